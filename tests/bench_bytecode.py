@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Measure transform_code_object() (disassemble, clean, assemble) on the code
+objects of real model code: every torch.nn.functional function and every
+torch.nn module forward(), plus torchvision models if installed:
+
+    python tests/bench_bytecode.py --repeat 5
+"""
+import argparse
+import inspect
+import time
+import types
+
+import torch
+
+from torchdynamo.bytecode_transformation import cleaned_instructions
+from torchdynamo.bytecode_transformation import transform_code_object
+
+
+def python_code(fn):
+    fn = inspect.unwrap(fn)
+    if isinstance(fn, types.FunctionType) and not inspect.isgeneratorfunction(fn):
+        return fn.__code__
+    return None
+
+
+def collect_code_objects():
+    modules = [torch.nn.functional, torch.nn.modules]
+    try:
+        import torchvision.models
+
+        modules.append(torchvision.models)
+    except ImportError:
+        pass
+
+    codes = dict()
+    for module in modules:
+        for name in dir(module):
+            value = getattr(module, name)
+            if isinstance(value, type) and issubclass(value, torch.nn.Module):
+                value = value.forward
+            code = python_code(value)
+            if code is not None:
+                codes[id(code)] = code
+    return list(codes.values())
+
+
+def timeit(fn, codes, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for code in codes:
+            fn(code)
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    codes = collect_code_objects()
+    instructions = sum(len(cleaned_instructions(code)) for code in codes)
+
+    def transform(code):
+        return transform_code_object(code, lambda instructions, options: None)
+
+    for name, fn in [
+        ("cleaned_instructions", cleaned_instructions),
+        ("transform_code_object", transform),
+    ]:
+        best = timeit(fn, codes, args.repeat)
+        print(
+            f"{name}: {len(codes)} code objects ({instructions} instructions) "
+            f"in {best * 1000:.1f}ms ({instructions / best:.0f} instructions/s, "
+            f"best of {args.repeat})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Measure how many bytecode instructions per second InstructionTranslator
+(and InliningInstructionTranslator) process:
+
+    python tests/bench_tracing.py --layers 1000 --repeat 5
+"""
+import argparse
+import dis
+import time
+
+import torch
+
+import torchdynamo
+from torchdynamo.testing import dummy_fx_compile
+
+
+def layer(x):
+    return torch.relu(x * 2 + 1)
+
+
+def make_model(layers):
+    body = "".join(f"    x = layer(x) + {i}\n" for i in range(layers))
+    scope = {"layer": layer, "torch": torch}
+    exec(f"def model(x):\n{body}    return x\n", scope)
+    return scope["model"]
+
+
+def count_instructions(fn, layers):
+    outer = len(list(dis.get_instructions(fn)))
+    inner = len(list(dis.get_instructions(layer)))
+    return outer + layers * inner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    model = make_model(args.layers)
+    instructions = count_instructions(model, args.layers)
+    x = torch.randn(8)
+    timings = []
+    for _ in range(args.repeat):
+        torchdynamo.reset()
+        t0 = time.perf_counter()
+        with torchdynamo.optimize(dummy_fx_compile):
+            model(x)
+        timings.append(time.perf_counter() - t0)
+    best = min(timings)
+    print(
+        f"{instructions} instructions traced in {best:.3f}s "
+        f"({instructions / best:.0f} instructions/s, best of {args.repeat})"
+    )
+
+
+if __name__ == "__main__":
+    main()
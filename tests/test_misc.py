@@ -4,10 +4,15 @@ import copy
 import dataclasses
 import dis
 import functools
+import json
 import math
+import os
 import sys
+import tempfile
+import threading
 import typing
 import unittest
+from unittest.mock import patch
 
 import numpy as np
 import torch
@@ -20,6 +25,32 @@ from torchdynamo.testing import same
 from torchdynamo.testing import unsupported
 
 mytuple = collections.namedtuple("mytuple", ["a", "b", "ab"])
+global_scale = 2
+
+
+def global_activation(x):
+    return x.relu()
+
+
+def global_scaled_activation(x, scale):
+    return global_activation(x) * scale + global_scale
+
+
+def global_grad_scale(p):
+    return p.grad * 2
+
+
+def global_positive(x):
+    return x[x > 0] + 1
+
+
+class GlobalScaleModule(torch.nn.Module):
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+
+    def forward(self, x):
+        return global_scaled_activation(x, self.scale)
 
 
 class MiscTests(torchdynamo.testing.TestCase):
@@ -1157,3 +1188,962 @@ class MiscTests(torchdynamo.testing.TestCase):
         inst = dis.get_instructions(fn)
         result = bytecode_transformation.assemble(inst, fn.__code__.co_firstlineno)
         self.assertTrue(result[1] == fn.__code__.co_lnotab)
+
+    @requires_static_shapes
+    def test_cache_many_shapes(self):
+        def fn(a, b):
+            return a.sin() + b
+
+        cnts = torchdynamo.testing.CompileCounter()
+        inputs = [(torch.randn(n, 4), torch.randn(n, 4)) for n in range(1, 21)]
+        with torchdynamo.optimize(cnts):
+            for args in inputs:
+                fn(*args)
+            self.assertEqual(cnts.frame_count, 20)
+            for args in reversed(inputs):
+                self.assertTrue(same(fn(*args), args[0].sin() + args[1]))
+        self.assertEqual(cnts.frame_count, 20)
+
+    @requires_static_shapes
+    @patch.object(torchdynamo.config, "cache_size_limit", 2)
+    def test_cache_lru_eviction(self):
+        def fn(a):
+            return a.cos() + 1
+
+        cnts = torchdynamo.testing.CompileCounter()
+        a, b, c = [torch.randn(n) for n in (2, 3, 4)]
+        with torchdynamo.optimize(cnts):
+            fn(a)
+            fn(b)
+            fn(a)  # hit, `a` is now most recently used
+            self.assertEqual(cnts.frame_count, 2)
+            fn(c)  # evicts `b` rather than falling back to eager
+            self.assertEqual(cnts.frame_count, 3)
+            fn(a)
+            self.assertEqual(cnts.frame_count, 3)
+            self.assertTrue(same(fn(b), b.cos() + 1))
+            self.assertEqual(cnts.frame_count, 4)
+        self.assertEqual(torchdynamo.utils.counters["frames"]["evicted"], 2)
+
+    def test_native_guards(self):
+        def fn(a, b, cfg):
+            if cfg["flag"] and b == 2:
+                return a + b
+            return a - b
+
+        cnts = torchdynamo.testing.CompileCounter()
+        x = torch.randn(4)
+        cfg = {"flag": True}
+        with torchdynamo.optimize(cnts):
+            self.assertTrue(same(fn(x, 2, cfg), x + 2))
+            self.assertTrue(same(fn(x, 2, cfg), x + 2))
+            self.assertEqual(cnts.frame_count, 1)
+            self.assertTrue(same(fn(x, 3, cfg), x - 3))
+            self.assertEqual(cnts.frame_count, 2)
+            cfg["other"] = 1
+            self.assertTrue(same(fn(x, 2, cfg), x + 2))
+            self.assertEqual(cnts.frame_count, 3)
+            with torch.no_grad():
+                self.assertTrue(same(fn(x, 2, cfg), x + 2))
+            self.assertEqual(cnts.frame_count, 4)
+
+    @patch.object(torchdynamo.config, "native_guards", False)
+    def test_python_guards(self):
+        self.test_native_guards()
+
+    @requires_static_shapes
+    def test_native_guards_shared(self):
+        def fn(a, b):
+            return torch.sigmoid(a) + b.training
+
+        cnts = torchdynamo.testing.CompileCounter()
+        mod = torch.nn.ReLU()
+        with torchdynamo.optimize(cnts):
+            fn(torch.randn(1), mod)
+            group = torchdynamo.guards.guard_groups[fn.__code__]
+            size = group.size()
+            for n in range(2, 6):
+                fn(torch.randn(n), mod)
+        self.assertEqual(cnts.frame_count, 5)
+        # every entry checks the same type/training guards on `b`
+        self.assertIs(torchdynamo.guards.guard_groups[fn.__code__], group)
+        self.assertEqual(group.size(), size)
+
+    def test_tensor_guards_check(self):
+        from torchdynamo._guards import TensorGuards
+
+        a = torch.randn(2, 3)
+        b = torch.randn(4)
+        guards = TensorGuards(a, b, dynamic_shapes=False)
+        self.assertTrue(guards.check(torch.zeros(2, 3), torch.zeros(4)))
+        self.assertFalse(guards.check(a.t(), b))
+        self.assertFalse(guards.check(a, b.double()))
+        self.assertFalse(guards.check(a, 1))
+        # more tensors than fit in the stack buffer
+        many = [torch.randn(i + 1) for i in range(12)]
+        guards = TensorGuards(*many, dynamic_shapes=False)
+        self.assertTrue(guards.check(*[x.clone() for x in many]))
+        self.assertFalse(guards.check(*many[:-1], many[0]))
+
+    @requires_static_shapes
+    @patch.object(torchdynamo.config, "profile_guards", True)
+    def test_guard_profiler(self):
+        from torchdynamo.guard_profiler import GuardProfiler
+
+        def fn(a):
+            return a + 1
+
+        profiler = GuardProfiler.instance
+        profiler.clear()
+        profiler.enable()
+        cnts = torchdynamo.testing.CompileCounter()
+        a, b = torch.randn(2), torch.randn(3)
+        try:
+            with torchdynamo.optimize(cnts):
+                fn(a)
+                fn(b)
+                fn(b)
+                fn(a)
+        finally:
+            profiler.disable()
+        stats = profiler.stats()[fn.__code__]
+        self.assertEqual(cnts.frame_count, 2)
+        self.assertEqual(stats.lookups, 4)
+        self.assertEqual(stats.misses, 2)
+        self.assertEqual(sum(stats.hit_depth.values()), 2)
+        self.assertEqual(len(stats.entries), 2)
+        self.assertEqual([entry.passes for entry in stats.entries], [1, 1])
+        self.assertEqual(profiler.to_json()[0]["name"], "fn")
+
+    def test_first_failing_guard_raises(self):
+        from torchdynamo.guard_profiler import first_failing_guard
+
+        def guard_fn(a, **kwargs):
+            return False
+
+        guard_fn.code_parts = ["a.size(0) == 2", "a.missing == 1", "False"]
+        guard_fn.closure_vars = {}
+        guard_fn.global_scope = {}
+        self.assertEqual(first_failing_guard(guard_fn, {"a": torch.randn(2)}), 1)
+
+    def test_global_guards_mutation(self):
+        global global_scale
+
+        def fn(a):
+            return global_activation(a) * global_scale
+
+        cnts = torchdynamo.testing.CompileCounter()
+        x = torch.randn(8)
+        try:
+            with torchdynamo.optimize(cnts):
+                self.assertTrue(same(fn(x), x.relu() * 2))
+                self.assertTrue(same(fn(x), x.relu() * 2))
+                self.assertEqual(cnts.frame_count, 1)
+                global_scale = 3
+                self.assertTrue(same(fn(x), x.relu() * 3))
+                self.assertTrue(same(fn(x), x.relu() * 3))
+                self.assertEqual(cnts.frame_count, 2)
+                global_scale = 2
+                self.assertTrue(same(fn(x), x.relu() * 2))
+                self.assertEqual(cnts.frame_count, 2)
+        finally:
+            global_scale = 2
+
+    @requires_static_shapes
+    @patch.object(torchdynamo.config, "ranged_shapes", "pow2")
+    def test_ranged_shapes_pow2(self):
+        def fn(a, b):
+            return (a + 1) * b
+
+        cnts = torchdynamo.testing.CompileCounter()
+        b = torch.randn(4)
+        with torchdynamo.optimize(cnts):
+            for n in (5, 6, 8, 7):
+                a = torch.randn(n, 4)
+                self.assertTrue(same(fn(a, b), (a + 1) * b))
+            self.assertEqual(cnts.frame_count, 1)
+            a = torch.randn(9, 4)
+            self.assertTrue(same(fn(a, b), (a + 1) * b))
+            self.assertEqual(cnts.frame_count, 2)
+            # only dim 0 may vary
+            a = torch.randn(8, 1)
+            self.assertTrue(same(fn(a, b), (a + 1) * b))
+            self.assertEqual(cnts.frame_count, 3)
+
+    @requires_static_shapes
+    @patch.object(torchdynamo.config, "ranged_shapes", "range")
+    def test_ranged_shapes_specialize(self):
+        def fn(a):
+            return a.view(a.size(0) // 2, -1) + 1
+
+        cnts = torchdynamo.testing.CompileCounter()
+        with torchdynamo.optimize(cnts):
+            for n in (4, 6, 4):
+                a = torch.randn(n, 3)
+                self.assertTrue(same(fn(a), a.view(n // 2, -1) + 1))
+        # reading a.size(0) while tracing keeps exact shape guards
+        self.assertEqual(cnts.frame_count, 2)
+
+    @requires_static_shapes
+    @patch.object(torchdynamo.config, "ranged_shapes", "range")
+    def test_ranged_shapes_backend(self):
+        def fn(a):
+            return a.cos()
+
+        shapes = []
+
+        def compiler_fn(gm, example_inputs):
+            shapes.append(example_inputs[0].shape)
+            return gm.forward
+
+        # not marked shape_polymorphic, so each size gets its own graph
+        with torchdynamo.optimize(compiler_fn):
+            for n in (3, 5, 3):
+                a = torch.randn(n)
+                self.assertTrue(same(fn(a), a.cos()))
+        self.assertEqual(shapes, [torch.Size([3]), torch.Size([5])])
+
+    @requires_static_shapes
+    @patch.object(torchdynamo.config, "ranged_shapes", "range")
+    @patch.object(torchdynamo.config, "ranged_shapes_dims", ())
+    def test_ranged_shapes_mark_dynamic(self):
+        def fn(a):
+            return a.cos()
+
+        cnts = torchdynamo.testing.CompileCounter()
+        with torchdynamo.optimize(cnts):
+            for n in (3, 5, 7):
+                a = torch.randn(2, n)
+                torchdynamo.mark_dynamic(a, 1)
+                self.assertTrue(same(fn(a), a.cos()))
+        self.assertEqual(cnts.frame_count, 1)
+
+    def test_threaded_compile(self):
+        def fn1(a):
+            return a.sin() + 1
+
+        def fn2(a):
+            return a.cos() - 1
+
+        cnts = torchdynamo.testing.CompileCounter()
+        x = torch.randn(10)
+        errors = []
+
+        def run(fn, expected):
+            try:
+                with torchdynamo.optimize(cnts):
+                    for _ in range(10):
+                        if not same(fn(x), expected):
+                            errors.append(fn)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=run, args=(fn, expected))
+            for fn, expected in [(fn1, x.sin() + 1), (fn2, x.cos() - 1)] * 4
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertGreaterEqual(cnts.frame_count, 2)
+
+    def test_concurrent_compile(self):
+        # each backend call waits for the other, so this only finishes if
+        # frames of different code are converted at the same time
+        barrier = threading.Barrier(2, timeout=30)
+        broken = []
+
+        def compiler_fn(gm, example_inputs):
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                broken.append(gm)
+            return gm.forward
+
+        def fn1(a):
+            return a.sin() + 1
+
+        def fn2(a):
+            return a.cos() - 1
+
+        x = torch.randn(10)
+        results = dict()
+
+        def run(fn):
+            with torchdynamo.optimize(compiler_fn):
+                results[fn] = fn(x)
+
+        threads = [threading.Thread(target=run, args=(fn,)) for fn in (fn1, fn2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(broken, [])
+        self.assertTrue(same(results[fn1], x.sin() + 1))
+        self.assertTrue(same(results[fn2], x.cos() - 1))
+
+    @patch.object(torchdynamo.config, "async_compile", True)
+    def test_async_compile(self):
+        from torchdynamo import async_compile
+
+        release = threading.Event()
+        compiled_calls = []
+
+        def compiler_fn(gm, example_inputs):
+            release.wait()
+
+            def compiled(*args):
+                compiled_calls.append(1)
+                return gm.forward(*args)
+
+            return compiled
+
+        def fn(a):
+            return a.sin() + 1
+
+        x = torch.randn(10)
+        counters = torchdynamo.utils.counters["async_compile"]
+        with torchdynamo.optimize(compiler_fn):
+            # runs the FX graph while the backend is busy
+            self.assertTrue(same(fn(x), x.sin() + 1))
+            self.assertEqual(compiled_calls, [])
+            self.assertEqual(counters["pending"], 1)
+            release.set()
+            async_compile.wait()
+            self.assertTrue(same(fn(x), x.sin() + 1))
+        self.assertEqual(compiled_calls, [1])
+        self.assertEqual(counters["pending"], 0)
+        self.assertEqual(counters["completed"], 1)
+
+    @patch.object(torchdynamo.config, "async_compile", True)
+    def test_async_compile_backend_error(self):
+        from torchdynamo import async_compile
+
+        grad_modes = []
+
+        def compiler_fn(gm, example_inputs):
+            grad_modes.append(torch.is_grad_enabled())
+            return None
+
+        def fn(a):
+            return a.sin() + 1
+
+        x = torch.randn(10)
+        counters = torchdynamo.utils.counters["async_compile"]
+        with torchdynamo.optimize(compiler_fn), torch.no_grad():
+            self.assertTrue(same(fn(x), x.sin() + 1))
+            async_compile.wait()
+            # keeps running the FX graph
+            self.assertTrue(same(fn(x), x.sin() + 1))
+        self.assertEqual(counters["completed"], 1)
+        self.assertEqual(counters["failed"], 0)
+        # compiled with the grad mode of the converted frame
+        self.assertEqual(grad_modes, [False])
+
+        torchdynamo.reset()
+        with patch.object(
+            torchdynamo.config, "raise_on_backend_error", True
+        ), torchdynamo.optimize(compiler_fn), torch.no_grad():
+            self.assertTrue(same(fn(x), x.sin() + 1))
+            async_compile.wait()
+        self.assertEqual(counters["failed"], 1)
+
+    @patch.object(torchdynamo.config, "async_compile", True)
+    def test_async_compile_mutating_backend(self):
+        from torchdynamo import async_compile
+
+        mod = torch.nn.Linear(10, 10)
+        mutated = threading.Event()
+        release = threading.Event()
+
+        def compiler_fn(gm, example_inputs):
+            gm.to(torch.float64)
+            mutated.set()
+            release.wait()
+            return gm.forward
+
+        def fn(a):
+            return mod(a).relu()
+
+        x = torch.randn(10)
+        ref = fn(x)
+        with torchdynamo.optimize(compiler_fn):
+            try:
+                fn(x)
+                mutated.wait()
+                # still runs the graph and modules it was traced with
+                self.assertTrue(same(fn(x), ref))
+            finally:
+                release.set()
+                async_compile.wait()
+
+    @unittest.skipIf(sys.version_info < (3, 8), "requires code.replace()")
+    def test_persistent_cache(self):
+        def fn(a, b):
+            x = a + b
+            x = unsupported(x, a)
+            return x.relu() * 2
+
+        a = torch.randn(10)
+        b = torch.randn(10)
+        counters = torchdynamo.utils.counters["persistent_cache"]
+        cnt = torchdynamo.testing.CompileCounter()
+        with tempfile.TemporaryDirectory() as cache_dir, patch.object(
+            torchdynamo.config, "persistent_cache_dir", cache_dir
+        ):
+            with torchdynamo.optimize(cnt):
+                ref = fn(a, b)
+            self.assertEqual(counters["saves"], 2)
+            self.assertEqual(cnt.frame_count, 2)
+
+            # only cache_dir survives, like in a new process
+            torchdynamo.reset()
+            with torchdynamo.optimize(cnt):
+                res = fn(a, b)
+            self.assertTrue(same(ref, res))
+            self.assertEqual(counters["hits"], 2)
+            self.assertEqual(counters["saves"], 2)
+            # the backend still runs for each loaded graph
+            self.assertEqual(cnt.frame_count, 4)
+            self.assertEqual(cnt.op_count, 6)
+
+    def test_persistent_cache_rng_state(self):
+        def fn(a):
+            return a + 1
+
+        def compiler_fn(gm, example_inputs):
+            # like a backend that benchmarks on random inputs
+            torch.randn(10)
+            return gm.forward
+
+        a = torch.randn(10)
+        counters = torchdynamo.utils.counters["persistent_cache"]
+        counters.clear()
+        with tempfile.TemporaryDirectory() as cache_dir, patch.object(
+            torchdynamo.config, "persistent_cache_dir", cache_dir
+        ):
+            with torchdynamo.optimize(compiler_fn):
+                fn(a)
+            torchdynamo.reset()
+            torch.manual_seed(0)
+            ref = torch.randn(10)
+            torch.manual_seed(0)
+            with torchdynamo.optimize(compiler_fn):
+                fn(a)
+            res = torch.randn(10)
+            self.assertEqual(counters["hits"], 1)
+            self.assertTrue(same(ref, res))
+
+    @unittest.skipIf(sys.version_info < (3, 8), "requires code.replace()")
+    def test_persistent_cache_invalidation(self):
+        def fn(mod, x):
+            return mod(x) + 1
+
+        x = torch.randn(10)
+        counters = torchdynamo.utils.counters["persistent_cache"]
+        counters.clear()
+        cnt = CompileCounter()
+        with tempfile.TemporaryDirectory() as cache_dir, patch.object(
+            torchdynamo.config, "persistent_cache_dir", cache_dir
+        ):
+            with torchdynamo.optimize(cnt):
+                fn(GlobalScaleModule(2), x)
+            self.assertEqual(counters["saves"], 1)
+
+            # a plain attribute, which repr(mod) doesn't show
+            torchdynamo.reset()
+            mod = GlobalScaleModule(3)
+            with torchdynamo.optimize(cnt):
+                res = fn(mod, x)
+            self.assertTrue(same(res, mod(x) + 1))
+            self.assertEqual(counters["hits"], 0)
+            self.assertEqual(counters["saves"], 2)
+
+            # the code of a function inlined by mod.forward()
+            torchdynamo.reset()
+            with patch.object(
+                global_activation, "__code__", (lambda x: x.sigmoid()).__code__
+            ):
+                with torchdynamo.optimize(cnt):
+                    res = fn(mod, x)
+                self.assertTrue(same(res, mod(x) + 1))
+            self.assertEqual(counters["hits"], 0)
+            self.assertEqual(counters["saves"], 3)
+
+            torchdynamo.reset()
+            with torchdynamo.optimize(cnt):
+                res = fn(mod, x)
+            self.assertTrue(same(res, mod(x) + 1))
+            self.assertEqual(counters["hits"], 1)
+
+    def test_dispatch_table(self):
+        from torchdynamo.symbolic_convert import InliningInstructionTranslator
+        from torchdynamo.symbolic_convert import InstructionTranslator
+
+        for cls in (InstructionTranslator, InliningInstructionTranslator):
+            table = cls.dispatch_table
+            self.assertEqual(len(table), len(dis.opname))
+            self.assertIs(table[dis.opmap["LOAD_FAST"]], cls.LOAD_FAST)
+            self.assertIs(table[dis.opmap["RETURN_VALUE"]], cls.RETURN_VALUE)
+        self.assertIsNot(
+            InstructionTranslator.dispatch_table[dis.opmap["RETURN_VALUE"]],
+            InliningInstructionTranslator.dispatch_table[dis.opmap["RETURN_VALUE"]],
+        )
+        # unsupported opcodes fail when reached, not when the table is built
+        missing = dis.opmap["YIELD_VALUE"]
+        self.assertFalse(hasattr(InstructionTranslator, "YIELD_VALUE"))
+        with self.assertRaises(torchdynamo.exc.Unsupported):
+            InstructionTranslator.dispatch_table[missing](None, None)
+
+    def test_graphstate_checkpoints(self):
+        def fn(a, b):
+            x = a + b
+            for _ in range(3):
+                x = x * 2
+            x = unsupported(x, a)
+            return x - 1
+
+        a = torch.randn(10)
+        b = torch.randn(10)
+        ref = fn(a, b)
+        cnts = torchdynamo.testing.CompileCounter()
+        with torchdynamo.optimize(cnts):
+            res = fn(a, b)
+        self.assertTrue(same(ref, res))
+        self.assertEqual(cnts.frame_count, 2)
+        self.assertEqual(cnts.op_count, 5)
+
+    def test_output_graph_restore(self):
+        from torchdynamo.output_graph import CheckpointedGraph
+        from torchdynamo.output_graph import GuardSet
+        from torchdynamo.side_effects import SideEffects
+
+        graph = CheckpointedGraph()
+        x = graph.placeholder("x")
+        outer = graph.checkpoint()
+        y = graph.call_function(torch.relu, (x,))
+        inner = graph.checkpoint()
+        graph.call_function(torch.sin, (y,))
+        graph.restore(inner)
+        self.assertEqual([n.op for n in graph.nodes], ["placeholder", "call_function"])
+        graph.restore(outer)
+        self.assertEqual(list(graph.nodes), [x])
+
+        guards = GuardSet()
+        guards.update({1, 2})
+        checkpoint = guards.checkpoint()
+        guards.update({2, 3})
+        guards.add(4)
+        guards.restore(checkpoint)
+        self.assertEqual(guards, {1, 2})
+
+        side_effects = SideEffects()
+        side_effects.keepalive.append(1)
+        snapshot = side_effects.checkpoint()
+        side_effects.copy_on_write()
+        side_effects.keepalive.append(2)
+        self.assertEqual(snapshot.keepalive, [1])
+        self.assertEqual(side_effects.keepalive, [1, 2])
+
+    def test_variable_tracker_sharing(self):
+        from torchdynamo.variables import ConstantVariable
+        from torchdynamo.variables import ListVariable
+        from torchdynamo.variables.base import MutableLocal
+        from torchdynamo.variables.base import VariableTracker
+
+        guards = {"guard"}
+        a = ConstantVariable(1, guards=guards)
+        b = ConstantVariable(2)
+        lst = ListVariable([a, b], mutable_local=MutableLocal())
+        self.assertIsInstance(a.guards, frozenset)
+        self.assertIs(VariableTracker.propagate(a, b)["guards"], a.guards)
+        self.assertIs(a.add_guards(guards), a)
+
+        stack = [lst, a]
+        self.assertIs(VariableTracker.apply(lambda v: v, stack), stack)
+
+        c = ConstantVariable(3)
+        result = VariableTracker.apply(lambda v: c if v is b else v, stack)
+        self.assertIsNot(result[0], lst)
+        self.assertIs(result[0].items[0], a)
+        self.assertIs(result[0].items[1], c)
+        self.assertIs(result[1], a)
+
+    @patch.object(torchdynamo.config, "profile_compile", True)
+    def test_compile_profiler(self):
+        from torchdynamo.compile_profiler import CompileProfiler
+
+        def fn(a, b):
+            return (a + b).relu() * 2
+
+        profiler = CompileProfiler.instance
+        profiler.clear()
+        cnt = CompileCounter()
+        with torchdynamo.optimize_assert(cnt):
+            fn(torch.randn(10), torch.randn(10))
+        self.assertEqual(cnt.frame_count, 1)
+
+        code = fn.__code__
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        regions = profiler.code_stats[key]
+        self.assertEqual(regions[("convert_frame",)].calls, 1)
+        paths = list(regions.keys())
+        self.assertTrue(any(path[-1] == "run" for path in paths))
+        self.assertTrue(any(path[-1] == "backend_compile" for path in paths))
+        for stats in regions.values():
+            self.assertLessEqual(stats.self_seconds, stats.seconds + 1e-6)
+        self.assertIn("convert_frame", profiler.totals())
+        self.assertIn(code.co_name, profiler.report())
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as fd:
+            profiler.dump_chrome_trace(fd.name)
+            with open(fd.name) as trace_file:
+                events = json.load(trace_file)["traceEvents"]
+        self.assertTrue(events)
+        self.assertTrue(all(event["ph"] == "X" for event in events))
+        profiler.clear()
+
+    @patch.object(torchdynamo.config, "meta_propagation", True)
+    def test_meta_propagation(self):
+        from torchdynamo.variables.tensor import TensorVariable
+
+        mod = torch.nn.Sequential(torch.nn.Linear(10, 20), torch.nn.ReLU())
+        weight = mod[0].weight.detach().clone()
+
+        def fn(x):
+            y = mod(x.to(torch.float64).float())
+            a, b = torch.split(y, 10, dim=1)
+            # data dependent shapes, from ops without meta kernels
+            nonzero = a.nonzero()
+            return (
+                (a * b).t().contiguous() + x.size(0),
+                nonzero.size(0),
+                nonzero.size(1),
+                x[x > 0].size(0),
+            )
+
+        x = torch.randn(4, 10)
+        ref = fn(x)
+        counters = torchdynamo.utils.counters["meta_propagation"]
+        counters.clear()
+        cnt = CompileCounter()
+        with torchdynamo.optimize_assert(cnt):
+            res = fn(x)
+        self.assertTrue(same(ref, res))
+        self.assertEqual(res[1:], ref[1:])
+        self.assertEqual(cnt.frame_count, 1)
+        self.assertGreater(counters["ok"], 0)
+        # the parameters were never copied or modified
+        self.assertTrue(same(mod[0].weight, weight))
+
+        tensor = torch.randn(2, 3).t()
+        meta = torchdynamo.utils.to_meta(tensor)
+        self.assertEqual(meta.device.type, "meta")
+        self.assertEqual(meta.stride(), tensor.stride())
+        self.assertEqual(torchdynamo.utils.fake_device(meta), tensor.device)
+        self.assertEqual(
+            TensorVariable.specialize(meta), TensorVariable.specialize(tensor)
+        )
+
+    def test_nn_module_propagation_copies(self):
+        from torchdynamo.optimizations.analysis import may_mutate_state
+
+        linear = torch.nn.Linear(10, 10)
+        bn = torch.nn.BatchNorm1d(10)
+        self.assertFalse(may_mutate_state(linear))
+        self.assertTrue(may_mutate_state(bn))
+        self.assertFalse(may_mutate_state(bn.eval()))
+        bn.train()
+
+        def fn(x):
+            return bn(linear(x))
+
+        x = torch.randn(4, 10)
+        ref_bn = copy.deepcopy(bn)
+        ref = ref_bn(linear(x))
+        counters = torchdynamo.utils.counters["stats"]
+        counters["nn_module_copies"] = 0
+        with torchdynamo.optimize_assert(CompileCounter()):
+            res = fn(x)
+        self.assertTrue(same(ref, res))
+        # tracing must not update the running stats a second time
+        self.assertTrue(same(bn.running_mean, ref_bn.running_mean))
+        self.assertEqual(counters["nn_module_copies"], 1)
+
+    def test_livevars(self):
+        from torchdynamo.bytecode_analysis import cached_livevars
+        from torchdynamo.bytecode_analysis import livevars_analysis
+
+        def fn(a, b, c):
+            x = a + 1
+            if b:
+                y = x + c
+            else:
+                y = c
+            return y
+
+        code = fn.__code__
+        instructions = bytecode_transformation.cleaned_instructions(code)
+        live = cached_livevars(code, instructions)
+        self.assertEqual(live[0], {"a", "b", "c"})
+        self.assertEqual(live[-2], {"y"})
+        self.assertEqual(live[-1], set())
+        # computed once per code object
+        instructions = bytecode_transformation.cleaned_instructions(code)
+        self.assertIs(cached_livevars(code, instructions), live)
+        for inst, names in zip(instructions, live):
+            self.assertEqual(livevars_analysis(instructions, inst), names)
+
+    def test_assemble_extended_args(self):
+        body = "".join(f"        x = x + {i}\n" for i in range(300))
+        scope = {}
+        exec(f"def fn(x):\n    if x > 0:\n{body}    return x\n", scope)
+        fn = scope["fn"]
+
+        code = fn.__code__
+        opnames = {inst.opname for inst in dis.get_instructions(code)}
+        self.assertIn("EXTENDED_ARG", opnames)
+        # assembles to the same bytes as the python compiler
+        bytecode_transformation.debug_checks(code)
+        fn.__code__ = bytecode_transformation.transform_code_object(
+            code, lambda instructions, options: None
+        )
+        self.assertEqual(fn(1), 1 + sum(range(300)))
+        self.assertEqual(fn(-1), -1)
+
+    @requires_static_shapes
+    def test_resume_function_sharing(self):
+        from torchdynamo.resume_execution import ContinueExecutionCache
+
+        def fn(a, b):
+            x = a + 1
+            y = b + 1
+            x = unsupported(x, y)
+            return x + y
+
+        counters = torchdynamo.utils.counters["resume_fns"]
+        counters.clear()
+        cnt = CompileCounter()
+        for n in (2, 3):
+            a, b = torch.randn(n), torch.randn(n)
+            ref = fn(a, b)
+            with torchdynamo.optimize(cnt):
+                res = fn(a, b)
+            self.assertTrue(same(ref, res))
+        self.assertEqual(counters["generated"], 1)
+        self.assertEqual(counters["reused"], 1)
+        self.assertEqual(len(ContinueExecutionCache.cache[fn.__code__]), 1)
+
+    def test_torch_object_index(self):
+        from torchdynamo import allowed_functions
+
+        def fn(x):
+            return x
+
+        walked = allowed_functions._walk_torch_objects()
+        index = allowed_functions.TorchObjectIndex(walked)
+        self.assertIsNotNone(index.lookup(torch.nn.functional.relu))
+        self.assertIsNone(index.lookup(fn))
+        self.assertFalse(index.pending)
+        self.assertEqual(index.ids, allowed_functions._allowed_function_ids())
+
+        # lookups from several threads while modules are being resolved
+        index = allowed_functions.TorchObjectIndex(walked)
+        objs = [torch.add, torch.nn.functional.relu, torch.nn.Linear, math.sqrt, fn]
+        ids = allowed_functions._allowed_function_ids()
+        outputs = [[] for _ in range(4)]
+        threads = [
+            threading.Thread(target=lambda out=out: out.extend(map(index.lookup, objs)))
+            for out in outputs
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for out in outputs:
+            self.assertEqual(out, [ids.get(id(obj)) for obj in objs])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.object(torchdynamo.config, "persistent_cache_dir", cache_dir):
+                path = allowed_functions._index_path()
+                self.assertEqual(allowed_functions._load_index(), walked)
+                self.assertTrue(os.path.exists(path))
+                # read back from disk
+                index = allowed_functions.TorchObjectIndex(
+                    allowed_functions._load_index()
+                )
+                ids = allowed_functions._allowed_function_ids()
+                self.assertEqual(index.lookup(torch.add), ids[id(torch.add)])
+                self.assertEqual(index.resolve_all(), ids)
+
+    def test_skip_filename(self):
+        from torchdynamo import skipfiles
+
+        self.assertTrue(skipfiles.check(copy.__file__))
+        self.assertFalse(skipfiles.check(__file__))
+
+        # new code objects from a skipped file never reach the callback
+        scope = {}
+        filename = skipfiles.SKIP_DIRS[-1] + "generated.py"
+        counter = CompileCounter()
+        try:
+            exec(compile("def fn(x):\n    return x + 1\n", filename, "exec"), scope)
+            self.assertTrue(skipfiles.check(filename))
+            with torchdynamo.optimize(counter):
+                scope["fn"](torch.ones(1))
+            exec(compile("def fn(x):\n    return x + 2\n", filename, "exec"), scope)
+            with patch.object(
+                skipfiles, "check", side_effect=AssertionError("called")
+            ), torchdynamo.optimize(counter):
+                scope["fn"](torch.ones(1))
+            self.assertEqual(counter.frame_count, 0)
+
+            # until the skipped files are forgotten
+            torchdynamo.reset()
+            exec(compile("def fn(x):\n    return x + 3\n", filename, "exec"), scope)
+            with patch.object(
+                skipfiles, "check", return_value=True
+            ) as check, torchdynamo.optimize(counter):
+                scope["fn"](torch.ones(1))
+            self.assertTrue(check.called)
+
+            skipfiles.add_allowlist(filename)
+            self.assertFalse(skipfiles.check(filename))
+            # changing the allowlist directly also drops cached results
+            skipfiles.FILENAME_ALLOWLIST.discard(filename)
+            self.assertTrue(skipfiles.check(filename))
+        finally:
+            skipfiles.FILENAME_ALLOWLIST.discard(filename)
+
+    def test_inline_cache(self):
+        def fn(a, b, c):
+            x = global_scaled_activation(a, 2)
+            y = global_scaled_activation(b, 2)
+            z = global_scaled_activation(c, 3)
+            w = global_scaled_activation(a, 2)
+            return x + y + z + w
+
+        args = [torch.randn(10) for _ in range(3)]
+        ref = fn(*args)
+        results = []
+        for cache_inline_calls in (False, True):
+            torchdynamo.reset()
+            counters = torchdynamo.utils.counters["inline_cache"]
+            counters.clear()
+            cnt = CompileCounter()
+            with patch.object(
+                torchdynamo.config, "cache_inline_calls", cache_inline_calls
+            ), torchdynamo.optimize_assert(cnt):
+                res = fn(*args)
+            self.assertTrue(same(ref, res))
+            results.append((cnt.frame_count, cnt.op_count))
+
+        self.assertEqual(results[0], results[1])
+        # the outer call is recorded once per distinct scale, the
+        # inner global_activation() once in total
+        self.assertEqual(counters["miss"], 3)
+        self.assertEqual(counters["hit"], 3)
+
+    def test_inline_cache_new_inputs(self):
+        def fn(a, b):
+            return global_grad_scale(a) + global_grad_scale(b)
+
+        a = torch.nn.Parameter(torch.randn(10))
+        b = torch.nn.Parameter(torch.randn(10))
+        a.grad = torch.randn(10)
+        b.grad = torch.randn(10)
+        ref = fn(a, b)
+        torchdynamo.utils.counters["inline_cache"].clear()
+        cnt = CompileCounter()
+        with torchdynamo.optimize_assert(cnt):
+            res = fn(a, b)
+        self.assertTrue(same(ref, res))
+        # `p.grad` adds a graph input for the source of p, so neither
+        # call may be replayed for the other parameter
+        self.assertEqual(torchdynamo.utils.counters["inline_cache"]["hit"], 0)
+        self.assertEqual(torchdynamo.utils.counters["inline_cache"]["uncacheable"], 2)
+
+    def test_inline_cache_data_dependent(self):
+        def fn(a, b):
+            x = global_positive(a)
+            y = global_positive(b)
+            return x.sum() + y.sum(), x.size(0), y.size(0)
+
+        a = torch.tensor([1.0, -1.0, 2.0, -2.0])
+        b = torch.tensor([1.0, 2.0, 3.0, -1.0])
+        ref = fn(a, b)
+        torchdynamo.utils.counters["inline_cache"].clear()
+        with patch.object(torchdynamo.config, "cache_inline_calls", True):
+            with torchdynamo.optimize(CompileCounter()):
+                res = fn(a, b)
+        self.assertTrue(same(ref, res))
+        self.assertEqual(torchdynamo.utils.counters["inline_cache"]["hit"], 0)
+
+    def test_inline_cache_grad_mode(self):
+        def fn(a):
+            with torch.no_grad():
+                x = global_activation(a)
+            y = global_activation(a)
+            return x + 1, y + 1
+
+        a = torch.randn(10, requires_grad=True)
+        torchdynamo.utils.counters["inline_cache"].clear()
+        with patch.object(torchdynamo.config, "cache_inline_calls", True):
+            with torchdynamo.optimize(CompileCounter()):
+                x, y = fn(a)
+        self.assertFalse(x.requires_grad)
+        self.assertTrue(y.requires_grad)
+        self.assertEqual(torchdynamo.utils.counters["inline_cache"]["hit"], 0)
+
+    def test_lazy_rng_state(self):
+        def add(a, b):
+            return a + b
+
+        def fn(x):
+            return torch.nn.functional.dropout(x, 0.5, True) + 1
+
+        x = torch.randn(10)
+        torch.manual_seed(0)
+        ref = fn(x)
+        cnt = CompileCounter()
+        with patch.object(
+            torch.random, "get_rng_state", wraps=torch.random.get_rng_state
+        ) as get_rng_state:
+            with torchdynamo.optimize_assert(cnt):
+                self.assertEqual(add(1, 2), 3)
+            # no op ran, so the RNG state was never cloned
+            self.assertEqual(get_rng_state.call_count, 0)
+
+            torch.manual_seed(0)
+            with torchdynamo.optimize_assert(cnt):
+                res = fn(x)
+            self.assertGreater(get_rng_state.call_count, 0)
+        # tracing doesn't change the random numbers the graph sees
+        self.assertTrue(same(ref, res))
+        self.assertEqual(cnt.frame_count, 1)
+
+    def test_cache_unsupported(self):
+        def fn(x, flag):
+            if flag:
+                try:
+                    return x.view(-1, 7)
+                except RuntimeError:
+                    return x - 1
+            return x + 1
+
+        x = torch.randn(10)
+        counters = torchdynamo.utils.counters["unsupported_frames"]
+        counters.clear()
+        cnt = CompileCounter()
+        with torchdynamo.optimize(cnt):
+            self.assertTrue(same(fn(x, False), x + 1))
+            # fails while tracing the view(), but keeps the compiled entry
+            for _ in range(3):
+                self.assertTrue(same(fn(x, True), x - 1))
+            self.assertTrue(same(fn(x, False), x + 1))
+        self.assertEqual(cnt.frame_count, 1)
+        self.assertEqual(counters["cached"], 1)
+        self.assertEqual(counters["retries_avoided"], 2)
+        self.assertEqual(counters["skipped"], 0)
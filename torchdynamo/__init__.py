@@ -1,5 +1,6 @@
 from . import convert_frame
 from . import resume_execution
+from . import skipfiles
 from .eval_frame import disable
 from .eval_frame import optimize
 from .eval_frame import optimize_assert
@@ -15,6 +16,7 @@ __all__ = [
     "reset",
     "list_backends",
     "skip",
+    "mark_dynamic",
 ]
 
 
@@ -25,6 +27,17 @@ def reset():
     convert_frame.input_codes.clear()
     convert_frame.output_codes.clear()
     resume_execution.ContinueExecutionCache.cache.clear()
+    skipfiles.clear_cache()
+
+
+def mark_dynamic(tensor, *dims):
+    """
+    Allow `dims` of an input tensor to vary without recompiling when
+    config.ranged_shapes is set (in addition to config.ranged_shapes_dims)
+    """
+    tensor._torchdynamo_dynamic_dims = (
+        tuple(getattr(tensor, "_torchdynamo_dynamic_dims", ())) + dims
+    )
 
 
 def list_backends():
@@ -55,8 +55,11 @@
 
 static PyObject *noargs = NULL;     /* cached empty tuple */
 static PyObject *dotzerokey = NULL; /* ".0" */
+/* co_filename of code skipfiles.check() rejected, see skip_filename() */
+static PyObject *skip_filenames = NULL;
 static PyObject *guard_fail_hook = NULL;
 static PyObject *guard_error_hook = NULL;
+static PyObject *guard_profile_hook = NULL;
 
 size_t extra_index = -1;
 
@@ -167,35 +170,233 @@ static inline PyObject *call_callback(PyObject *callable, PyObject *frame,
   return result;
 }
 
+// number of hash buckets used to index the CacheEntrys of a code object
+#define CACHE_NUM_BUCKETS 16
+
+// Optional discriminator provided by _guards.cpp, see set_signature_hash()
+typedef Py_hash_t (*signature_hash_fn_t)(PyObject *);
+static signature_hash_fn_t signature_hash_fn = NULL;
+
+// Optional callback provided by _guards.cpp, see set_guard_lookup()
+typedef void (*guard_lookup_fn_t)(PyObject *);
+static guard_lookup_fn_t guard_lookup_fn = NULL;
+
 typedef struct cache_entry {
   // check the guards: lambda: <locals of user function>: bool
   PyObject *check_fn;
   // modified user bytecode (protected by check_fn's guards)
   PyCodeObject *code;
-  // on a cache miss, linked list of next thing to try
+  // discriminator of the locals check_fn was generated for
+  Py_hash_t key;
+  // true if this entry lives in CacheRoot.buckets, else CacheRoot.unkeyed
+  bool keyed;
+  // next entry in the same bucket (or in CacheRoot.unkeyed)
+  struct cache_entry *bucket_next;
+  // doubly linked list of all entries of a code object, most recently hit
+  // first, used for LRU eviction (next links CacheRoot.graveyard once dead)
+  struct cache_entry *prev;
   struct cache_entry *next;
+  // evicted while another thread was walking the cache
+  bool dead;
 } CacheEntry;
 
-static CacheEntry *create_cache_entry(CacheEntry *next,
-                                      PyObject *guarded_code) {
+typedef struct cache_root {
+  // tuple of local names hashed to compute CacheEntry.key
+  PyObject *key_names;
+  // keyed entries, indexed by key % CACHE_NUM_BUCKETS
+  CacheEntry *buckets[CACHE_NUM_BUCKETS];
+  // entries guarded on different locals than key_names, always checked
+  CacheEntry *unkeyed;
+  // all entries, most recently hit first
+  CacheEntry *entries;
+  // least recently hit entry, the tail of entries
+  CacheEntry *lru;
+  long size;
+  // number of lookup()s in progress, check_fn may release the GIL and let
+  // other threads add/evict entries in the middle of a lookup
+  long walkers;
+  // entries evicted while walkers > 0, freed when the last lookup finishes
+  CacheEntry *graveyard;
+} CacheRoot;
+
+inline static Py_hash_t signature_hash(PyObject *obj) {
+  if (signature_hash_fn != NULL) {
+    return signature_hash_fn(obj);
+  }
+  return (Py_hash_t)Py_TYPE(obj);
+}
+
+static Py_hash_t compute_cache_key(PyObject *key_names, PyObject *f_locals) {
+  // combine the signatures of the guarded locals, similar to tuplehash()
+  Py_uhash_t key = 0x345678UL;
+  Py_ssize_t len = PyTuple_GET_SIZE(key_names);
+  for (Py_ssize_t i = 0; i < len; ++i) {
+    PyObject *value = PyDict_GetItem(f_locals, PyTuple_GET_ITEM(key_names, i));
+    Py_uhash_t h = (value == NULL) ? 0 : (Py_uhash_t)signature_hash(value);
+    key = (key ^ h) * 1000003UL;
+  }
+  return (Py_hash_t)key;
+}
+
+inline static CacheEntry **cache_bucket(CacheRoot *root, Py_hash_t key) {
+  return &root->buckets[(Py_uhash_t)key % CACHE_NUM_BUCKETS];
+}
+
+inline static CacheEntry **cache_chain(CacheRoot *root, CacheEntry *e) {
+  return e->keyed ? cache_bucket(root, e->key) : &root->unkeyed;
+}
+
+inline static void recency_unlink(CacheRoot *root, CacheEntry *e) {
+  if (e->prev != NULL) {
+    e->prev->next = e->next;
+  } else {
+    root->entries = e->next;
+  }
+  if (e->next != NULL) {
+    e->next->prev = e->prev;
+  } else {
+    root->lru = e->prev;
+  }
+}
+
+inline static void recency_push_front(CacheRoot *root, CacheEntry *e) {
+  e->prev = NULL;
+  e->next = root->entries;
+  if (root->entries != NULL) {
+    root->entries->prev = e;
+  } else {
+    root->lru = e;
+  }
+  root->entries = e;
+}
+
+static void touch_cache_entry(CacheRoot *root, CacheEntry *e,
+                              CacheEntry **link) {
+  // move a hit entry to the front of its chain (link points at e) and
+  // of the recency list, so hot entries are checked first next time
+  CacheEntry **head = cache_chain(root, e);
+  if (*link != e) {
+    // the chain changed while check_fn ran
+    link = head;
+    while (*link != e) {
+      link = &(*link)->bucket_next;
+    }
+  }
+  if (link != head) {
+    *link = e->bucket_next;
+    e->bucket_next = *head;
+    *head = e;
+  }
+  if (root->entries != e) {
+    recency_unlink(root, e);
+    recency_push_front(root, e);
+  }
+}
+
+static CacheRoot *create_cache_root(void) {
+  CacheRoot *root = (CacheRoot *)calloc(1, sizeof(CacheRoot));
+  NULL_CHECK(root);
+  return root;
+}
+
+static CacheEntry *create_cache_entry(CacheRoot *root, PyObject *guarded_code,
+                                      PyObject *f_locals) {
   CacheEntry *e = (CacheEntry *)malloc(sizeof(CacheEntry));
   DEBUG_NULL_CHECK(e);
   e->check_fn = PyObject_GetAttrString(guarded_code, "check_fn");
   NULL_CHECK(e->check_fn);
   e->code = (PyCodeObject *)PyObject_GetAttrString(guarded_code, "code");
   NULL_CHECK(e->code);
-  e->next = next;
+  e->key = 0;
+  e->keyed = false;
+  e->dead = false;
+
+  // entries are only bucketed if they guard on the same locals as the first
+  // bucketed entry, otherwise the key would not be a necessary condition
+  PyObject *key_names = PyObject_GetAttrString(guarded_code, "cache_key_names");
+  if (key_names == NULL) {
+    PyErr_Clear();
+  } else if (PyTuple_CheckExact(key_names) &&
+             PyTuple_GET_SIZE(key_names) > 0) {
+    if (root->key_names == NULL) {
+      Py_INCREF(key_names);
+      root->key_names = key_names;
+    }
+    int same = PyObject_RichCompareBool(key_names, root->key_names, Py_EQ);
+    if (same < 0) {
+      PyErr_Clear();
+    }
+    e->keyed = (same == 1);
+  }
+  Py_XDECREF(key_names);
+
+  if (e->keyed) {
+    e->key = compute_cache_key(root->key_names, f_locals);
+    CacheEntry **bucket = cache_bucket(root, e->key);
+    e->bucket_next = *bucket;
+    *bucket = e;
+  } else {
+    e->bucket_next = root->unkeyed;
+    root->unkeyed = e;
+  }
+  recency_push_front(root, e);
+  root->size++;
   return e;
 }
 
-static void destroy_cache_entry(CacheEntry *e) {
-  if (e == NULL || e == SKIP_CODE) {
+static PyCodeObject *evict_lru_cache_entry(CacheRoot *root) {
+  // remove the least recently hit entry, returns its (owned) code
+  CacheEntry *e = root->lru;
+  if (e == NULL) {
+    return NULL;
+  }
+  recency_unlink(root, e);
+  CacheEntry **link = cache_chain(root, e);
+  while (*link != e) {
+    link = &(*link)->bucket_next;
+  }
+  *link = e->bucket_next;
+  root->size--;
+  PyCodeObject *code = e->code;
+  e->code = NULL;
+  if (root->walkers > 0) {
+    // another thread may be running e->check_fn or hold a link into e
+    e->dead = true;
+    e->next = root->graveyard;
+    root->graveyard = e;
+  } else {
+    Py_XDECREF(e->check_fn);
+    free(e);
+  }
+  return code;
+}
+
+static void free_graveyard(CacheRoot *root) {
+  CacheEntry *e = root->graveyard;
+  root->graveyard = NULL;
+  while (e != NULL) {
+    CacheEntry *next = e->next;
+    Py_XDECREF(e->check_fn);
+    free(e);
+    e = next;
+  }
+}
+
+static void destroy_cache_root(CacheRoot *root) {
+  if (root == NULL || root == SKIP_CODE) {
     return;
   }
-  Py_XDECREF(e->check_fn);
-  Py_XDECREF(e->code);
-  destroy_cache_entry(e->next);
-  free(e);
+  CacheEntry *e = root->entries;
+  while (e != NULL) {
+    CacheEntry *next = e->next;
+    Py_XDECREF(e->check_fn);
+    Py_XDECREF(e->code);
+    free(e);
+    e = next;
+  }
+  free_graveyard(root);
+  Py_XDECREF(root->key_names);
+  free(root);
 }
 
 #ifdef TORCHDYNAMO_DEBUG
@@ -206,10 +407,10 @@ inline static const char *name(PyFrameObject *frame) {
 #endif
 
 static void call_guard_fail_hook(PyObject *hook, CacheEntry *e,
-                                 PyObject *f_locals) {
+                                 PyObject *f_locals, bool last) {
   // call debugging logic when a guard fails
   PyObject *args = PyTuple_Pack(4, e->check_fn, e->code, f_locals,
-                                (e->next == NULL ? Py_True : Py_False));
+                                (last ? Py_True : Py_False));
   NULL_CHECK(args);
   PyObject *result = PyObject_CallObject(hook, args);
   NULL_CHECK(result);
@@ -217,11 +418,8 @@ static void call_guard_fail_hook(PyObject *hook, CacheEntry *e,
   Py_DECREF(args);
 }
 
-static PyCodeObject *lookup(CacheEntry *e, PyObject *f_locals) {
-  if (e == NULL) {
-    return NULL;
-  }
-  PyObject *dotzero = PyDict_GetItem(f_locals, dotzerokey);
+static bool check_cache_entry(CacheEntry *e, PyObject *f_locals,
+                              PyObject *dotzero, bool last) {
   PyObject *valid = NULL;
   if (unlikely(dotzero != NULL)) {
     // .0 is a special variable name used for implicit args
@@ -235,34 +433,111 @@ static PyCodeObject *lookup(CacheEntry *e, PyObject *f_locals) {
   if (unlikely(valid == NULL)) {
     PyErr_Print();
     if (guard_error_hook != NULL) {
-      call_guard_fail_hook(guard_error_hook, e, f_locals);
+      call_guard_fail_hook(guard_error_hook, e, f_locals, last);
     }
     NULL_CHECK(valid);
   }
   Py_DECREF(valid);
   if (valid == Py_True) {
-    return e->code;
+    return true;
   }
   if (unlikely(guard_fail_hook != NULL)) {
-    call_guard_fail_hook(guard_fail_hook, e, f_locals);
+    call_guard_fail_hook(guard_fail_hook, e, f_locals, last);
   }
-  return lookup(e->next, f_locals);
+  return false;
 }
 
-static long cache_size(CacheEntry *e) {
-  if (e == NULL) {
+inline static CacheEntry **next_in_bucket(CacheEntry **link, Py_hash_t key) {
+  // skip entries that share a bucket but have a different key
+  while (*link != NULL && (*link)->key != key) {
+    link = &(*link)->bucket_next;
+  }
+  return link;
+}
+
+static PyCodeObject *lookup_entry(CacheRoot *root, PyObject *f_locals,
+                                  long *index) {
+  // *index is set to the number of entries checked before the hit
+  PyObject *dotzero = PyDict_GetItem(f_locals, dotzerokey);
+  if (root->key_names != NULL) {
+    // only entries compiled for locals with the same signature can match
+    Py_hash_t key = compute_cache_key(root->key_names, f_locals);
+    CacheEntry **link = next_in_bucket(cache_bucket(root, key), key);
+    while (*link != NULL) {
+      CacheEntry *e = *link;
+      CacheEntry **next = next_in_bucket(&e->bucket_next, key);
+      bool last = (*next == NULL && root->unkeyed == NULL);
+      ++*index;
+      if (check_cache_entry(e, f_locals, dotzero, last)) {
+        if (unlikely(e->dead)) {
+          return NULL;
+        }
+        touch_cache_entry(root, e, link);
+        return e->code;
+      }
+      link = next;
+    }
+  }
+  for (CacheEntry **link = &root->unkeyed; *link != NULL;
+       link = &(*link)->bucket_next) {
+    CacheEntry *e = *link;
+    ++*index;
+    if (check_cache_entry(e, f_locals, dotzero, e->bucket_next == NULL)) {
+      if (unlikely(e->dead)) {
+        return NULL;
+      }
+      touch_cache_entry(root, e, link);
+      return e->code;
+    }
+  }
+  return NULL;
+}
+
+static void call_guard_profile_hook(PyCodeObject *code, long index) {
+  // report which cache entry (or -1 for a miss) a frame was served by
+  PyObject *result =
+      PyObject_CallFunction(guard_profile_hook, "Ol", code, index);
+  NULL_CHECK(result);
+  Py_DECREF(result);
+}
+
+static PyCodeObject *lookup(CacheRoot *root, PyFrameObject *frame) {
+  if (root == NULL) {
+    return NULL;
+  }
+  long index = -1;
+  root->walkers++;
+  if (guard_lookup_fn != NULL) {
+    // lets guards shared between cache entries be evaluated once per frame
+    guard_lookup_fn(frame->f_locals);
+  }
+  PyCodeObject *cached_code = lookup_entry(root, frame->f_locals, &index);
+  if (guard_lookup_fn != NULL) {
+    guard_lookup_fn(NULL);
+  }
+  if (--root->walkers == 0 && root->graveyard != NULL) {
+    free_graveyard(root);
+  }
+  if (unlikely(guard_profile_hook != NULL)) {
+    call_guard_profile_hook(frame->f_code, cached_code ? index : -1);
+  }
+  return cached_code;
+}
+
+static long cache_size(CacheRoot *root) {
+  if (root == NULL) {
     return 0;
   }
-  return 1 + cache_size(e->next);
+  return root->size;
 }
 
-inline static CacheEntry *get_extra(PyCodeObject *code) {
-  CacheEntry *extra = NULL;
+inline static CacheRoot *get_extra(PyCodeObject *code) {
+  CacheRoot *extra = NULL;
   _PyCode_GetExtra((PyObject *)code, extra_index, (void *)&extra);
   return extra;
 }
 
-inline static void set_extra(PyCodeObject *code, CacheEntry *extra) {
+inline static void set_extra(PyCodeObject *code, CacheRoot *extra) {
   // TODO(jansel): would it be faster to bypass this?
   _PyCode_SetExtra((PyObject *)code, extra_index, extra);
 }
@@ -315,11 +590,23 @@ static PyObject *_custom_eval_frame(PyThreadState *tstate, PyFrameObject *frame,
   DEBUG_TRACE("begin %s %s %i %i %i %i", name(frame),
               PyUnicode_AsUTF8(frame->f_code->co_filename), frame->f_lineno,
               frame->f_lasti, frame->f_iblock, frame->f_executing);
-  CacheEntry *extra = get_extra(frame->f_code);
+  CacheRoot *extra = get_extra(frame->f_code);
   if (extra == SKIP_CODE) {
     DEBUG_TRACE("skip %s", name(frame));
     return eval_frame_default(tstate, frame, throw_flag);
   }
+  if (extra == NULL && PySet_GET_SIZE(skip_filenames) > 0) {
+    // new code from a skipped file, mark it without calling the callback
+    int skip = PySet_Contains(skip_filenames, frame->f_code->co_filename);
+    if (skip < 0) {
+      return NULL;
+    }
+    if (skip) {
+      DEBUG_TRACE("skip file %s", name(frame));
+      set_extra(frame->f_code, SKIP_CODE);
+      return eval_frame_default(tstate, frame, throw_flag);
+    }
+  }
   if (PyFrame_FastToLocalsWithError(frame) < 0) {
     DEBUG_TRACE("error %s", name(frame));
     return NULL;
@@ -332,7 +619,7 @@ static PyObject *_custom_eval_frame(PyThreadState *tstate, PyFrameObject *frame,
   PyObject *callback = eval_frame_callback_get();
   disable_eval_frame(tstate);
 
-  PyCodeObject *cached_code = lookup(extra, frame->f_locals);
+  PyCodeObject *cached_code = lookup(extra, frame);
   if (cached_code != NULL) {
     // used cached version
     DEBUG_TRACE("cache hit %s", name(frame));
@@ -348,13 +635,30 @@ static PyObject *_custom_eval_frame(PyThreadState *tstate, PyFrameObject *frame,
     // this is useful for debugging -- but we dont want it to happen outside of
     // testing
     return NULL;
+  }
+  // the callback may have let other threads change the cache of this code
+  extra = get_extra(frame->f_code);
+  if (result == Py_False) {
+    // another thread just compiled this code, use its entry if it matches
+    // or run the frame normally this time without skipping it forever
+    DEBUG_TRACE("retry %s", name(frame));
+    Py_DECREF(result);
+    cached_code = (extra == SKIP_CODE) ? NULL : lookup(extra, frame);
+    enable_eval_frame(tstate);
+    if (cached_code != NULL) {
+      return eval_custom_code(tstate, frame, cached_code, throw_flag);
+    }
+    return eval_frame_default(tstate, frame, throw_flag);
   } else if (result != Py_None) {
     DEBUG_TRACE("create cache %s", name(frame));
-    extra = create_cache_entry(extra, result);
+    if (extra == NULL || extra == SKIP_CODE) {
+      extra = create_cache_root();
+      set_extra(frame->f_code, extra);
+    }
+    CacheEntry *entry = create_cache_entry(extra, result, frame->f_locals);
     Py_DECREF(result);
-    set_extra(frame->f_code, extra);
     enable_eval_frame(tstate);
-    return eval_custom_code(tstate, frame, extra->code, throw_flag);
+    return eval_custom_code(tstate, frame, entry->code, throw_flag);
   } else {
     DEBUG_TRACE("create skip %s", name(frame));
     Py_DECREF(result);
@@ -369,7 +673,7 @@ static PyObject *_custom_eval_frame_run_only(PyThreadState *tstate,
                                              int throw_flag) {
   // do not dynamically compile anything, just reuse prior compiles
   DEBUG_TRACE("begin %s", name(frame));
-  CacheEntry *extra = get_extra(frame->f_code);
+  CacheRoot *extra = get_extra(frame->f_code);
   if (extra == SKIP_CODE || extra == NULL) {
     DEBUG_TRACE("skip %s", name(frame));
     return eval_frame_default(tstate, frame, throw_flag);
@@ -379,7 +683,7 @@ static PyObject *_custom_eval_frame_run_only(PyThreadState *tstate,
     DEBUG_TRACE("error %s", name(frame));
     return NULL;
   }
-  PyCodeObject *cached_code = lookup(extra, frame->f_locals);
+  PyCodeObject *cached_code = lookup(extra, frame);
   if (cached_code != NULL) {
     // used cached version
     DEBUG_TRACE("cache hit %s", name(frame));
@@ -467,7 +771,7 @@ static PyObject *reset_code(PyObject *dummy, PyObject *args) {
     return NULL;
   }
 
-  destroy_cache_entry(get_extra((PyCodeObject *)code));
+  destroy_cache_root(get_extra((PyCodeObject *)code));
   set_extra((PyCodeObject *)code, NULL);
   Py_RETURN_NONE;
 }
@@ -496,6 +800,26 @@ static PyObject *skip_code(PyObject *dummy, PyObject *args) {
   Py_RETURN_NONE;
 }
 
+static PyObject *skip_filename(PyObject *dummy, PyObject *args) {
+  // code objects with this co_filename get skip_code() on first entry
+  PyObject *filename = NULL;
+  if (!PyArg_ParseTuple(args, "U", &filename)) {
+    return NULL;
+  }
+  if (PySet_Add(skip_filenames, filename) < 0) {
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
+static PyObject *clear_skip_filenames(PyObject *dummy, PyObject *args) {
+  // after SKIP_DIRS or FILENAME_ALLOWLIST in skipfiles.py changed
+  if (PySet_Clear(skip_filenames) < 0) {
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
 static PyObject *set_guard_fail_hook(PyObject *dummy, PyObject *args) {
   PyObject *obj = NULL;
   if (!PyArg_ParseTuple(args, "O", &obj)) {
@@ -526,13 +850,96 @@ static PyObject *set_guard_error_hook(PyObject *dummy, PyObject *args) {
   Py_RETURN_NONE;
 }
 
+static PyObject *set_guard_profile_hook(PyObject *dummy, PyObject *args) {
+  PyObject *obj = NULL;
+  if (!PyArg_ParseTuple(args, "O", &obj)) {
+    return NULL;
+  }
+  Py_XDECREF(guard_profile_hook);
+  if (obj == Py_None) {
+    guard_profile_hook = NULL;
+  } else {
+    guard_profile_hook = obj;
+    Py_INCREF(guard_profile_hook);
+  }
+  Py_RETURN_NONE;
+}
+
+static PyObject *set_signature_hash(PyObject *dummy, PyObject *args) {
+  // install the discriminator used to bucket cache entries, see _guards.cpp
+  PyObject *obj = NULL;
+  if (!PyArg_ParseTuple(args, "O", &obj)) {
+    return NULL;
+  }
+  if (obj == Py_None) {
+    signature_hash_fn = NULL;
+    Py_RETURN_NONE;
+  }
+  void *fn = PyCapsule_GetPointer(obj, "torchdynamo._guards.signature_hash");
+  if (fn == NULL) {
+    return NULL;
+  }
+  signature_hash_fn = (signature_hash_fn_t)fn;
+  Py_RETURN_NONE;
+}
+
+static PyObject *set_guard_lookup(PyObject *dummy, PyObject *args) {
+  // install the callback run before (with f_locals) and after (with NULL)
+  // checking the cache entries of a frame
+  PyObject *obj = NULL;
+  if (!PyArg_ParseTuple(args, "O", &obj)) {
+    return NULL;
+  }
+  if (obj == Py_None) {
+    guard_lookup_fn = NULL;
+    Py_RETURN_NONE;
+  }
+  void *fn =
+      PyCapsule_GetPointer(obj, "torchdynamo._guards.guard_lookup");
+  if (fn == NULL) {
+    return NULL;
+  }
+  guard_lookup_fn = (guard_lookup_fn_t)fn;
+  Py_RETURN_NONE;
+}
+
+static PyObject *evict_lru(PyObject *dummy, PyObject *args) {
+  // drop the least recently used cache entry of a code object and return
+  // its guarded code (or None) so the caller can release it
+  PyObject *code = NULL;
+  if (!PyArg_ParseTuple(args, "O:code", &code)) {
+    DEBUG_TRACE0("arg error");
+    return NULL;
+  }
+  if (!PyCode_Check(code)) {
+    DEBUG_TRACE0("arg error");
+    PyErr_SetString(PyExc_TypeError, "expected a code object");
+    return NULL;
+  }
+  CacheRoot *root = get_extra((PyCodeObject *)code);
+  if (root == NULL || root == SKIP_CODE) {
+    Py_RETURN_NONE;
+  }
+  PyCodeObject *evicted = evict_lru_cache_entry(root);
+  if (evicted == NULL) {
+    Py_RETURN_NONE;
+  }
+  return (PyObject *)evicted;
+}
+
 static PyMethodDef _methods[] = {
     {"set_eval_frame", set_eval_frame_py, METH_VARARGS, NULL},
     {"reset_code", reset_code, METH_VARARGS, NULL},
     {"unsupported", unsupported, METH_VARARGS, NULL},
     {"skip_code", skip_code, METH_VARARGS, NULL},
+    {"skip_filename", skip_filename, METH_VARARGS, NULL},
+    {"clear_skip_filenames", clear_skip_filenames, METH_VARARGS, NULL},
     {"set_guard_fail_hook", set_guard_fail_hook, METH_VARARGS, NULL},
     {"set_guard_error_hook", set_guard_error_hook, METH_VARARGS, NULL},
+    {"set_guard_profile_hook", set_guard_profile_hook, METH_VARARGS, NULL},
+    {"set_signature_hash", set_signature_hash, METH_VARARGS, NULL},
+    {"set_guard_lookup", set_guard_lookup, METH_VARARGS, NULL},
+    {"evict_lru", evict_lru, METH_VARARGS, NULL},
     {NULL, NULL, 0, NULL}};
 
 static struct PyModuleDef _module = {
@@ -553,5 +960,6 @@ PyMODINIT_FUNC PyInit__eval_frame(void) {
 
   noargs = PyTuple_New(0);
   dotzerokey = PyUnicode_InternFromString(".0");
+  skip_filenames = PySet_New(NULL);
   return PyModule_Create(&_module);
 }
@@ -2,6 +2,8 @@
 #include <Python.h>
 #include <torch/extension.h>
 
+#include <deque>
+
 namespace {
 
 struct LocalState {
@@ -18,69 +20,148 @@ struct LocalState {
         grad_mode_enabled(at::GradMode::is_enabled()) {}
 };
 
-class TensorCheck {
-public:
-  TensorCheck(const LocalState &state, PyTypeObject *pt, const at::Tensor &v,
-              bool dynamic_shapes)
-      : pytype(pt), dispatch_key_(state.apply(v.key_set()).raw_repr()),
-        dtype_(v.dtype().toScalarType()),
-        requires_grad_(state.grad_mode_enabled && v.requires_grad()),
-        dynamic_shapes_(dynamic_shapes) {
-    auto ndim = v.ndimension();
-    const auto &sizes = v.sizes();
-    const auto &strides = v.strides();
-    sizes_.reserve(ndim);
-    strides_.reserve(ndim);
-    for (int i = 0; i < ndim; ++i) {
-      sizes_.emplace_back(sizes[i]);
-      strides_.emplace_back(strides[i]);
-    }
-  }
-
-  bool check(const LocalState &state, const at::Tensor &v) {
-    if (dispatch_key_ != state.apply(v.key_set()).raw_repr() ||
-        dtype_ != v.dtype().toScalarType() ||
-        requires_grad_ != (state.grad_mode_enabled && v.requires_grad())) {
+// Per tensor metadata is packed into one contiguous int64 buffer as
+//   [dispatch_key, dtype, requires_grad, ndim, sizes..., strides...]
+// (sizes/strides are omitted with dynamic_shapes) so checking a tensor is a
+// memcmp() of its header followed by memcmp()s of its sizes and strides.
+// Tensors given ranges are packed as [header, (min, max) per dim...] and
+// must be contiguous with every size in its range.
+constexpr size_t kTensorHeaderSize = 4;
+
+static void pack_tensor_header(const LocalState &state, const at::Tensor &v,
+                               int64_t *out) {
+  out[0] = static_cast<int64_t>(state.apply(v.key_set()).raw_repr());
+  out[1] = static_cast<int64_t>(v.dtype().toScalarType());
+  out[2] = state.grad_mode_enabled && v.requires_grad();
+  out[3] = v.ndimension();
+}
+
+static bool is_tensor(PyObject *obj) {
+  return THPVariable_CheckExact(obj) || THPVariable_Check(obj);
+}
+
+struct TensorGuardsData {
+  std::vector<PyTypeObject *> pytypes;
+  std::vector<int64_t> packed;
+  // per tensor, true if its sizes are packed as ranges
+  std::vector<bool> ranged;
+  bool dynamic_shapes = false;
+
+  // `ranges` is None or a sequence of (min, max) for each dim
+  bool add(const LocalState &state, PyObject *item, PyObject *ranges) {
+    const at::Tensor &v = THPVariable_Unpack(item);
+    pytypes.emplace_back(Py_TYPE(item));
+    size_t pos = packed.size();
+    packed.resize(pos + kTensorHeaderSize);
+    pack_tensor_header(state, v, packed.data() + pos);
+    ranged.emplace_back(!dynamic_shapes && ranges != Py_None);
+    if (ranged.back()) {
+      return add_ranges(v, ranges);
+    }
+    if (!dynamic_shapes) {
+      const auto &sizes = v.sizes();
+      const auto &strides = v.strides();
+      packed.insert(packed.end(), sizes.begin(), sizes.end());
+      packed.insert(packed.end(), strides.begin(), strides.end());
+    }
+    return true;
+  }
+
+  bool add_ranges(const at::Tensor &v, PyObject *ranges) {
+    PyObject *seq = PySequence_Fast(ranges, "expected a sequence of ranges");
+    if (seq == NULL) {
       return false;
     }
-    size_t ndim = static_cast<size_t>(v.ndimension());
-    if (ndim != sizes_.size()) {
+    if (PySequence_Fast_GET_SIZE(seq) != v.ndimension() ||
+        !v.is_contiguous()) {
+      Py_DECREF(seq);
+      PyErr_SetString(PyExc_ValueError,
+                      "ranges need one (min, max) per dim of a contiguous "
+                      "tensor");
       return false;
     }
-    if (!dynamic_shapes_) {
-      const auto &sizes = v.sizes();
-      const auto &strides = v.strides();
-      for (size_t i = 0; i < ndim; ++i) {
-        if (sizes_[i] != sizes[i] || strides_[i] != strides[i]) {
+    for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(seq); ++i) {
+      int64_t lo, hi;
+      if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(seq, i), "LL", &lo,
+                            &hi)) {
+        Py_DECREF(seq);
+        return false;
+      }
+      packed.emplace_back(lo);
+      packed.emplace_back(hi);
+    }
+    Py_DECREF(seq);
+    return true;
+  }
+
+  // `headers` holds pack_tensor_header() of each of `tensors`, which must
+  // already be known to be Tensors of the right count
+  bool check(PyObject *tensors, const int64_t *headers) const {
+    const int64_t *expected = packed.data();
+    size_t len = pytypes.size();
+    for (size_t i = 0; i < len; ++i) {
+      PyObject *item = PyTuple_GET_ITEM(tensors, i);
+      const int64_t *header = headers + i * kTensorHeaderSize;
+      if (Py_TYPE(item) != pytypes[i] ||
+          memcmp(expected, header, kTensorHeaderSize * sizeof(int64_t)) != 0) {
+        return false;
+      }
+      expected += kTensorHeaderSize;
+      if (ranged[i]) {
+        const at::Tensor &v = THPVariable_Unpack(item);
+        const auto &sizes = v.sizes();
+        for (int64_t d = 0; d < header[3]; ++d) {
+          if (sizes[d] < expected[2 * d] || sizes[d] > expected[2 * d + 1]) {
+            return false;
+          }
+        }
+        if (!v.is_contiguous()) {
+          return false;
+        }
+        expected += 2 * header[3];
+      } else if (!dynamic_shapes) {
+        const at::Tensor &v = THPVariable_Unpack(item);
+        size_t nbytes = header[3] * sizeof(int64_t);
+        if (nbytes != 0 &&
+            (memcmp(expected, v.sizes().data(), nbytes) != 0 ||
+             memcmp(expected + header[3], v.strides().data(), nbytes) != 0)) {
           return false;
         }
+        expected += 2 * header[3];
       }
     }
     return true;
   }
-
-  PyTypeObject *pytype;
-
-private:
-  uint64_t dispatch_key_; // DispatchKeySet includes device/layout
-  at::ScalarType dtype_;
-  bool requires_grad_;
-  bool dynamic_shapes_;
-  std::vector<int64_t> sizes_;
-  std::vector<int64_t> strides_;
 };
 
-typedef std::vector<TensorCheck> ChecksList;
+// headers of up to this many tensors are packed on the stack
+constexpr size_t kStackTensors = 8;
+
+// pack the headers of `tensors` into `headers`, which has room for all of
+// them, returns false if any item is not a Tensor
+static bool pack_tensor_headers(const LocalState &state, PyObject *tensors,
+                                int64_t *headers) {
+  ssize_t len = PyTuple_GET_SIZE(tensors);
+  for (ssize_t i = 0; i < len; ++i) {
+    PyObject *item = PyTuple_GET_ITEM(tensors, i);
+    if (!is_tensor(item)) {
+      return false;
+    }
+    pack_tensor_header(state, THPVariable_Unpack(item),
+                       headers + i * kTensorHeaderSize);
+  }
+  return true;
+}
 
 typedef struct {
   PyObject_HEAD;
-  ChecksList *checks;
+  TensorGuardsData *data;
 } TensorGuards;
 
 static void TensorGuards_dealloc(TensorGuards *self) {
-  if (self->checks != NULL) {
-    delete self->checks;
-    self->checks = NULL;
+  if (self->data != NULL) {
+    delete self->data;
+    self->data = NULL;
   }
   Py_TYPE(self)->tp_free((PyObject *)self);
 }
@@ -89,7 +170,7 @@ static PyObject *TensorGuards_new(PyTypeObject *type, PyObject *args,
                                   PyObject *kwds) {
   TensorGuards *self = (TensorGuards *)type->tp_alloc(type, 0);
   if (self != NULL) {
-    self->checks = new ChecksList();
+    self->data = new TensorGuardsData();
   }
   return (PyObject *)self;
 }
@@ -105,20 +186,31 @@ static int TensorGuards_init(TensorGuards *self, PyObject *args,
     PyErr_SetString(PyExc_TypeError, "missing dynamic_shapes=...");
     return -1;
   }
-  bool dynamic_shapes = PyObject_IsTrue(dynamic_shapes_py);
+  auto &data = *self->data;
+  data.dynamic_shapes = PyObject_IsTrue(dynamic_shapes_py);
 
-  auto &checks = *self->checks;
   ssize_t len = PyTuple_GET_SIZE(args);
-  checks.reserve(len);
+  // optional ranges=[None or ((min, max), ...) for each tensor]
+  PyObject *ranges = PyDict_GetItemString(kwds, "ranges");
+  if (ranges != NULL && ranges != Py_None &&
+      (!PyList_Check(ranges) || PyList_GET_SIZE(ranges) != len)) {
+    PyErr_SetString(PyExc_TypeError, "expected one ranges=[...] per tensor");
+    return -1;
+  }
+  data.pytypes.reserve(len);
   LocalState state;
   for (ssize_t i = 0; i < len; ++i) {
     PyObject *item = PyTuple_GET_ITEM(args, i);
-    if (!THPVariable_CheckExact(item) && !THPVariable_Check(item)) {
+    if (!is_tensor(item)) {
       PyErr_SetString(PyExc_TypeError, "expected Tensor()");
       return -1;
     }
-    checks.emplace_back(TensorCheck(state, Py_TYPE(item),
-                                    THPVariable_Unpack(item), dynamic_shapes));
+    PyObject *item_ranges = (ranges != NULL && ranges != Py_None)
+                                ? PyList_GET_ITEM(ranges, i)
+                                : Py_None;
+    if (!data.add(state, item, item_ranges)) {
+      return -1;
+    }
   }
   return 0;
 }
@@ -128,26 +220,26 @@ PyObject *TensorGuards_check(TensorGuards *self, PyObject *args) {
     PyErr_SetString(PyExc_TypeError, "expected tuple()");
     return NULL;
   }
-  auto &checks = *self->checks;
+  auto &data = *self->data;
   ssize_t len = PyTuple_GET_SIZE(args);
 
-  if (static_cast<ssize_t>(checks.size()) != len) {
+  if (static_cast<ssize_t>(data.pytypes.size()) != len) {
     PyErr_SetString(PyExc_TypeError, "wrong length");
     return NULL;
   }
 
   LocalState state;
-
-  for (ssize_t i = 0; i < len; ++i) {
-    PyObject *item = PyTuple_GET_ITEM(args, i);
-    if (Py_TYPE(item) != checks[i].pytype) {
-      Py_RETURN_FALSE;
-    }
-    if (!checks[i].check(state, THPVariable_Unpack(item))) {
-      Py_RETURN_FALSE;
-    }
+  int64_t stack_headers[kStackTensors * kTensorHeaderSize];
+  std::vector<int64_t> heap_headers;
+  int64_t *headers = stack_headers;
+  if (static_cast<size_t>(len) > kStackTensors) {
+    heap_headers.resize(len * kTensorHeaderSize);
+    headers = heap_headers.data();
+  }
+  if (!pack_tensor_headers(state, args, headers) ||
+      !data.check(args, headers)) {
+    Py_RETURN_FALSE;
   }
-
   Py_RETURN_TRUE;
 }
 
@@ -160,6 +252,630 @@ static PyTypeObject TensorGuardsType = {
     // NOLINTNEXTLINE
     PyVarObject_HEAD_INIT(NULL, 0)};
 
+enum class GuardKind { TYPE_MATCH, ID_MATCH, EQUALS_MATCH, DICT_KEYS, GRAD_MODE };
+
+struct GuardPath {
+  // a local/global name followed by zero or more attribute lookups
+  bool is_global = false;
+  PyObject *root = NULL;
+  std::vector<PyObject *> attrs;
+
+  bool init(PyObject *global_flag, PyObject *path) {
+    if (!PyTuple_CheckExact(path) || PyTuple_GET_SIZE(path) < 1) {
+      PyErr_SetString(PyExc_TypeError, "expected non-empty tuple path");
+      return false;
+    }
+    is_global = PyObject_IsTrue(global_flag);
+    root = PyTuple_GET_ITEM(path, 0);
+    Py_INCREF(root);
+    for (ssize_t i = 1; i < PyTuple_GET_SIZE(path); ++i) {
+      PyObject *attr = PyTuple_GET_ITEM(path, i);
+      Py_INCREF(attr);
+      attrs.emplace_back(attr);
+    }
+    return true;
+  }
+
+  void release() {
+    Py_CLEAR(root);
+    for (auto &attr : attrs) {
+      Py_CLEAR(attr);
+    }
+    attrs.clear();
+  }
+
+  // returns a new reference, or NULL (without an exception set) if the
+  // value can't be found which is treated as a guard failure
+  PyObject *resolve(PyObject *f_locals, PyObject *f_globals) const {
+    PyObject *scope = is_global ? f_globals : f_locals;
+    if (scope == NULL) {
+      return NULL;
+    }
+    PyObject *obj = PyDict_GetItem(scope, root);
+    if (obj == NULL) {
+      return NULL;
+    }
+    Py_INCREF(obj);
+    for (PyObject *attr : attrs) {
+      PyObject *next = PyObject_GetAttr(obj, attr);
+      Py_DECREF(obj);
+      if (next == NULL) {
+        PyErr_Clear();
+        return NULL;
+      }
+      obj = next;
+    }
+    return obj;
+  }
+};
+
+#if PY_VERSION_HEX < 0x030C0000
+// PEP 509 dict versions let results of guards on globals be reused until
+// one of the dicts they were read from is mutated
+#define TORCHDYNAMO_DICT_VERSIONS
+#endif
+
+struct DictVersion {
+  PyObject *dict; // owned
+  uint64_t version;
+};
+
+static bool is_immutable_constant(PyObject *obj) {
+  if (PyTuple_CheckExact(obj)) {
+    for (Py_ssize_t i = 0; i < PyTuple_GET_SIZE(obj); ++i) {
+      if (!is_immutable_constant(PyTuple_GET_ITEM(obj, i))) {
+        return false;
+      }
+    }
+    return true;
+  }
+  return obj == Py_None || PyBool_Check(obj) || PyLong_CheckExact(obj) ||
+         PyFloat_CheckExact(obj) || PyUnicode_CheckExact(obj);
+}
+
+struct NativeCheck {
+  GuardKind kind;
+  GuardPath path;
+  // id() for TYPE_MATCH/ID_MATCH, matching the ids in the python guards
+  unsigned long expected_id = 0;
+  // owned value for EQUALS_MATCH/DICT_KEYS/GRAD_MODE
+  PyObject *expected = NULL;
+  // dicts the cached result of a global check was computed from
+  std::vector<DictVersion> versions;
+  bool cached = false;
+  int cached_result = 0;
+
+  void release() {
+    path.release();
+    Py_CLEAR(expected);
+    clear_cache();
+  }
+
+  static void release_versions(std::vector<DictVersion> &dicts) {
+    for (auto &v : dicts) {
+      Py_CLEAR(v.dict);
+    }
+    dicts.clear();
+  }
+
+  void clear_cache() {
+    release_versions(versions);
+    cached = false;
+  }
+
+  // 1 if the guard passes, 0 if it fails, -1 on error
+  int check(PyObject *f_locals, PyObject *f_globals) {
+    if (kind == GuardKind::GRAD_MODE) {
+      return at::GradMode::is_enabled() == (expected == Py_True);
+    }
+#ifdef TORCHDYNAMO_DICT_VERSIONS
+    if (path.is_global) {
+      return check_global(f_globals);
+    }
+#endif
+    PyObject *obj = path.resolve(f_locals, f_globals);
+    if (obj == NULL) {
+      return 0;
+    }
+    int result = check_value(obj);
+    Py_DECREF(obj);
+    return result;
+  }
+
+#ifdef TORCHDYNAMO_DICT_VERSIONS
+  static uint64_t dict_version(PyObject *dict) {
+    return ((PyDictObject *)dict)->ma_version_tag;
+  }
+
+  static void add_version(std::vector<DictVersion> &dicts, PyObject *dict) {
+    Py_INCREF(dict);
+    dicts.emplace_back(DictVersion{dict, dict_version(dict)});
+  }
+
+  int check_global(PyObject *f_globals) {
+    if (cached) {
+      bool unchanged = true;
+      for (const auto &v : versions) {
+        if (dict_version(v.dict) != v.version) {
+          unchanged = false;
+          break;
+        }
+      }
+      if (unchanged) {
+        return cached_result;
+      }
+      clear_cache();
+    }
+    // the result only depends on the dicts we read if every step of the
+    // path is a dict lookup in the globals or a module's __dict__.  They
+    // are only installed in `versions` once the result is known, since
+    // resolve() may run python and let another thread check this guard.
+    std::vector<DictVersion> read;
+    PyObject *found = NULL;
+    if (f_globals != NULL) {
+      add_version(read, f_globals);
+      found = PyDict_GetItem(f_globals, path.root);
+      for (size_t i = 0; found != NULL && i < path.attrs.size(); ++i) {
+        if (!PyModule_CheckExact(found)) {
+          found = NULL;
+          break;
+        }
+        PyObject *dict = PyModule_GetDict(found);
+        add_version(read, dict);
+        found = PyDict_GetItem(dict, path.attrs[i]);
+      }
+    }
+    PyObject *obj = path.resolve(NULL, f_globals);
+    if (obj == NULL) {
+      release_versions(read);
+      return 0;
+    }
+    int result = check_value(obj);
+    if (result >= 0 && obj == found && value_is_stable(obj)) {
+      if (kind == GuardKind::DICT_KEYS) {
+        add_version(read, obj);
+      }
+      clear_cache();
+      versions.swap(read);
+      cached = true;
+      cached_result = result;
+    }
+    release_versions(read);
+    Py_DECREF(obj);
+    return result;
+  }
+
+  bool value_is_stable(PyObject *obj) const {
+    // can check_value(obj) change without one of `versions` changing?
+    switch (kind) {
+    case GuardKind::ID_MATCH:
+      return true;
+    case GuardKind::TYPE_MATCH:
+      // __class__ can only be reassigned on heap types and modules
+      return !(Py_TYPE(obj)->tp_flags & Py_TPFLAGS_HEAPTYPE) &&
+             !PyModule_Check(obj);
+    case GuardKind::EQUALS_MATCH:
+      return is_immutable_constant(obj);
+    case GuardKind::DICT_KEYS:
+      return PyDict_CheckExact(obj);
+    case GuardKind::GRAD_MODE:
+      return false;
+    }
+    return false;
+  }
+#endif
+
+  int check_value(PyObject *obj) const {
+    int result = 0;
+    switch (kind) {
+    case GuardKind::TYPE_MATCH:
+      result = Py_TYPE(obj) == (void *)expected_id;
+      break;
+    case GuardKind::ID_MATCH:
+      result = obj == (void *)expected_id;
+      break;
+    case GuardKind::EQUALS_MATCH:
+      result = PyObject_RichCompareBool(obj, expected, Py_EQ);
+      break;
+    case GuardKind::DICT_KEYS:
+      result = check_dict_keys(obj);
+      break;
+    case GuardKind::GRAD_MODE:
+      break;
+    }
+    return result;
+  }
+
+  int check_dict_keys(PyObject *obj) const {
+    // faster `obj.keys() == expected` for a dict and a frozenset of keys
+    if (!PyDict_Check(obj) || PyDict_Size(obj) != PySet_GET_SIZE(expected)) {
+      return 0;
+    }
+    PyObject *iter = PyObject_GetIter(expected);
+    if (iter == NULL) {
+      return -1;
+    }
+    int result = 1;
+    PyObject *key;
+    while (result == 1 && (key = PyIter_Next(iter)) != NULL) {
+      result = PyDict_Contains(obj, key);
+      Py_DECREF(key);
+    }
+    Py_DECREF(iter);
+    if (PyErr_Occurred()) {
+      return -1;
+    }
+    return result;
+  }
+};
+
+static bool parse_guard_kind(PyObject *name, GuardKind *kind) {
+  const char *str = PyUnicode_AsUTF8(name);
+  if (str == NULL) {
+    return false;
+  }
+  std::string s(str);
+  if (s == "TYPE_MATCH") {
+    *kind = GuardKind::TYPE_MATCH;
+  } else if (s == "ID_MATCH") {
+    *kind = GuardKind::ID_MATCH;
+  } else if (s == "EQUALS_MATCH") {
+    *kind = GuardKind::EQUALS_MATCH;
+  } else if (s == "DICT_KEYS") {
+    *kind = GuardKind::DICT_KEYS;
+  } else if (s == "GRAD_MODE") {
+    *kind = GuardKind::GRAD_MODE;
+  } else {
+    PyErr_Format(PyExc_ValueError, "unknown native guard %s", str);
+    return false;
+  }
+  return true;
+}
+
+// source of guard_epoch values, unique across threads (guarded by the GIL)
+static uint64_t last_guard_epoch = 0;
+// a new epoch once per frame before _eval_frame.c starts checking its cache
+// entries and on every check_fn call from python, so GuardGroup results are
+// never reused across frames.  Per thread, as several threads may be
+// checking the cache entries of the same code at once.
+static thread_local uint64_t guard_epoch = 0;
+// f_locals of the frame whose cache entries this thread is checking, or NULL
+static thread_local PyObject *guard_lookup_locals = NULL;
+
+// called by _eval_frame.c with f_locals before checking the cache entries of
+// a frame and with NULL once it is done
+static void guard_lookup(PyObject *f_locals) {
+  guard_epoch = ++last_guard_epoch;
+  guard_lookup_locals = f_locals;
+}
+
+enum class CheckResult : int8_t { UNKNOWN, PASS, FAIL };
+
+typedef struct {
+  PyObject_HEAD;
+  PyObject *dict;
+  // every GuardEvaluator in the group uses this as its global scope
+  PyObject *global_scope;
+  // deduplicated native checks for all cache entries of one code object,
+  // a deque so add() from a converting thread never moves a check that
+  // another thread is evaluating
+  std::deque<NativeCheck> *checks;
+  // results of checks for the frame currently being looked up
+  std::deque<CheckResult> *results;
+  uint64_t epoch;
+  // f_locals of the frame the results belong to, only compared by address
+  PyObject *locals;
+} GuardGroup;
+
+static int GuardGroup_traverse(GuardGroup *self, visitproc visit, void *arg) {
+  Py_VISIT(self->dict);
+  Py_VISIT(self->global_scope);
+  if (self->checks != NULL) {
+    for (auto &check : *self->checks) {
+      Py_VISIT(check.expected);
+      for (auto &v : check.versions) {
+        Py_VISIT(v.dict);
+      }
+    }
+  }
+  return 0;
+}
+
+static int GuardGroup_clear(GuardGroup *self) {
+  Py_CLEAR(self->dict);
+  Py_CLEAR(self->global_scope);
+  if (self->checks != NULL) {
+    for (auto &check : *self->checks) {
+      check.release();
+    }
+    self->checks->clear();
+    self->results->clear();
+  }
+  return 0;
+}
+
+static void GuardGroup_dealloc(GuardGroup *self) {
+  PyObject_GC_UnTrack(self);
+  GuardGroup_clear(self);
+  delete self->checks;
+  delete self->results;
+  self->checks = NULL;
+  self->results = NULL;
+  Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *GuardGroup_new(PyTypeObject *type, PyObject *args,
+                                PyObject *kwds) {
+  GuardGroup *self = (GuardGroup *)type->tp_alloc(type, 0);
+  if (self != NULL) {
+    self->checks = new std::deque<NativeCheck>();
+    self->results = new std::deque<CheckResult>();
+  }
+  return (PyObject *)self;
+}
+
+static int GuardGroup_init(GuardGroup *self, PyObject *args, PyObject *kwds) {
+  PyObject *global_scope;
+  if (!PyArg_ParseTuple(args, "O!", &PyDict_Type, &global_scope)) {
+    return -1;
+  }
+  Py_INCREF(global_scope);
+  Py_XSETREF(self->global_scope, global_scope);
+  return 0;
+}
+
+static PyObject *GuardGroup_add(GuardGroup *self, PyObject *args) {
+  // add(kind: str, is_global: bool, path: Optional[tuple], expected) -> index
+  PyObject *kind, *is_global, *path, *expected;
+  if (!PyArg_ParseTuple(args, "OOOO", &kind, &is_global, &path, &expected)) {
+    return NULL;
+  }
+  NativeCheck check;
+  if (!parse_guard_kind(kind, &check.kind)) {
+    return NULL;
+  }
+  if (check.kind == GuardKind::TYPE_MATCH ||
+      check.kind == GuardKind::ID_MATCH) {
+    check.expected_id = PyLong_AsUnsignedLong(expected);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
+  } else if (check.kind == GuardKind::DICT_KEYS &&
+             !PyFrozenSet_CheckExact(expected)) {
+    PyErr_SetString(PyExc_TypeError, "expected frozenset() of keys");
+    return NULL;
+  } else {
+    Py_INCREF(expected);
+    check.expected = expected;
+  }
+  if (check.kind != GuardKind::GRAD_MODE &&
+      !check.path.init(is_global, path)) {
+    check.release();
+    return NULL;
+  }
+  self->checks->emplace_back(check);
+  self->results->emplace_back(CheckResult::UNKNOWN);
+  return PyLong_FromSize_t(self->checks->size() - 1);
+}
+
+static PyObject *GuardGroup_size(GuardGroup *self, PyObject *noargs) {
+  return PyLong_FromSize_t(self->checks->size());
+}
+
+// 1 if checks[index] passes for f_locals, 0 if it fails, -1 on error
+static int GuardGroup_check(GuardGroup *self, size_t index,
+                            PyObject *f_locals) {
+  auto &results = *self->results;
+  if (self->epoch != guard_epoch || self->locals != f_locals) {
+    std::fill(results.begin(), results.end(), CheckResult::UNKNOWN);
+    self->epoch = guard_epoch;
+    self->locals = f_locals;
+  }
+  if (results[index] != CheckResult::UNKNOWN) {
+    return results[index] == CheckResult::PASS;
+  }
+  int result = (*self->checks)[index].check(f_locals, self->global_scope);
+  if (result < 0) {
+    return -1;
+  }
+  // evaluating the check may have run python that looked up another frame
+  if (self->epoch == guard_epoch && self->locals == f_locals) {
+    results[index] = result ? CheckResult::PASS : CheckResult::FAIL;
+  }
+  return result;
+}
+
+static PyMethodDef GuardGroup_methods[] = {
+    {"add", (PyCFunction)GuardGroup_add, METH_VARARGS, ""},
+    {"size", (PyCFunction)GuardGroup_size, METH_NOARGS, ""},
+    {NULL} /* Sentinel */
+};
+
+static PyTypeObject GuardGroupType = {
+    // NOLINTNEXTLINE
+    PyVarObject_HEAD_INIT(NULL, 0)};
+
+typedef struct {
+  PyObject_HEAD;
+  // __dict__, used by debug hooks in guards.py
+  PyObject *dict;
+  // GuardedCode, checked for .valid
+  PyObject *guarded_code;
+  // GuardGroup shared with the other cache entries of this code object
+  PyObject *group;
+  // TensorGuards applied to the values at tensor_paths, or None
+  PyObject *tensor_guards;
+  // python lambda for guards that can't be evaluated natively, or None
+  PyObject *fallback;
+  // indices into group->checks
+  std::vector<size_t> *checks;
+  std::vector<GuardPath> *tensor_paths;
+} GuardEvaluator;
+
+static int GuardEvaluator_traverse(GuardEvaluator *self, visitproc visit,
+                                   void *arg) {
+  Py_VISIT(self->dict);
+  Py_VISIT(self->guarded_code);
+  Py_VISIT(self->group);
+  Py_VISIT(self->tensor_guards);
+  Py_VISIT(self->fallback);
+  return 0;
+}
+
+static int GuardEvaluator_clear(GuardEvaluator *self) {
+  Py_CLEAR(self->dict);
+  Py_CLEAR(self->guarded_code);
+  Py_CLEAR(self->group);
+  Py_CLEAR(self->tensor_guards);
+  Py_CLEAR(self->fallback);
+  if (self->tensor_paths != NULL) {
+    for (auto &path : *self->tensor_paths) {
+      path.release();
+    }
+    self->tensor_paths->clear();
+  }
+  return 0;
+}
+
+static void GuardEvaluator_dealloc(GuardEvaluator *self) {
+  PyObject_GC_UnTrack(self);
+  GuardEvaluator_clear(self);
+  delete self->checks;
+  delete self->tensor_paths;
+  self->checks = NULL;
+  self->tensor_paths = NULL;
+  Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *GuardEvaluator_new(PyTypeObject *type, PyObject *args,
+                                    PyObject *kwds) {
+  GuardEvaluator *self = (GuardEvaluator *)type->tp_alloc(type, 0);
+  if (self != NULL) {
+    self->checks = new std::vector<size_t>();
+    self->tensor_paths = new std::vector<GuardPath>();
+  }
+  return (PyObject *)self;
+}
+
+static int GuardEvaluator_init(GuardEvaluator *self, PyObject *args,
+                               PyObject *kwds) {
+  // GuardEvaluator(guarded_code, group, checks, tensor_guards,
+  //                tensor_paths, fallback)
+  //   checks: [index returned by group.add(), ...]
+  //   tensor_paths: [(is_global: bool, path: tuple), ...]
+  PyObject *guarded_code, *group, *checks, *tensor_guards, *tensor_paths,
+      *fallback;
+  if (!PyArg_ParseTuple(args, "OO!O!OO!O", &guarded_code, &GuardGroupType,
+                        &group, &PyList_Type, &checks, &tensor_guards,
+                        &PyList_Type, &tensor_paths, &fallback)) {
+    return -1;
+  }
+  if (tensor_guards != Py_None &&
+      !PyObject_TypeCheck(tensor_guards, &TensorGuardsType)) {
+    PyErr_SetString(PyExc_TypeError, "expected TensorGuards() or None");
+    return -1;
+  }
+  Py_INCREF(guarded_code);
+  Py_INCREF(group);
+  Py_INCREF(tensor_guards);
+  Py_INCREF(fallback);
+  self->guarded_code = guarded_code;
+  self->group = group;
+  self->tensor_guards = tensor_guards;
+  self->fallback = fallback;
+
+  size_t num_checks = ((GuardGroup *)group)->checks->size();
+  for (Py_ssize_t i = 0; i < PyList_GET_SIZE(checks); ++i) {
+    size_t index = PyLong_AsSize_t(PyList_GET_ITEM(checks, i));
+    if (PyErr_Occurred()) {
+      return -1;
+    }
+    if (index >= num_checks) {
+      PyErr_SetString(PyExc_IndexError, "check index out of range");
+      return -1;
+    }
+    self->checks->emplace_back(index);
+  }
+
+  for (Py_ssize_t i = 0; i < PyList_GET_SIZE(tensor_paths); ++i) {
+    PyObject *is_global, *path;
+    if (!PyArg_ParseTuple(PyList_GET_ITEM(tensor_paths, i), "OO", &is_global,
+                          &path)) {
+      return -1;
+    }
+    GuardPath tensor_path;
+    if (!tensor_path.init(is_global, path)) {
+      tensor_path.release();
+      return -1;
+    }
+    self->tensor_paths->emplace_back(tensor_path);
+  }
+  return 0;
+}
+
+static PyObject *GuardEvaluator_call(GuardEvaluator *self, PyObject *args,
+                                     PyObject *kwargs) {
+  // called by _eval_frame.c as check_fn(**f_locals)
+  PyObject *valid = PyObject_GetAttrString(self->guarded_code, "valid");
+  if (valid == NULL) {
+    return NULL;
+  }
+  int is_valid = PyObject_IsTrue(valid);
+  Py_DECREF(valid);
+  if (is_valid < 0) {
+    return NULL;
+  } else if (is_valid == 0) {
+    Py_RETURN_FALSE;
+  }
+
+  if (kwargs == NULL || kwargs != guard_lookup_locals) {
+    // called from python (e.g. a profiling wrapper) with a temporary kwargs
+    // dict whose address may be reused, don't share results with it
+    guard_epoch = ++last_guard_epoch;
+  }
+  GuardGroup *group = (GuardGroup *)self->group;
+  for (size_t index : *self->checks) {
+    int result = GuardGroup_check(group, index, kwargs);
+    if (result < 0) {
+      return NULL;
+    } else if (result == 0) {
+      Py_RETURN_FALSE;
+    }
+  }
+
+  if (self->tensor_guards != Py_None) {
+    auto &paths = *self->tensor_paths;
+    PyObject *tensors = PyTuple_New(static_cast<Py_ssize_t>(paths.size()));
+    if (tensors == NULL) {
+      return NULL;
+    }
+    for (size_t i = 0; i < paths.size(); ++i) {
+      PyObject *value = paths[i].resolve(kwargs, group->global_scope);
+      if (value == NULL) {
+        Py_DECREF(tensors);
+        Py_RETURN_FALSE;
+      }
+      PyTuple_SET_ITEM(tensors, i, value);
+    }
+    PyObject *result =
+        TensorGuards_check((TensorGuards *)self->tensor_guards, tensors);
+    Py_DECREF(tensors);
+    if (result != Py_True) {
+      return result;
+    }
+    Py_DECREF(result);
+  }
+
+  if (self->fallback != Py_None) {
+    return PyObject_Call(self->fallback, args, kwargs);
+  }
+  Py_RETURN_TRUE;
+}
+
+static PyTypeObject GuardEvaluatorType = {
+    // NOLINTNEXTLINE
+    PyVarObject_HEAD_INIT(NULL, 0)};
+
 static PyObject *check_type_id(PyObject *dummy, PyObject *args) {
   // faster `lambda obj, expected: id(type(obj)) == expected`
   PyObject *obj;
@@ -188,6 +904,22 @@ static PyObject *check_obj_id(PyObject *dummy, PyObject *args) {
   }
 }
 
+static Py_hash_t signature_hash(PyObject *obj) {
+  // Cheap discriminator used by _eval_frame.c to bucket cache entries.  It
+  // must only depend on properties that TensorGuards checks exactly, so that
+  // two inputs with different hashes can never pass the same guards.
+  Py_uhash_t h = reinterpret_cast<Py_uhash_t>(Py_TYPE(obj));
+  if (THPVariable_Check(obj)) {
+    const at::Tensor &v = THPVariable_Unpack(obj);
+    h = (h ^ static_cast<Py_uhash_t>(v.dtype().toScalarType())) * 1000003UL;
+    h = (h ^ static_cast<Py_uhash_t>(v.ndimension())) * 1000003UL;
+    for (auto size : v.sizes()) {
+      h = (h ^ static_cast<Py_uhash_t>(size)) * 1000003UL;
+    }
+  }
+  return static_cast<Py_hash_t>(h);
+}
+
 static PyMethodDef _methods[] = {
     {"check_type_id", check_type_id, METH_VARARGS, NULL},
     {"check_obj_id", check_obj_id, METH_VARARGS, NULL},
@@ -211,14 +943,66 @@ PyMODINIT_FUNC PyInit__guards(void) {
   TensorGuardsType.tp_init = (initproc)TensorGuards_init;
   TensorGuardsType.tp_new = TensorGuards_new;
 
+  GuardGroupType.tp_name = "torchdynamo._guards.GuardGroup";
+  GuardGroupType.tp_basicsize = sizeof(GuardGroup);
+  GuardGroupType.tp_itemsize = 0;
+  GuardGroupType.tp_dealloc = (destructor)GuardGroup_dealloc;
+  GuardGroupType.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC;
+  GuardGroupType.tp_doc = "Native guards shared by the cache entries of a code";
+  GuardGroupType.tp_traverse = (traverseproc)GuardGroup_traverse;
+  GuardGroupType.tp_clear = (inquiry)GuardGroup_clear;
+  GuardGroupType.tp_methods = GuardGroup_methods;
+  GuardGroupType.tp_dictoffset = offsetof(GuardGroup, dict);
+  GuardGroupType.tp_init = (initproc)GuardGroup_init;
+  GuardGroupType.tp_new = GuardGroup_new;
+
+  GuardEvaluatorType.tp_name = "torchdynamo._guards.GuardEvaluator";
+  GuardEvaluatorType.tp_basicsize = sizeof(GuardEvaluator);
+  GuardEvaluatorType.tp_itemsize = 0;
+  GuardEvaluatorType.tp_dealloc = (destructor)GuardEvaluator_dealloc;
+  GuardEvaluatorType.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC;
+  GuardEvaluatorType.tp_doc = "Evaluate common guards without python";
+  GuardEvaluatorType.tp_traverse = (traverseproc)GuardEvaluator_traverse;
+  GuardEvaluatorType.tp_clear = (inquiry)GuardEvaluator_clear;
+  GuardEvaluatorType.tp_call = (ternaryfunc)GuardEvaluator_call;
+  GuardEvaluatorType.tp_dictoffset = offsetof(GuardEvaluator, dict);
+  GuardEvaluatorType.tp_init = (initproc)GuardEvaluator_init;
+  GuardEvaluatorType.tp_new = GuardEvaluator_new;
+
   PyObject *m;
   if (PyType_Ready(&TensorGuardsType) < 0)
     return NULL;
+  if (PyType_Ready(&GuardGroupType) < 0)
+    return NULL;
+  if (PyType_Ready(&GuardEvaluatorType) < 0)
+    return NULL;
 
   m = PyModule_Create(&_module);
   if (m == NULL)
     return NULL;
 
+  PyObject *signature_hash_capsule = PyCapsule_New(
+      reinterpret_cast<void *>(signature_hash),
+      "torchdynamo._guards.signature_hash", NULL);
+  if (signature_hash_capsule == NULL ||
+      PyModule_AddObject(m, "signature_hash_capsule", signature_hash_capsule) <
+          0) {
+    Py_XDECREF(signature_hash_capsule);
+    Py_DECREF(m);
+    return NULL;
+  }
+
+  PyObject *guard_lookup_capsule = PyCapsule_New(
+      reinterpret_cast<void *>(guard_lookup),
+      "torchdynamo._guards.guard_lookup", NULL);
+  if (guard_lookup_capsule == NULL ||
+      PyModule_AddObject(m, "guard_lookup_capsule",
+                         guard_lookup_capsule) < 0) {
+    Py_XDECREF(guard_lookup_capsule);
+    Py_DECREF(m);
+    return NULL;
+  }
+
   Py_INCREF(&TensorGuardsType);
   if (PyModule_AddObject(m, "TensorGuards", (PyObject *)&TensorGuardsType) <
       0) {
@@ -227,5 +1011,20 @@ PyMODINIT_FUNC PyInit__guards(void) {
     return NULL;
   }
 
+  Py_INCREF(&GuardGroupType);
+  if (PyModule_AddObject(m, "GuardGroup", (PyObject *)&GuardGroupType) < 0) {
+    Py_DECREF(&GuardGroupType);
+    Py_DECREF(m);
+    return NULL;
+  }
+
+  Py_INCREF(&GuardEvaluatorType);
+  if (PyModule_AddObject(m, "GuardEvaluator",
+                         (PyObject *)&GuardEvaluatorType) < 0) {
+    Py_DECREF(&GuardEvaluatorType);
+    Py_DECREF(m);
+    return NULL;
+  }
+
   return m;
 }
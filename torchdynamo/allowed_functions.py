@@ -2,9 +2,16 @@ import builtins
 import collections
 import copy
 import functools
+import hashlib
 import itertools
+import json
+import logging
 import math
 import operator
+import os
+import sys
+import tempfile
+import threading
 import types
 import warnings
 from functools import lru_cache
@@ -12,6 +19,10 @@ from functools import lru_cache
 import numpy
 import torch
 
+from . import config
+
+log = logging.getLogger(__name__)
+
 
 @lru_cache(None)
 def _disallowed_function_ids():
@@ -41,43 +52,170 @@ def _disallowed_function_ids():
     return {id(x) for x in remove}
 
 
-@lru_cache(None)
-def _allowed_function_ids():
+def _walk_torch_objects():
     """
-    Walk torch.* and get the ids of all the stuff in it
+    Walk torch.* and math, returning what was found in each module as a
+    list of (attribute path of the module, module name, attribute names)
+    in the order visited.  Every object is listed once.
     """
-    warnings.filterwarnings("ignore", category=UserWarning, module="torch.distributed")
-    torch.distributions.Distribution.set_default_validate_args(False)
-    torch_object_ids = dict()
+    seen = set()
+    index = []
 
-    def _find_torch_objects(module):
+    def _find_torch_objects(module, path):
         if module.__name__.startswith("torch.distributions"):
             return
         if module.__name__.startswith("torch.testing"):
             return
-        torch_object_ids[id(module)] = module.__name__
+        seen.add(id(module))
+        names = []
+        index.append((path, module.__name__, names))
         for name, obj in list(module.__dict__.items()):
-            if id(obj) not in torch_object_ids:
+            if id(obj) not in seen:
                 if isinstance(obj, types.ModuleType):
                     if obj.__name__.startswith("torch."):
-                        torch_object_ids[id(obj)] = f"{module.__name__}.{name}"
-                        _find_torch_objects(obj)
+                        seen.add(id(obj))
+                        names.append(name)
+                        _find_torch_objects(obj, path + [name])
                 else:
-                    torch_object_ids[id(obj)] = f"{module.__name__}.{name}"
+                    seen.add(id(obj))
+                    names.append(name)
+
+    _find_torch_objects(torch, ["torch"])
+    _find_torch_objects(math, ["math"])
+    return index
+
+
+def _index_path():
+    """Where the result of _walk_torch_objects() is saved for this process"""
+    key = hashlib.sha256(
+        repr(
+            (
+                sys.version,
+                torch.__version__,
+                torch.version.git_version,
+                torch.__file__,
+                # lazily imported submodules change what the walk finds
+                sorted(name for name in sys.modules if name.startswith("torch")),
+            )
+        ).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(config.persistent_cache_dir, "allowed_functions", f"{key}.json")
+
+
+def _load_index():
+    if not config.persistent_cache_dir:
+        return _walk_torch_objects()
+    path = _index_path()
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        log.warning(f"allowed_functions: ignoring unreadable {path}")
+    index = _walk_torch_objects()
+    try:
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        # write + rename so concurrent processes never see partial files
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+    except OSError:
+        log.warning(f"allowed_functions: failed to write {path}")
+    return index
+
+
+class TorchObjectIndex:
+    """
+    Names of the objects found in torch.* and math by _walk_torch_objects()
+    (saved in config.persistent_cache_dir if set), resolved to ids one
+    module at a time as lookups need them.
 
-    _find_torch_objects(torch)
-    _find_torch_objects(math)
+    Lookups of objects defined in torch.* only resolve their own module.
+    The first miss for anything else (a user function, say) has to
+    resolve every module to be sure, which costs as much as the eager
+    walk once per process.
+    """
+
+    def __init__(self, index):
+        # lookups may come from several threads converting frames
+        self.lock = threading.RLock()
+        self.ids = dict()
+        # attribute path => (module name, attribute names) for modules not
+        # resolved yet, and module name => attribute path
+        self.pending = collections.OrderedDict()
+        self.paths = dict()
+        for path, module_name, names in index:
+            self.pending[tuple(path)] = (module_name, names)
+            self.paths.setdefault(module_name, tuple(path))
+
+    def resolve(self, path):
+        """Add the ids of the objects in one module, holding self.lock"""
+        module_name, names = self.pending.pop(path)
+        module = {"torch": torch, "math": math}[path[0]]
+        try:
+            for name in path[1:]:
+                module = getattr(module, name)
+        except AttributeError:
+            return
+        disallowed = _disallowed_function_ids()
+        self.ids[id(module)] = module_name
+        for name in names:
+            if name in module.__dict__:
+                idx = id(module.__dict__[name])
+                if idx not in disallowed:
+                    # modules are named by their own entry when it is resolved
+                    self.ids.setdefault(idx, f"{module_name}.{name}")
 
-    for idx in _disallowed_function_ids():
-        if idx in torch_object_ids:
-            del torch_object_ids[idx]
+    def lookup(self, obj):
+        """Name of obj in torch.* or math, or None"""
+        idx = id(obj)
+        if idx in self.ids or not self.pending:
+            return self.ids.get(idx)
+        # try where obj is most likely defined first
+        try:
+            if isinstance(obj, types.ModuleType):
+                module_name = obj.__name__
+            else:
+                module_name = getattr(obj, "__module__", None)
+        except Exception:
+            module_name = None
+        with self.lock:
+            if (
+                isinstance(module_name, str)
+                and self.paths.get(module_name) in self.pending
+            ):
+                self.resolve(self.paths[module_name])
+            while idx not in self.ids and self.pending:
+                self.resolve(next(iter(self.pending)))
+            return self.ids.get(idx)
 
-    return torch_object_ids
+    def resolve_all(self):
+        with self.lock:
+            while self.pending:
+                self.resolve(next(iter(self.pending)))
+            return self.ids
+
+
+@lru_cache(None)
+def _torch_object_index():
+    warnings.filterwarnings("ignore", category=UserWarning, module="torch.distributed")
+    torch.distributions.Distribution.set_default_validate_args(False)
+    return TorchObjectIndex(_load_index())
+
+
+def _allowed_function_ids():
+    """
+    Walk torch.* and get the ids of all the stuff in it
+    """
+    return _torch_object_index().resolve_all()
 
 
 def is_allowed(obj):
     """Is this safe to trace like torch.add ?"""
-    return id(obj) in _allowed_function_ids()
+    return _torch_object_index().lookup(obj) is not None
 
 
 def is_disallowed(obj):
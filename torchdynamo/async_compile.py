@@ -0,0 +1,73 @@
+import concurrent.futures
+import logging
+import threading
+from typing import Callable
+
+from . import config
+from .utils import counters
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+# reentrant so that _forget() can run inside submit()
+_lock = threading.RLock()
+_executor = None
+_futures = set()
+
+
+def is_compile_thread():
+    """True inside the worker threads used by config.async_compile"""
+    return getattr(_local, "active", False)
+
+
+def _init_worker():
+    _local.active = True
+
+
+def _count(key, delta=1):
+    with _lock:
+        counters["async_compile"][key] += delta
+
+
+def _run(fn: Callable):
+    try:
+        fn()
+        _count("completed")
+    except Exception:
+        _count("failed")
+        log.exception("TORCHDYNAMO: async backend compiler failed")
+    finally:
+        _count("pending", -1)
+
+
+def _forget(future):
+    with _lock:
+        _futures.discard(future)
+
+
+def submit(fn: Callable):
+    """
+    Run fn() in a background thread.  Progress is reported in
+    counters["async_compile"] as submitted/pending/completed/failed.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.async_compile_workers,
+                thread_name_prefix="torchdynamo_compile",
+                initializer=_init_worker,
+            )
+        counters["async_compile"]["submitted"] += 1
+        counters["async_compile"]["pending"] += 1
+        future = _executor.submit(_run, fn)
+        _futures.add(future)
+        future.add_done_callback(_forget)
+    return future
+
+
+def wait(timeout=None):
+    """Block until all submitted compiles are finished"""
+    with _lock:
+        futures = list(_futures)
+    concurrent.futures.wait(futures, timeout=timeout)
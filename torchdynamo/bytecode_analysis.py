@@ -1,6 +1,7 @@
 import dataclasses
 import dis
 import sys
+import weakref
 from numbers import Real
 
 TERMINAL_OPCODES = {
@@ -60,45 +61,70 @@ def remove_pointless_jumps(instructions):
 
 
 @dataclasses.dataclass
-class ReadsWrites:
-    reads: set
-    writes: set
-    visited: set
+class FixedPointBox:
+    value: bool = True
 
 
-def livevars_analysis(instructions, instruction):
+def livevars_fixed_point(instructions):
+    """
+    For every instruction, the local and free variables that may be read
+    before being written on some path starting there
+    """
     indexof = {id(inst): i for i, inst in enumerate(instructions)}
-    must = ReadsWrites(set(), set(), set())
-    may = ReadsWrites(set(), set(), set())
-
-    def walk(state, start):
-        if start in state.visited:
-            return
-        state.visited.add(start)
-
-        for i in range(start, len(instructions)):
-            inst = instructions[i]
-            if inst.opcode in HASLOCAL or inst.opcode in HASFREE:
-                if "LOAD" in inst.opname or "DELETE" in inst.opname:
-                    if inst.argval not in must.writes:
-                        state.reads.add(inst.argval)
-                elif "STORE" in inst.opname:
-                    state.writes.add(inst.argval)
-                else:
-                    assert False, f"unhandled {inst.opname}"
-            if inst.opcode in JUMP_OPCODES:
-                walk(may, indexof[id(inst.target)])
-                state = may
-            if inst.opcode in TERMINAL_OPCODES:
-                return
-
-    walk(must, indexof[id(instruction)])
-    return must.reads | may.reads
+    reads = [None] * len(instructions)
+    writes = [None] * len(instructions)
+    successors = [[] for _ in instructions]
+    for i, inst in enumerate(instructions):
+        if inst.opcode in HASLOCAL or inst.opcode in HASFREE:
+            if "LOAD" in inst.opname or "DELETE" in inst.opname:
+                reads[i] = inst.argval
+            elif "STORE" in inst.opname:
+                writes[i] = inst.argval
+            else:
+                assert False, f"unhandled {inst.opname}"
+        if inst.opcode not in TERMINAL_OPCODES and i + 1 < len(instructions):
+            successors[i].append(i + 1)
+        if inst.opcode in JUMP_OPCODES:
+            successors[i].append(indexof[id(inst.target)])
+
+    live = [frozenset()] * len(instructions)
+    fixed_point = FixedPointBox(False)
+    while not fixed_point.value:
+        fixed_point.value = True
+        for i in reversed(range(len(instructions))):
+            result = set()
+            for j in successors[i]:
+                result.update(live[j])
+            result.discard(writes[i])
+            if reads[i] is not None:
+                result.add(reads[i])
+            if len(result) != len(live[i]):
+                # sets only grow, so comparing sizes is enough
+                live[i] = frozenset(result)
+                fixed_point.value = False
+    return live
+
+
+# code => (opcodes, livevars_fixed_point() of its cleaned instructions)
+_livevars_cache = weakref.WeakKeyDictionary()
+
+
+def cached_livevars(code, instructions):
+    """
+    livevars_fixed_point() computed once per code object, indexed by the
+    position of each instruction
+    """
+    opcodes = tuple(inst.opcode for inst in instructions)
+    entry = _livevars_cache.get(code)
+    if entry is None or entry[0] != opcodes:
+        entry = (opcodes, livevars_fixed_point(instructions))
+        _livevars_cache[code] = entry
+    return entry[1]
 
 
-@dataclasses.dataclass
-class FixedPointBox:
-    value: bool = True
+def livevars_analysis(instructions, instruction):
+    index = next(i for i, inst in enumerate(instructions) if inst is instruction)
+    return set(livevars_fixed_point(instructions)[index])
 
 
 @dataclasses.dataclass
@@ -3,6 +3,7 @@ import dis
 import itertools
 import sys
 import types
+import weakref
 from typing import Any
 from typing import List
 from typing import Optional
@@ -112,18 +113,25 @@ def linetable_writer(first_lineno):
     return linetable, update, end
 
 
-def assemble(instructions: List[dis.Instruction], firstlineno):
-    """Do the opposite of dis.get_instructions()"""
+def assemble(instructions: List[dis.Instruction], firstlineno, extended=None):
+    """
+    Do the opposite of dis.get_instructions().  extended optionally gives a
+    number of EXTENDED_ARG prefixes per instruction, see assemble_offsets().
+    """
     code = []
     if sys.version_info < (3, 10):
         lnotab, update_lineno = lnotab_writer(firstlineno)
     else:
         lnotab, update_lineno, end = linetable_writer(firstlineno)
 
-    for inst in instructions:
+    extended_arg = dis.EXTENDED_ARG
+    for i, inst in enumerate(instructions):
         if inst.starts_line is not None:
             update_lineno(inst.starts_line, len(code))
         arg = inst.arg or 0
+        if extended is not None:
+            for shift in range(8 * extended[i], 0, -8):
+                code.extend((extended_arg, (arg >> shift) & 0xFF))
         code.extend((inst.opcode, arg & 0xFF))
 
     if sys.version_info >= (3, 10):
@@ -144,44 +152,20 @@ def virtualize_jumps(instructions):
                     break
 
 
-def devirtualize_jumps(instructions):
-    """Fill in args for virtualized jump target after instructions may have moved"""
-    indexof = {id(inst): i for i, inst, in enumerate(instructions)}
-    jumps = set(dis.hasjabs).union(set(dis.hasjrel))
-
-    for inst in instructions:
-        if inst.opcode in jumps:
-            target = inst.target
-            target_index = indexof[id(target)]
-            for offset in (1, 2, 3):
-                if (
-                    target_index >= offset
-                    and instructions[target_index - offset].opcode == dis.EXTENDED_ARG
-                ):
-                    target = instructions[target_index - offset]
-                else:
-                    break
-
-            if inst.opcode in dis.hasjabs:
-                if sys.version_info < (3, 10):
-                    inst.arg = target.offset
-                else:
-                    # arg is offset of the instruction line rather than the bytecode
-                    # for all jabs/jrel since python 3.10
-                    inst.arg = int(target.offset / 2)
-            else:  # relative jump
-                if sys.version_info < (3, 10):
-                    inst.arg = target.offset - inst.offset - instruction_size(inst)
-                else:
-                    inst.arg = int(
-                        (target.offset - inst.offset - instruction_size(inst)) / 2
-                    )
-            inst.argval = target.offset
-            inst.argrepr = f"to {target.offset}"
-
-
 def strip_extended_args(instructions: List[Instruction]):
-    instructions[:] = [i for i in instructions if i.opcode != dis.EXTENDED_ARG]
+    output = []
+    starts_line = None
+    for inst in instructions:
+        if inst.opcode == dis.EXTENDED_ARG:
+            # line numbers start at the first prefix, move them to inst
+            if starts_line is None:
+                starts_line = inst.starts_line
+            continue
+        if inst.starts_line is None:
+            inst.starts_line = starts_line
+        starts_line = None
+        output.append(inst)
+    instructions[:] = output
 
 
 def remove_load_call_method(instructions: List[Instruction]):
@@ -224,39 +208,6 @@ def explicit_super(code: types.CodeType, instructions: List[Instruction]):
     instructions[:] = output
 
 
-def fix_extended_args(instructions: List[Instruction]):
-    """Fill in correct argvals for EXTENDED_ARG ops"""
-    output = []
-
-    def maybe_pop_n(n):
-        for _ in range(n):
-            if output and output[-1].opcode == dis.EXTENDED_ARG:
-                output.pop()
-
-    for i, inst in enumerate(instructions):
-        if inst.opcode == dis.EXTENDED_ARG:
-            # Leave this instruction alone for now so we never shrink code
-            inst.arg = 0
-        elif inst.arg and inst.arg > 0xFFFFFF:
-            maybe_pop_n(3)
-            output.append(create_instruction("EXTENDED_ARG", inst.arg >> 24))
-            output.append(create_instruction("EXTENDED_ARG", inst.arg >> 16))
-            output.append(create_instruction("EXTENDED_ARG", inst.arg >> 8))
-        elif inst.arg and inst.arg > 0xFFFF:
-            maybe_pop_n(2)
-            output.append(create_instruction("EXTENDED_ARG", inst.arg >> 16))
-            output.append(create_instruction("EXTENDED_ARG", inst.arg >> 8))
-        elif inst.arg and inst.arg > 0xFF:
-            maybe_pop_n(1)
-            output.append(create_instruction("EXTENDED_ARG", inst.arg >> 8))
-        output.append(inst)
-
-    added = len(output) - len(instructions)
-    assert added >= 0
-    instructions[:] = output
-    return added
-
-
 def instruction_size(inst):
     return 2
 
@@ -268,11 +219,68 @@ def check_offsets(instructions):
         offset += instruction_size(inst)
 
 
-def update_offsets(instructions):
-    offset = 0
-    for inst in instructions:
-        inst.offset = offset
-        offset += instruction_size(inst)
+def extended_args_needed(arg):
+    """Number of EXTENDED_ARG prefixes required to encode arg"""
+    if not arg or arg <= 0xFF:
+        return 0
+    elif arg <= 0xFFFF:
+        return 1
+    elif arg <= 0xFFFFFF:
+        return 2
+    return 3
+
+
+JUMP_OPCODES = set(dis.hasjabs + dis.hasjrel)
+JABS_OPCODES = set(dis.hasjabs)
+
+
+def assemble_offsets(instructions: List[Instruction]):
+    """
+    Fill in the offset of every instruction and the args of jumps.  Each
+    instruction gets extended_args_needed(arg) EXTENDED_ARG prefixes that
+    are not materialized in the list.  Only jumps can need more prefixes
+    once offsets move, so only they are revisited, and prefixes never
+    shrink so this reaches a fixed point.  Returns the prefix counts.
+    """
+    strip_extended_args(instructions)
+    indexof = {id(inst): i for i, inst in enumerate(instructions)}
+    extended = [extended_args_needed(inst.arg) for inst in instructions]
+    jumps = [
+        (i, indexof[id(inst.target)])
+        for i, inst in enumerate(instructions)
+        if inst.opcode in JUMP_OPCODES
+    ]
+    # byte offset where the prefixes of each instruction begin
+    starts = [0] * (len(instructions) + 1)
+    # python 3.10+ jump args count instructions rather than bytes
+    scale = 1 if sys.version_info < (3, 10) else 2
+
+    dirty = True
+    while dirty:
+        dirty = False
+        offset = 0
+        for i, count in enumerate(extended):
+            starts[i] = offset
+            offset += 2 * (count + 1)
+        starts[-1] = offset
+
+        for i, target_index in jumps:
+            inst = instructions[i]
+            target_offset = starts[target_index]
+            if inst.opcode in JABS_OPCODES:
+                inst.arg = target_offset // scale
+            else:
+                inst.arg = (target_offset - starts[i + 1]) // scale
+            inst.argval = target_offset
+            inst.argrepr = f"to {target_offset}"
+            count = extended_args_needed(inst.arg)
+            if count > extended[i]:
+                extended[i] = count
+                dirty = True
+
+    for i, inst in enumerate(instructions):
+        inst.offset = starts[i] + 2 * extended[i]
+    return extended
 
 
 def debug_bytes(*args):
@@ -339,14 +347,9 @@ def transform_code_object(code, transformations, safe=False):
 
     fix_vars(instructions, code_options)
 
-    dirty = True
-    while dirty:
-        update_offsets(instructions)
-        devirtualize_jumps(instructions)
-        # this pass might change offsets, if so we need to try again
-        dirty = fix_extended_args(instructions)
+    extended = assemble_offsets(instructions)
 
-    bytecode, lnotab = assemble(instructions, code.co_firstlineno)
+    bytecode, lnotab = assemble(instructions, code.co_firstlineno, extended)
     if sys.version_info < (3, 10):
         code_options["co_lnotab"] = lnotab
     else:
@@ -361,8 +364,25 @@ def transform_code_object(code, transformations, safe=False):
     return types.CodeType(*[code_options[k] for k in keys])
 
 
+# code => (id(code), dis.Instructions of code)
+_disassembly_cache = weakref.WeakKeyDictionary()
+
+
+def disassemble(code: types.CodeType):
+    """
+    Fresh Instructions for code.  dis.get_instructions() runs once per code
+    object; code objects that are == but not identical (e.g. different line
+    numbers) don't share results.
+    """
+    entry = _disassembly_cache.get(code)
+    if entry is None or entry[0] != id(code):
+        entry = (id(code), list(dis.get_instructions(code)))
+        _disassembly_cache[code] = entry
+    return [convert_instruction(i) for i in entry[1]]
+
+
 def cleaned_instructions(code, safe=False):
-    instructions = list(map(convert_instruction, dis.get_instructions(code)))
+    instructions = disassemble(code)
     check_offsets(instructions)
     virtualize_jumps(instructions)
     strip_extended_args(instructions)
@@ -0,0 +1,188 @@
+import collections
+import contextlib
+import dataclasses
+import functools
+import json
+import os
+import threading
+import time
+import types
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from . import config
+
+# (co_name, co_filename, co_firstlineno)
+CodeKey = Tuple[str, str, int]
+UNKNOWN_CODE: CodeKey = ("<unknown>", "<unknown>", 0)
+
+
+@dataclasses.dataclass
+class RegionStats:
+    calls: int = 0
+    seconds: float = 0.0
+    # seconds not spent in nested regions
+    self_seconds: float = 0.0
+
+
+@dataclasses.dataclass
+class ActiveRegion:
+    name: str
+    code: CodeKey
+    path: Tuple[str, ...]
+    start: float
+    child_seconds: float = 0.0
+
+
+class CompileProfiler:
+    """
+    Hierarchical timings of compilation when config.profile_compile is set
+    (or TORCHDYNAMO_PROFILE_COMPILE=1), aggregated per code object.
+
+        print(CompileProfiler.instance.report())
+        CompileProfiler.instance.dump_chrome_trace("trace.json")
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # code => path of region names => stats
+        self.code_stats: Dict[
+            CodeKey, Dict[Tuple[str, ...], RegionStats]
+        ] = collections.OrderedDict()
+        # chrome trace "complete" events
+        self.events: List[dict] = []
+
+    def clear(self):
+        with self.lock:
+            self.code_stats.clear()
+            self.events.clear()
+
+    def active_regions(self) -> List[ActiveRegion]:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextlib.contextmanager
+    def region(self, name: str, code: Optional[types.CodeType] = None):
+        """Time a region; passing `code` starts a new tree for that code"""
+        stack = self.active_regions()
+        parent = stack[-1] if stack else None
+        if code is not None:
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            path = (name,)
+        elif parent is not None:
+            key = parent.code
+            path = parent.path + (name,)
+        else:
+            key = UNKNOWN_CODE
+            path = (name,)
+        active = ActiveRegion(name, key, path, time.perf_counter())
+        stack.append(active)
+        try:
+            yield
+        finally:
+            stack.pop()
+            seconds = time.perf_counter() - active.start
+            if parent is not None:
+                parent.child_seconds += seconds
+            self.record(active, seconds)
+
+    def record(self, active: ActiveRegion, seconds: float):
+        with self.lock:
+            regions = self.code_stats.setdefault(active.code, dict())
+            stats = regions.setdefault(active.path, RegionStats())
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.self_seconds += seconds - active.child_seconds
+            name, filename, lineno = active.code
+            self.events.append(
+                {
+                    "name": active.name,
+                    "cat": "torchdynamo",
+                    "ph": "X",
+                    "ts": active.start * 1e6,
+                    "dur": seconds * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"code": f"{name} {filename}:{lineno}"},
+                }
+            )
+
+    def totals(self) -> Dict[str, RegionStats]:
+        """Stats per region name, summed over all codes and paths"""
+        result = collections.defaultdict(RegionStats)
+        with self.lock:
+            for regions in self.code_stats.values():
+                for path, stats in regions.items():
+                    total = result[path[-1]]
+                    total.calls += stats.calls
+                    total.self_seconds += stats.self_seconds
+                    if path[-1] not in path[:-1]:
+                        # don't double count recursive regions (inline_call)
+                        total.seconds += stats.seconds
+        return dict(result)
+
+    def report(self) -> str:
+        lines = []
+        with self.lock:
+            code_stats = {
+                key: dict(regions) for key, regions in self.code_stats.items()
+            }
+        for (name, filename, lineno), regions in code_stats.items():
+            lines.append(f"{name} ({filename}:{lineno})")
+            for path in sorted(regions):
+                stats = regions[path]
+                label = "  " * len(path) + path[-1]
+                lines.append(
+                    f"{label:<50} {stats.calls:>7} calls "
+                    f"{stats.seconds * 1000:>10.3f} ms "
+                    f"{stats.self_seconds * 1000:>10.3f} ms self"
+                )
+        lines.append("TOTAL (by self time)")
+        for region_name, stats in sorted(
+            self.totals().items(), key=lambda item: -item[1].self_seconds
+        ):
+            lines.append(
+                f"  {region_name:<48} {stats.calls:>7} calls "
+                f"{stats.seconds * 1000:>10.3f} ms "
+                f"{stats.self_seconds * 1000:>10.3f} ms self"
+            )
+        return "\n".join(lines)
+
+    def to_chrome_trace(self):
+        with self.lock:
+            return {"traceEvents": list(self.events)}
+
+    def dump_chrome_trace(self, filename: str):
+        """Write a trace viewable in chrome://tracing or ui.perfetto.dev"""
+        with open(filename, "w") as fd:
+            json.dump(self.to_chrome_trace(), fd)
+
+
+CompileProfiler.instance = CompileProfiler()
+
+
+def region(name: str, code: Optional[types.CodeType] = None):
+    """Context manager timing `name` if config.profile_compile is set"""
+    if not config.profile_compile:
+        return contextlib.nullcontext()
+    return CompileProfiler.instance.region(name, code)
+
+
+def profiled(name: str):
+    """Decorator timing every call of a function as region `name`"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not config.profile_compile:
+                return fn(*args, **kwargs)
+            with CompileProfiler.instance.region(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
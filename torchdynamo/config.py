@@ -16,9 +16,14 @@ minimum_call_count = 1
 # turn on/off DCE pass
 dead_code_elimination = True
 
-# disable (for a function) when cache reaches this size
+# evict the least recently used entry (for a function) when cache reaches this size
 cache_size_limit = 64
 
+# When a code that already has compiled versions fails to convert, add a cache
+# entry running it eagerly under the guards in effect at the failure, rather
+# than skipping the code from then on.  Codes that never converted are skipped
+cache_unsupported_frames = True
+
 # Assume these functions return constants
 constant_functions = {
     torch.jit.is_scripting: False,
@@ -32,12 +37,36 @@ base_dir = dirname(dirname(abspath(__file__)))
 # don't specialize on shapes and strides and put shape ops in graph
 dynamic_shapes = os.environ.get("TORCHDYNAMO_DYNAMIC_SHAPES") == "1"
 
+# Let some dims of input tensors vary without recompiling, as long as
+# tracing never reads their sizes.  Guards still specialize on rank, dtype
+# and contiguity.  None (off), "range" (any size in [2, ranged_shapes_max])
+# or "pow2" (sizes that round up to the same power of two share a graph).
+# The backend only sees example inputs of one shape, so this only applies
+# to backends with `shape_polymorphic = True` (e.g. "eager"); graphs from
+# other backends, like TorchScript tracing or TensorRT, keep exact shapes
+ranged_shapes = None
+
+# dims that vary under ranged_shapes, in addition to torchdynamo.mark_dynamic()
+ranged_shapes_dims = (0,)
+ranged_shapes_max = 1 << 16
+
 # Set this to False to assume nn.Modules() contents are immutable (similar assumption as freezing)
 guard_nn_modules = False
 
 # Run the FX graph as it is created to get better type information
 dynamic_propagation = True
 
+# With dynamic_propagation, run the FX graph on meta tensors (sizes, strides,
+# dtypes and devices only) instead of real data and copies of nn.Modules.
+# The first op without a meta kernel runs the graph on real data after all
+meta_propagation = False
+
+# Reuse the FX nodes from inlining a user function without closures or side
+# effects when it is called again with the same argument types and shapes
+# and grad mode.  Calls using ops with data dependent output shapes aren't
+# reused.
+cache_inline_calls = True
+
 # run FX normalization passes in optimizer
 normalize_ir = True
 
@@ -47,3 +76,32 @@ traceable_tensor_subclasses = set()
 
 # Propagate backend exceptions up to torchdynamo.optimize
 raise_on_backend_error = False
+
+# Run backend compilers in background threads, calling the plain FX
+# gm.forward until the compiled version is swapped in.  Meanwhile frames run
+# a copy of the graph and its nn.Modules, which in-place updates of the
+# original parameters (e.g. optimizer steps) don't reach.  Backends that run
+# the graph while compiling draw from the process-wide RNG concurrently with
+# the user program, so random numbers are not reproducible with this on
+async_compile = False
+async_compile_workers = 1
+
+# Save converted frames to this directory and reuse them in later
+# processes, see persistent_cache.py.  None disables the cache
+persistent_cache_dir = os.environ.get("TORCHDYNAMO_CACHE_DIR")
+
+# Also save TorchScript backend results in persistent_cache_dir, keyed on
+# the graph and a hash of its weights, so a hit skips the backend
+persistent_cache_artifacts = False
+
+# Evaluate common guards (type/id/constant/dict keys/tensor checks) in C++
+# and only fall back to the generated python lambda for the rest
+native_guards = True
+
+# Record estimated per-guard evaluation counts, check_fn time, first failing
+# guards and cache lookup depths in guard_profiler.GuardProfiler.instance
+profile_guards = os.environ.get("TORCHDYNAMO_PROFILE_GUARDS") == "1"
+
+# Record hierarchical compile-time timings per code object in
+# compile_profiler.CompileProfiler.instance
+profile_compile = os.environ.get("TORCHDYNAMO_PROFILE_COMPILE") == "1"
@@ -1,8 +1,10 @@
+import contextlib
 import dis
 import functools
 import itertools
 import os
 import sys
+import threading
 import traceback
 import types
 import typing
@@ -11,11 +13,14 @@ from typing import Callable
 import torch
 from torch.fx.graph_module import _forward_from_src as original_forward_from_src
 
+from . import compile_profiler
 from . import config
+from . import persistent_cache
 from .bytecode_analysis import remove_dead_code
 from .bytecode_analysis import remove_pointless_jumps
 from .bytecode_transformation import is_generator
 from .bytecode_transformation import transform_code_object
+from .eval_frame import evict_lru
 from .eval_frame import skip_code
 from .exc import InternalTorchDynamoError
 from .exc import RestartAnalysis
@@ -25,6 +30,7 @@ from .exc import unimplemented
 from .guards import GuardedCode
 from .symbolic_convert import InstructionTranslator
 from .utils import CleanupManager
+from .utils import LazyRngState
 from .utils import counters
 
 
@@ -32,18 +38,28 @@ class Tracker:
     def __init__(self):
         self.seen = []
         self.seen_ids = set()
+        # frames are converted on several threads at once
+        self.lock = threading.Lock()
 
     def add(self, obj):
-        if obj not in self:
-            self.seen.append(obj)
-            self.seen_ids.add(id(obj))
+        with self.lock:
+            if obj not in self:
+                self.seen.append(obj)
+                self.seen_ids.add(id(obj))
+
+    def remove(self, obj):
+        with self.lock:
+            if obj in self:
+                self.seen_ids.remove(id(obj))
+                self.seen = [x for x in self.seen if x is not obj]
 
     def __contains__(self, item):
         return id(item) in self.seen_ids
 
     def clear(self):
-        self.seen.clear()
-        self.seen_ids.clear()
+        with self.lock:
+            self.seen.clear()
+            self.seen_ids.clear()
 
 
 input_codes = Tracker()
@@ -55,7 +71,8 @@ def fx_forward_from_src_skip_result(*args, **kwargs):
     # we monkey patch FX to prevent infinite loop of trying to convert
     # our generated code
     result: types.FunctionType = original_forward_from_src(*args, **kwargs)
-    skip_code(result.__code__)
+    if getattr(_forward_from_src_local, "depth", 0):
+        skip_code(result.__code__)
     return result
 
 
@@ -69,10 +86,46 @@ def wrap_compiler_fn(compiler_fn):
         return compiler_fn
 
 
-def wrap_convert_context(fn):
+_forward_from_src_lock = threading.Lock()
+_forward_from_src_users = 0
+_prior_forward_from_src = None
+# depth of patch_forward_from_src() on this thread
+_forward_from_src_local = threading.local()
+
+
+@contextlib.contextmanager
+def patch_forward_from_src():
+    """
+    Monkey patch torch.fx.graph_module._forward_from_src while any thread
+    is converting a frame or running a backend in async_compile.  Only
+    code generated on those threads is skipped, other threads building
+    GraphModules meanwhile are unaffected.
+    """
+    global _forward_from_src_users, _prior_forward_from_src
+    with _forward_from_src_lock:
+        if _forward_from_src_users == 0:
+            _prior_forward_from_src = torch.fx.graph_module._forward_from_src
+            torch.fx.graph_module._forward_from_src = fx_forward_from_src_skip_result
+        _forward_from_src_users += 1
+    local = _forward_from_src_local
+    local.depth = getattr(local, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        local.depth -= 1
+        with _forward_from_src_lock:
+            _forward_from_src_users -= 1
+            if _forward_from_src_users == 0:
+                torch.fx.graph_module._forward_from_src = _prior_forward_from_src
+                _prior_forward_from_src = None
+
+
+def wrap_convert_context(fn, preserve_rng=True):
     """
     Context manager to:
-        1) Save/restore torch random state
+        1) Save/restore torch random state, cloned lazily by
+           preserve_rng_state() once tracing or the backend runs an op
+           (unless preserve_rng=False)
         2) Save/restore torch.is_grad_enabled() state
         3) Monkey patch torch.fx.graph_module._forward_from_src
     """
@@ -80,36 +133,41 @@ def wrap_convert_context(fn):
     @functools.wraps(fn)
     def _fn(*args, **kwargs):
         prior_grad_mode = torch.is_grad_enabled()
-        rng_state = torch.clone(torch.random.get_rng_state())
-        if torch.cuda.is_available():
-            cuda_rng_state = torch.clone(torch.cuda.get_rng_state())
-        prior_fwd_from_src = torch.fx.graph_module._forward_from_src
-        torch.fx.graph_module._forward_from_src = fx_forward_from_src_skip_result
         try:
-            return fn(*args, **kwargs)
+            with patch_forward_from_src():
+                if not preserve_rng:
+                    return fn(*args, **kwargs)
+                with LazyRngState().activate():
+                    return fn(*args, **kwargs)
         finally:
             torch._C._set_grad_enabled(prior_grad_mode)
-            torch.random.set_rng_state(rng_state)
-            if torch.cuda.is_available():
-                torch.cuda.set_rng_state(cuda_rng_state)
-            torch.fx.graph_module._forward_from_src = prior_fwd_from_src
 
     return _fn
 
 
+def evict_cache_entry(code: types.CodeType):
+    """
+    Drop the least recently used compiled version of code to make room
+    for a new one.  Releasing the last reference to the evicted code runs
+    its CleanupManager hooks.
+    """
+    evicted = evict_lru(code)
+    if evicted is not None:
+        output_codes.remove(evicted)
+        counters["frames"]["evicted"] += 1
+
+
 def convert_frame_assert(compiler_fn: Callable, one_graph=True):
     """Fully convert a frame into an FX graph"""
     compiler_fn = wrap_compiler_fn(compiler_fn)
+    debug_function = os.environ.get("TORCHDYNAMO_DEBUG_FUNCTION")
 
     def _convert_frame_assert(frame: types.FrameType, cache_size: int):
         code = frame.f_code
         input_codes.add(code)
         if code in output_codes:
             return None
-        if (
-            os.environ.get("TORCHDYNAMO_DEBUG_FUNCTION")
-            and os.environ.get("TORCHDYNAMO_DEBUG_FUNCTION") != code.co_name
-        ):
+        if debug_function and debug_function != code.co_name:
             return None
         if code.co_name == "<genexpr>" and code.co_filename.endswith(
             "transformers/file_utils.py"
@@ -125,8 +183,6 @@ def convert_frame_assert(compiler_fn: Callable, one_graph=True):
 
         if is_generator(code):
             unimplemented("generator")
-        if cache_size >= config.cache_size_limit:
-            unimplemented("cache_size_limit reached")
         output = None
 
         # from .utils import print_once;  print_once(code.co_filename)
@@ -143,8 +199,8 @@ def convert_frame_assert(compiler_fn: Callable, one_graph=True):
                 compiler_fn,
                 one_graph,
             )
-            tracer.run()
             output = tracer.output
+            tracer.run()
             assert output.output_instructions
             instructions[:] = output.output_instructions
             code_options.update(output.code_options)
@@ -164,29 +220,58 @@ def convert_frame_assert(compiler_fn: Callable, one_graph=True):
             # print(dis.Bytecode(frame.f_code).info())
             print(dis.Bytecode(frame.f_code).dis())
 
-        try:
-            for attempt in itertools.count():
-                try:
-                    code = transform_code_object(frame.f_code, transform)
-                    break
-                except RestartAnalysis:
-                    if attempt > 100:
-                        unimplemented("100+ RestartAnalysis() calls")
+        def install(code, guards, cleanups, dynamic_dims):
             output_codes.add(code)
-            if config.debug:
-                debug_print("ORIGINAL BYTECODE")
-                print("MODIFIED BYTECODE")
-                # print(dis.Bytecode(code).info())
-                print(dis.Bytecode(code).dis())
-                print("\nGUARDS:")
-                for guard in sorted(output.guards):
-                    print(" -", str(guard))
-                print()
-            assert output.guards is not None
-            CleanupManager.instance[code] = output.cleanups
-            return GuardedCode(code, output.guards, frame.f_locals, frame.f_globals)
-        except (Unsupported, TorchRuntimeError):
+            CleanupManager.instance[code] = cleanups
+            for _ in range(cache_size - config.cache_size_limit + 1):
+                evict_cache_entry(frame.f_code)
+            return GuardedCode(
+                code,
+                guards,
+                frame.f_locals,
+                frame.f_globals,
+                frame.f_code,
+                dynamic_dims,
+            )
+
+        try:
+            with compile_profiler.region("convert_frame", frame.f_code):
+                if persistent_cache.enabled():
+                    with compile_profiler.region("persistent_cache.load"):
+                        loaded = persistent_cache.load(frame, compiler_fn)
+                    if loaded is not None:
+                        return install(*loaded)
+
+                for attempt in itertools.count():
+                    try:
+                        with compile_profiler.region("transform_code_object"):
+                            code = transform_code_object(frame.f_code, transform)
+                        break
+                    except RestartAnalysis:
+                        if attempt > 100:
+                            unimplemented("100+ RestartAnalysis() calls")
+                if config.debug:
+                    debug_print("ORIGINAL BYTECODE")
+                    print("MODIFIED BYTECODE")
+                    # print(dis.Bytecode(code).info())
+                    print(dis.Bytecode(code).dis())
+                    print("\nGUARDS:")
+                    for guard in sorted(output.guards):
+                        print(" -", str(guard))
+                    print()
+                assert output.guards is not None
+                guarded_code = install(
+                    code, output.guards, output.cleanups, output.dynamic_dims
+                )
+                if persistent_cache.enabled():
+                    with compile_profiler.region("persistent_cache.save"):
+                        persistent_cache.save(frame, compiler_fn, code, output)
+                return guarded_code
+        except (Unsupported, TorchRuntimeError) as exc:
             debug_print("WONT CONVERT")
+            if output is not None:
+                # for cache_unsupported()
+                exc.guards = frozenset(output.guards)
             raise
         except Exception:
             debug_print("WONT CONVERT")
@@ -202,6 +287,51 @@ def convert_frame_assert(compiler_fn: Callable, one_graph=True):
     return wrap_convert_context(_convert_frame_assert)
 
 
+def cache_unsupported(frame: types.FrameType, cache_size: int, exc: Exception):
+    """
+    Callback result for a frame that failed to convert.  A code without
+    compiled versions is skipped from now on (None).  Otherwise we add an
+    entry that runs the original code when the guards in effect at the
+    failure pass again, keeping the compiled versions usable while
+    equivalent calls don't retrace only to fail at the same place.
+    """
+    stats = counters["unsupported_frames"]
+    if cache_size == 0 or not config.cache_unsupported_frames:
+        stats["skipped"] += 1
+        return None
+    guards = getattr(exc, "guards", None)
+    if not guards:
+        # nothing to tell equivalent calls apart, run eagerly just this once
+        stats["retried"] += 1
+        return False
+    try:
+        guarded_code = GuardedCode(
+            frame.f_code, guards, frame.f_locals, frame.f_globals, frame.f_code
+        )
+    except Exception:
+        stats["retried"] += 1
+        return False
+    guarded_code.unsupported_reason = getattr(exc, "msg", str(exc))
+
+    check_fn = guarded_code.check_fn
+
+    def unsupported_check_fn(*args, **kwargs):
+        if check_fn(*args, **kwargs):
+            counters["unsupported_frames"]["retries_avoided"] += 1
+            return True
+        return False
+
+    unsupported_check_fn.closure_vars = check_fn.closure_vars
+    unsupported_check_fn.code_parts = check_fn.code_parts
+    unsupported_check_fn.global_scope = check_fn.global_scope
+    guarded_code.check_fn = unsupported_check_fn
+
+    for _ in range(cache_size - config.cache_size_limit + 1):
+        evict_cache_entry(frame.f_code)
+    stats["cached"] += 1
+    return guarded_code
+
+
 def convert_frame(compiler_fn: typing.Callable):
     """Try to convert a frame into an FX graph, if error leave frame unmodified"""
     inner_convert = convert_frame_assert(compiler_fn, one_graph=False)
@@ -212,6 +342,8 @@ def convert_frame(compiler_fn: typing.Callable):
             result = inner_convert(frame, cache_size)
             counters["frames"]["ok"] += 1
             return result
+        except (Unsupported, TorchRuntimeError) as exc:
+            return cache_unsupported(frame, cache_size, exc)
         except Exception:
             pass
         return None
@@ -2,10 +2,13 @@ import functools
 import logging
 import threading
 
+from . import async_compile
 from . import config
 from . import convert_frame
 from . import skipfiles
 from .mutation_guard import install_generation_tagging_new
+from .utils import ExactWeakKeyDictionary
+from .utils import counters
 
 try:
     from . import _eval_frame
@@ -16,8 +19,14 @@ set_eval_frame = _eval_frame.set_eval_frame
 reset_code = _eval_frame.reset_code
 unsupported = _eval_frame.unsupported
 skip_code = _eval_frame.skip_code
+skip_filename = _eval_frame.skip_filename
+clear_skip_filenames = _eval_frame.clear_skip_filenames
 set_guard_fail_hook = _eval_frame.set_guard_fail_hook
 set_guard_error_hook = _eval_frame.set_guard_error_hook
+set_guard_profile_hook = _eval_frame.set_guard_profile_hook
+set_signature_hash = _eval_frame.set_signature_hash
+set_guard_lookup = _eval_frame.set_guard_lookup
+evict_lru = _eval_frame.evict_lru
 
 
 def nothing():
@@ -26,7 +35,21 @@ def nothing():
 
 unset = object()
 
-compile_lock = threading.Lock()
+# code object => lock held while converting frames of that code, so other
+# threads entering it can wait and retry its cache instead of converting.
+# Threads converting different code run at the same time: the state they
+# share (the torch.fx patch, the RNG snapshot, output_codes, resume
+# functions, guard groups, CleanupManager) is safe to use concurrently.
+compile_locks = ExactWeakKeyDictionary()
+compile_locks_lock = threading.Lock()
+
+
+def get_compile_lock(code):
+    with compile_locks_lock:
+        lock = compile_locks.get(code)
+        if lock is None:
+            lock = compile_locks[code] = threading.Lock()
+        return lock
 
 
 class _TorchDynamoContext:
@@ -88,6 +111,9 @@ def catch_errors_wrapper(callback):
     def catch_errors(frame, cache_size):
         try:
             if frame.f_lasti >= 0 or skipfiles.check(frame.f_code.co_filename):
+                if frame.f_lasti < 0:
+                    # later code from this file is skipped without calling us
+                    skip_filename(frame.f_code.co_filename)
                 if config.debug:
                     print(f"skipping {frame.f_code.co_name} {frame.f_code.co_filename}")
                 return None
@@ -97,8 +123,21 @@ def catch_errors_wrapper(callback):
             ):
                 # nametuple constructor
                 return None
-            with compile_lock:
+            if async_compile.is_compile_thread():
+                # code run by a backend compiler in the background
+                return False
+            lock = get_compile_lock(frame.f_code)
+            if not lock.acquire(blocking=False):
+                # Another thread is compiling this code, wait for it then
+                # let _eval_frame.c retry its cache (or run the frame
+                # normally).  Threads compiling other code don't block.
+                with lock:
+                    counters["frames"]["compile_lock_waits"] += 1
+                return False
+            try:
                 return callback(frame, cache_size)
+            finally:
+                lock.release()
         except Exception:
             logging.basicConfig()
             logging.exception("Error while processing frame")
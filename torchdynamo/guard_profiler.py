@@ -0,0 +1,229 @@
+import collections
+import csv
+import dataclasses
+import json
+import time
+import types
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from . import config
+from .eval_frame import set_guard_profile_hook
+from .utils import rename_implicit
+
+
+def first_failing_guard(
+    guard_fn: Callable, f_locals: Dict[str, Any], args=()
+) -> Optional[int]:
+    """
+    Index into guard_fn.code_parts of the first guard that fails, found by
+    evaluating them again in the order guard_fn checks them.  A guard that
+    raises counts as failing.
+    """
+    scope = {rename_implicit(k): v for k, v in f_locals.items()}
+    if args:
+        # see parallel handling of ".0" / "___implicit0" in _eval_frame.c
+        scope["___implicit0"] = args[0]
+    scope.update(guard_fn.closure_vars)
+    for index, part in enumerate(guard_fn.code_parts):
+        try:
+            if not eval(part, guard_fn.global_scope, scope):
+                return index
+        except Exception:
+            return index
+    return None
+
+
+@dataclasses.dataclass
+class CacheEntryStats:
+    code_parts: List[str]
+    calls: int = 0
+    passes: int = 0
+    seconds: float = 0.0
+    # estimated number of times each of code_parts was reached: every guard
+    # before the first failing one is assumed to have run, though native
+    # checks shared with other entries may have been answered from a cache
+    evaluations: List[int] = dataclasses.field(default_factory=list)
+    # guard => number of times it was the first to fail
+    first_failures: collections.Counter = dataclasses.field(
+        default_factory=collections.Counter
+    )
+
+    def __post_init__(self):
+        if not self.evaluations:
+            self.evaluations = [0] * len(self.code_parts)
+
+    def record(self, seconds: float, failed_index: Optional[int]):
+        self.calls += 1
+        self.seconds += seconds
+        if failed_index is None:
+            self.passes += 1
+            reached = len(self.code_parts)
+        else:
+            self.first_failures[self.code_parts[failed_index]] += 1
+            reached = failed_index + 1
+        for i in range(reached):
+            self.evaluations[i] += 1
+
+    def to_json(self):
+        return {
+            "calls": self.calls,
+            "passes": self.passes,
+            "seconds": self.seconds,
+            "guards": [
+                {
+                    "guard": part,
+                    "evaluations": count,
+                    "first_failures": self.first_failures[part],
+                }
+                for part, count in zip(self.code_parts, self.evaluations)
+            ],
+        }
+
+
+@dataclasses.dataclass
+class CodeStats:
+    name: str
+    filename: str
+    firstlineno: int
+    lookups: int = 0
+    misses: int = 0
+    # number of entries checked before the one that matched => count.  The
+    # cache is kept most recently used first, so this is a lookup depth, not
+    # an index into `entries` (see CacheEntryStats.passes for that)
+    hit_depth: collections.Counter = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    # in the order the entries were compiled
+    entries: List[CacheEntryStats] = dataclasses.field(default_factory=list)
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "filename": self.filename,
+            "firstlineno": self.firstlineno,
+            "lookups": self.lookups,
+            "misses": self.misses,
+            "hit_depth": dict(self.hit_depth),
+            "entries": [entry.to_json() for entry in self.entries],
+        }
+
+
+class GuardProfiler:
+    """
+    Records guard evaluation statistics when config.profile_guards is set
+    (or TORCHDYNAMO_PROFILE_GUARDS=1).  Cache lookups are only recorded
+    between enable() and disable(), enabled at import by the environment
+    variable.
+
+        GuardProfiler.instance.stats()  # {code: CodeStats}
+        GuardProfiler.instance.dump_csv("guards.csv")
+        GuardProfiler.instance.dump_json("guards.json")
+    """
+
+    def __init__(self):
+        self.code_stats: Dict[types.CodeType, CodeStats] = collections.OrderedDict()
+
+    def get(self, code: types.CodeType) -> CodeStats:
+        if code not in self.code_stats:
+            self.code_stats[code] = CodeStats(
+                code.co_name, code.co_filename, code.co_firstlineno
+            )
+        return self.code_stats[code]
+
+    def stats(self) -> Dict[types.CodeType, CodeStats]:
+        return dict(self.code_stats)
+
+    def clear(self):
+        self.code_stats.clear()
+
+    def record_lookup(self, code: types.CodeType, index: int):
+        """Called by _eval_frame.c after checking the cache of `code`"""
+        stats = self.get(code)
+        stats.lookups += 1
+        if index < 0:
+            stats.misses += 1
+        else:
+            stats.hit_depth[index] += 1
+
+    def wrap(self, f_code: Optional[types.CodeType], guard_fn: Callable):
+        """Wrap a check_fn to record into the stats of `f_code`"""
+        if f_code is None:
+            return guard_fn
+        entry = CacheEntryStats(list(guard_fn.code_parts))
+        self.get(f_code).entries.append(entry)
+
+        def profiled_guard_fn(*args, **kwargs):
+            t0 = time.perf_counter()
+            result = guard_fn(*args, **kwargs)
+            t1 = time.perf_counter()
+            failed_index = None
+            if not result:
+                failed_index = first_failing_guard(guard_fn, kwargs, args)
+            entry.record(t1 - t0, failed_index)
+            return result
+
+        profiled_guard_fn.closure_vars = guard_fn.closure_vars
+        profiled_guard_fn.code_parts = guard_fn.code_parts
+        profiled_guard_fn.global_scope = guard_fn.global_scope
+        return profiled_guard_fn
+
+    def to_json(self):
+        return [stats.to_json() for stats in self.code_stats.values()]
+
+    def dump_json(self, filename: str):
+        with open(filename, "w") as fd:
+            json.dump(self.to_json(), fd, indent=2)
+
+    def dump_csv(self, filename: str):
+        with open(filename, "w", newline="") as fd:
+            writer = csv.writer(fd)
+            writer.writerow(
+                [
+                    "filename",
+                    "firstlineno",
+                    "name",
+                    "lookups",
+                    "misses",
+                    "entry",
+                    "calls",
+                    "passes",
+                    "seconds",
+                    "guard",
+                    "evaluations",
+                    "first_failures",
+                ]
+            )
+            for stats in self.code_stats.values():
+                for entry_index, entry in enumerate(stats.entries):
+                    for part, count in zip(entry.code_parts, entry.evaluations):
+                        writer.writerow(
+                            [
+                                stats.filename,
+                                stats.firstlineno,
+                                stats.name,
+                                stats.lookups,
+                                stats.misses,
+                                entry_index,
+                                entry.calls,
+                                entry.passes,
+                                entry.seconds,
+                                part,
+                                count,
+                                entry.first_failures[part],
+                            ]
+                        )
+
+    def enable(self):
+        set_guard_profile_hook(self.record_lookup)
+
+    def disable(self):
+        set_guard_profile_hook(None)
+
+
+GuardProfiler.instance = GuardProfiler()
+if config.profile_guards:
+    GuardProfiler.instance.enable()
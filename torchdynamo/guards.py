@@ -12,17 +12,28 @@ from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Set
+from typing import Tuple
 
 import numpy as np
 import torch
 
 from . import config
 from . import mutation_guard
+from ._guards import GuardEvaluator
+from ._guards import GuardGroup
 from ._guards import TensorGuards
 from ._guards import check_obj_id
 from ._guards import check_type_id
+from ._guards import guard_lookup_capsule
+from ._guards import signature_hash_capsule
+from .compile_profiler import profiled
 from .eval_frame import set_guard_error_hook
 from .eval_frame import set_guard_fail_hook
+from .eval_frame import set_guard_lookup
+from .eval_frame import set_signature_hash
+from .guard_profiler import GuardProfiler
+from .guard_profiler import first_failing_guard
+from .utils import ExactWeakKeyDictionary
 from .utils import istype
 from .utils import rename_implicit
 from .utils import tuple_iterator_getitem
@@ -40,6 +51,10 @@ CLOSURE_VARS = collections.OrderedDict(
 )
 
 
+# start a new GuardGroup for a code object once it holds this many checks
+GUARD_GROUP_SIZE_LIMIT = 4096
+
+
 class GuardSource(enum.Enum):
     LOCAL = 0
     GLOBAL = 1
@@ -111,6 +126,45 @@ def strip_getattr_getitem(name):
     return re.split(r"[.\[]", name)[0]
 
 
+def native_path_is_valid(name):
+    """
+    "a.foo.bar" => True
+    "a[1]" => False
+    """
+    return re.match(r"^[a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*$", name)
+
+
+def size_ranges(value: torch.Tensor, dynamic_dims):
+    """
+    (min, max) allowed for each dim of `value` under config.ranged_shapes,
+    or None to guard on exact sizes and strides
+    """
+    if not dynamic_dims:
+        return None
+    ranges = []
+    for dim, size in enumerate(value.size()):
+        if dim not in dynamic_dims:
+            ranges.append((size, size))
+        elif config.ranged_shapes == "pow2":
+            # 3-4, 5-8, 9-16, ...
+            hi = 1 << (size - 1).bit_length()
+            ranges.append((hi // 2 + 1, hi))
+        else:
+            assert config.ranged_shapes == "range", config.ranged_shapes
+            ranges.append((2, max(size, config.ranged_shapes_max)))
+    return ranges
+
+
+def is_native_constant(val):
+    """Can GuardEvaluator check `x == val` with the same result as python"""
+    if istype(val, tuple):
+        return all(map(is_native_constant, val))
+    if istype(val, float):
+        # PyObject_RichCompareBool() treats identical nan objects as equal
+        return val == val
+    return istype(val, (int, bool, str, type(None)))
+
+
 class GuardBuilder:
     def __init__(
         self, id_ref: Callable, scope: Dict[str, Any], guarded_code, renames=True
@@ -127,6 +181,11 @@ class GuardBuilder:
         self.code: List[str] = []
         self.tensor_check_names = []
         self.tensor_check_examples = []
+        self.tensor_check_ranges = []
+        # (kind, path, expected) for guards GuardEvaluator can check in C++
+        self.native_checks = []
+        # entries of self.code covered by self.native_checks
+        self.native_code = set()
         self.guarded_code = guarded_code
 
     def get(self, name: str):
@@ -143,10 +202,33 @@ class GuardBuilder:
 
         return name
 
+    def native_path(self, name: str):
+        """
+        Convert `name` into a (local, attr, ...) tuple that GuardEvaluator
+        can resolve without running python, or return None
+        """
+        if name.startswith("___") or not native_path_is_valid(name):
+            return None
+        path = tuple(name.split("."))
+        if path[0] not in self.scope:
+            return None
+        return path
+
+    def add_code(self, code: str, kind: Optional[str] = None, path=None, expected=None):
+        self.code.append(code)
+        if kind is not None and (path is not None or kind == "GRAD_MODE"):
+            self.native_checks.append((kind, path, expected))
+            self.native_code.add(code)
+
     def TYPE_MATCH(self, guard: Guard):
         # ___check_type_id is same as `id(type(x)) == y`
-        self.code.append(
-            f"___check_type_id({self.arg_ref(guard)}, {self.id_ref(type(self.get(guard.name)))})"
+        ref = self.arg_ref(guard)
+        type_id = self.id_ref(type(self.get(guard.name)))
+        self.add_code(
+            f"___check_type_id({ref}, {type_id})",
+            "TYPE_MATCH",
+            self.native_path(ref),
+            type_id,
         )
 
     def ID_MATCH(self, guard: Guard):
@@ -155,8 +237,13 @@ class GuardBuilder:
         if m:
             # optional optimization to produce cleaner/faster guard code
             return self.TYPE_MATCH(Guard(m.group(1), guard.source, None))
-        self.code.append(
-            f"___check_obj_id({self.arg_ref(guard)}, {self.id_ref(self.get(guard.name))})"
+        ref = self.arg_ref(guard)
+        obj_id = self.id_ref(self.get(guard.name))
+        self.add_code(
+            f"___check_obj_id({ref}, {obj_id})",
+            "ID_MATCH",
+            self.native_path(ref),
+            obj_id,
         )
 
     def HASATTR(self, guard: Guard):
@@ -206,7 +293,13 @@ class GuardBuilder:
             return
         if istype(val, torch.Size):
             val = tuple(val)
-        self.code.append(f"{self.arg_ref(guard)} == {val!r}")
+        ref = self.arg_ref(guard)
+        if is_native_constant(val):
+            self.add_code(
+                f"{ref} == {val!r}", "EQUALS_MATCH", self.native_path(ref), val
+            )
+        else:
+            self.code.append(f"{ref} == {val!r}")
 
     def CONSTANT_MATCH(self, guard: Guard):
         val = self.get(guard.name)
@@ -220,10 +313,11 @@ class GuardBuilder:
         ref = self.arg_ref(guard)
         val = self.get(guard.name)
         assert istype(val.training, bool)
+        path = self.native_path(f"{ref}.training")
         if val.training:
-            self.code.append(f"{ref}.training")
+            self.add_code(f"{ref}.training", "EQUALS_MATCH", path, True)
         else:
-            self.code.append(f"not {ref}.training")
+            self.add_code(f"not {ref}.training", "EQUALS_MATCH", path, False)
 
     def FUNCTION_MATCH(self, guard: Guard):
         """things like torch.add and user defined functions"""
@@ -239,33 +333,39 @@ class GuardBuilder:
     def LIST_LENGTH(self, guard):
         ref = self.arg_ref(guard)
         value = self.get(guard.name)
-        self.code.append(f"___check_type_id({ref}, {self.id_ref(type(value))})")
+        self.TYPE_MATCH(guard)
         self.code.append(f"len({ref}) == {len(value)}")
 
     def TUPLE_ITERATOR_LEN(self, guard):
         ref = self.arg_ref(guard)
         value = self.get(guard.name)
-        self.code.append(f"___check_type_id({ref}, {self.id_ref(type(value))})")
+        self.TYPE_MATCH(guard)
         self.code.append(f"___tuple_iterator_len({ref}) == {tuple_iterator_len(value)}")
 
     def DICT_KEYS(self, guard):
         ref = self.arg_ref(guard)
         value = self.get(guard.name)
-        self.code.append(f"___check_type_id({ref}, {self.id_ref(type(value))})")
-        self.code.append(f"{ref}.keys() == {set(value.keys())!r}")
+        self.TYPE_MATCH(guard)
+        code = f"{ref}.keys() == {set(value.keys())!r}"
+        if istype(value, dict):
+            self.add_code(
+                code, "DICT_KEYS", self.native_path(ref), frozenset(value.keys())
+            )
+        else:
+            self.code.append(code)
 
     def NN_MODULE_PARAM_NAMES(self, guard):
         ref = self.arg_ref(guard)
         value = self.get(guard.name)
         keys = {k for k, v in value.named_parameters()}
-        self.code.append(f"___check_type_id({ref}, {self.id_ref(type(value))})")
+        self.TYPE_MATCH(guard)
         self.code.append(f"{{k for k, v in {ref}.named_parameters()}} == {keys!r}")
 
     def ODICT_KEYS(self, guard):
         """OrderedDict keys match"""
         ref = self.arg_ref(guard)
         value = self.get(guard.name)
-        self.code.append(f"___check_type_id({ref}, {self.id_ref(type(value))})")
+        self.TYPE_MATCH(guard)
         self.code.append(f"str({ref}.keys()) == {str(value.keys())!r}")
 
     def OBJECT_MUTATION(self, guard: Guard):
@@ -276,30 +376,43 @@ class GuardBuilder:
         assert guard.name == ""
         assert guard.source is GuardSource.GLOBAL
         if torch.is_grad_enabled():
-            self.code.append("___is_grad_enabled()")
+            self.add_code("___is_grad_enabled()", "GRAD_MODE", expected=True)
         else:
-            self.code.append("not ___is_grad_enabled()")
+            self.add_code("not ___is_grad_enabled()", "GRAD_MODE", expected=False)
 
     def TENSOR_MATCH(self, guard: Guard):
         if guard.is_nn_module():
             self.ID_MATCH(guard)
         else:
+            value = self.get(guard.name)
             self.tensor_check_names.append(self.arg_ref(guard))
-            self.tensor_check_examples.append(self.get(guard.name))
+            self.tensor_check_examples.append(value)
+            self.tensor_check_ranges.append(
+                size_ranges(value, self.guarded_code.dynamic_dims.get(guard.name))
+            )
 
 
 class GuardedCode:
+    @profiled("GuardedCode")
     def __init__(
         self,
         code: types.CodeType,
         guards: Optional[Set[Guard]] = None,
         f_locals: Optional[Dict] = None,
         f_globals: Optional[Dict] = None,
+        f_code: Optional[types.CodeType] = None,
+        dynamic_dims: Optional[Dict[str, Tuple[int, ...]]] = None,
     ):
         self.code = code
+        # original code object this guards a transformed version of
+        self.f_code = f_code
+        # tensor name => dims allowed to vary, see config.ranged_shapes
+        self.dynamic_dims = dynamic_dims or dict()
         self.valid = True
         self._weakrefs = []
         self._seen_ids = set()
+        # locals hashed by _eval_frame.c to bucket cache entries
+        self.cache_key_names = ()
 
         local_builder = GuardBuilder(self.id_ref, f_locals, self, renames=True)
         global_builder = GuardBuilder(self.id_ref, f_globals, self, renames=False)
@@ -308,8 +421,25 @@ class GuardedCode:
                 continue
             guard.create(local_builder, global_builder)
         self.check_fn = self.compile_check_fn(local_builder, global_builder)
+        if config.profile_guards:
+            self.check_fn = GuardProfiler.instance.wrap(f_code, self.check_fn)
+        if not config.dynamic_shapes:
+            # inputs with ranged sizes can't be bucketed by their exact sizes
+            self.cache_key_names = tuple(
+                unique(
+                    name
+                    for name, ranges in zip(
+                        local_builder.tensor_check_names,
+                        local_builder.tensor_check_ranges,
+                    )
+                    if name.isidentifier()
+                    and not name.startswith("___")
+                    and ranges is None
+                )
+            )
         self._seen_ids.clear()
 
+    @profiled("compile_check_fn")
     def compile_check_fn(self, local_builder, global_builder):
         assert not (set(local_builder.argnames) & set(global_builder.argnames))
         # see parallel handling of ".0" / "___implicit0" in _eval_frame.c
@@ -324,15 +454,22 @@ class GuardedCode:
         tensor_check_names = (
             local_builder.tensor_check_names + global_builder.tensor_check_names
         )
+        tensor_guards = None
         check_tensors_fn = None
         if tensor_check_names:
             tensor_check_examples = (
                 local_builder.tensor_check_examples
                 + global_builder.tensor_check_examples
             )
-            check_tensors_fn = TensorGuards(
-                *tensor_check_examples, dynamic_shapes=config.dynamic_shapes
-            ).check
+            tensor_check_ranges = (
+                local_builder.tensor_check_ranges + global_builder.tensor_check_ranges
+            )
+            tensor_guards = TensorGuards(
+                *tensor_check_examples,
+                dynamic_shapes=config.dynamic_shapes,
+                ranges=tensor_check_ranges,
+            )
+            check_tensors_fn = tensor_guards.check
             code_parts.append(f"___check_tensors({', '.join(tensor_check_names)})")
 
         code = " and ".join(unique(code_parts))
@@ -354,14 +491,88 @@ class GuardedCode:
             print("GUARDS", code)
         if os.environ.get("TORCHDYNAMO_PRINT_GUARD_FAILS", None) == "1":
             set_guard_fail_hook(guard_fail_hook)
-        out = dict()
-        exec(py_code, global_builder.scope, out)
-        guard_fn = out["___make_guard_fn"](*closure_vars.values())
+        if config.native_guards:
+            guard_fn = self.compile_native_check_fn(
+                local_builder, global_builder, args, closure_vars, tensor_guards
+            )
+        else:
+            guard_fn = self.exec_check_fn(py_code, global_builder, closure_vars)
+            guard_fn.code_parts = list(unique(code_parts))
         guard_fn.closure_vars = closure_vars
-        guard_fn.code_parts = code_parts
         guard_fn.global_scope = global_builder.scope
         return guard_fn
 
+    @staticmethod
+    def exec_check_fn(py_code, global_builder, closure_vars):
+        out = dict()
+        exec(py_code, global_builder.scope, out)
+        return out["___make_guard_fn"](*closure_vars.values())
+
+    def compile_native_check_fn(
+        self, local_builder, global_builder, args, closure_vars, tensor_guards
+    ):
+        """
+        Move the guards GuardBuilder could express natively into a
+        GuardEvaluator, leaving only the rest to a python lambda.
+        """
+        builders = ((local_builder, False), (global_builder, True))
+        checks = [
+            (kind, is_global, path, expected)
+            for builder, is_global in builders
+            for kind, path, expected in builder.native_checks
+        ]
+        group = get_guard_group(self.f_code, global_builder.scope)
+        checks = [group_add(group, *check) for check in checks]
+        native_code = {"___guarded_code.valid"}
+        for builder, _ in builders:
+            native_code.update(builder.native_code)
+
+        tensor_paths = [
+            (is_global, builder.native_path(name))
+            for builder, is_global in builders
+            for name in builder.tensor_check_names
+        ]
+        native_tensors = all(path is not None for _, path in tensor_paths)
+        tensor_names = (
+            local_builder.tensor_check_names + global_builder.tensor_check_names
+        )
+        tensor_part = f"___check_tensors({', '.join(tensor_names)})"
+
+        parts = list(unique(local_builder.code + global_builder.code))
+        fallback_parts = [part for part in parts if part not in native_code]
+        if tensor_guards is not None and not native_tensors:
+            fallback_parts.append(tensor_part)
+
+        fallback = None
+        if fallback_parts:
+            code = " and ".join(fallback_parts)
+            py_code = textwrap.dedent(
+                f"""
+                def ___make_guard_fn({','.join(closure_vars.keys())}):
+                    return lambda {args}: {code}
+                """
+            )
+            fallback = self.exec_check_fn(py_code, global_builder, closure_vars)
+
+        if not native_tensors:
+            tensor_guards = None
+            tensor_paths = []
+        evaluator = GuardEvaluator(
+            self,
+            group,
+            checks,
+            tensor_guards,
+            tensor_paths,
+            fallback,
+        )
+        # in the order they are checked: natively, then tensors, then fallback
+        evaluator.code_parts = ["___guarded_code.valid"]
+        evaluator.code_parts += [part for part in parts if part in native_code]
+        if tensor_guards is not None:
+            evaluator.code_parts.append(tensor_part)
+        evaluator.code_parts += fallback_parts
+        return evaluator
+
     def invalidate(self, ref):
         # A weakref is no longer valid, self.check_fn should return false
         self.valid = False
@@ -377,6 +588,38 @@ class GuardedCode:
         return id(obj)
 
 
+guard_groups = ExactWeakKeyDictionary()
+
+
+def get_guard_group(f_code: Optional[types.CodeType], global_scope: Dict[str, Any]):
+    """
+    Native checks of every cache entry of `f_code` are deduplicated into a
+    shared GuardGroup, so a check common to many entries (e.g. the ID_MATCH
+    of a global function) is only evaluated once per frame no matter how
+    many entries get tried.
+    """
+    group = guard_groups.get(f_code) if f_code is not None else None
+    if (
+        group is None
+        or group.global_scope is not global_scope
+        or group.size() >= GUARD_GROUP_SIZE_LIMIT
+    ):
+        group = GuardGroup(global_scope)
+        group.global_scope = global_scope
+        group.index = dict()
+        if f_code is not None:
+            guard_groups[f_code] = group
+    return group
+
+
+def group_add(group, kind, is_global, path, expected):
+    """Add a check to `group`, or find the identical one already there"""
+    key = (kind, is_global, path, type(expected), expected)
+    if key not in group.index:
+        group.index[key] = group.add(kind, is_global, path, expected)
+    return group.index[key]
+
+
 def guard_fail_hook(
     guard_fn: Callable, code: types.CodeType, f_locals: Dict[str, Any], last: bool
 ):
@@ -386,13 +629,8 @@ def guard_fail_hook(
     """
     if not last:
         return
-    scope = {rename_implicit(k): v for k, v in f_locals.items()}
-    scope.update(guard_fn.closure_vars)
-    reasons = []
-    for part in guard_fn.code_parts:
-        if not eval(part, guard_fn.global_scope, scope):
-            reasons.append(part)
-            break
+    index = first_failing_guard(guard_fn, f_locals)
+    reasons = [guard_fn.code_parts[index]] if index is not None else []
     print(f"Failed guards {reasons} (code={id(code)}, last={last})")
 
 
@@ -406,6 +644,8 @@ def guard_error_hook(
 
 
 set_guard_error_hook(guard_error_hook)
+set_signature_hash(signature_hash_capsule)
+set_guard_lookup(guard_lookup_capsule)
 
 
 def unique(seq):
@@ -0,0 +1,253 @@
+import dataclasses
+import operator
+import types
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import torch
+import torch.fx
+
+from . import config
+from .side_effects import SideEffects
+from .utils import counters
+from .variables.base import VariableTracker
+from .variables.constant import ConstantVariable
+from .variables.functions import UserFunctionVariable
+from .variables.lists import TupleVariable
+from .variables.tensor import TensorVariable
+
+# TensorVariable fields a traced function may specialize on
+TENSOR_KEY_FIELDS = [f for f in TensorVariable._nonvar_fields if f != "proxy"] + [
+    "class_type"
+]
+# placeholder and get_attr nodes are tied to the sources of the recorded
+# arguments (e.g. `p.grad`), so calls creating them aren't recorded
+RECORDED_OPS = (
+    "call_function",
+    "call_method",
+    "call_module",
+)
+
+# ops whose output shape depends on the data of their inputs.  The traced
+# function may have specialized on that shape, so calls using them aren't
+# recorded.
+DATA_DEPENDENT_FUNCTIONS = {
+    getattr(torch, name)
+    for name in (
+        "argwhere",
+        "bincount",
+        "masked_select",
+        "nonzero",
+        "repeat_interleave",
+        "unique",
+        "unique_consecutive",
+    )
+    if hasattr(torch, name)
+}
+DATA_DEPENDENT_METHODS = {
+    "argwhere",
+    "bincount",
+    "item",
+    "masked_select",
+    "nonzero",
+    "repeat_interleave",
+    "tolist",
+    "unique",
+    "unique_consecutive",
+}
+
+
+@dataclasses.dataclass
+class InlineCall:
+    """A call about to be inlined, see inline_call()"""
+
+    key: Tuple[Any, ...]
+    # proxies of the tensor arguments, in signature order
+    arg_nodes: List[torch.fx.Node]
+    arg_guards: frozenset
+
+
+@dataclasses.dataclass
+class InlineCallRecord:
+    # keep the function alive so id(fn) in the key isn't reused
+    fn: types.FunctionType
+    arg_nodes: List[torch.fx.Node]
+    nodes: List[torch.fx.Node]
+    result: VariableTracker
+    side_effects: SideEffects
+    side_effects_version: int
+
+
+def is_hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+
+def is_bool_index(node: torch.fx.Node):
+    """x[mask] selects a data dependent number of elements"""
+    found = []
+    torch.fx.node.map_arg(node.args[1:], found.append)
+    return any(
+        getattr(n.meta.get("example_value"), "dtype", None) is torch.bool for n in found
+    )
+
+
+def is_data_dependent(node: torch.fx.Node):
+    if node.op == "call_function":
+        if node.target in DATA_DEPENDENT_FUNCTIONS:
+            return True
+        if node.target is torch.where and len(node.args) + len(node.kwargs) == 1:
+            return True
+        return node.target is operator.getitem and is_bool_index(node)
+    if node.op == "call_method":
+        if node.target in DATA_DEPENDENT_METHODS:
+            return True
+        return node.target == "__getitem__" and is_bool_index(node)
+    return False
+
+
+def is_cacheable_result(var: VariableTracker):
+    if type(var) in (TensorVariable, ConstantVariable):
+        return True
+    if type(var) is TupleVariable:
+        return all(map(is_cacheable_result, var.items))
+    return False
+
+
+def inline_call(
+    func: VariableTracker,
+    sub_locals: Dict[str, VariableTracker],
+    closure_cells: Dict[str, VariableTracker],
+) -> Optional[InlineCall]:
+    """
+    Describe a call of func for the inline cache, or None if it can't be
+    cached.  Only plain functions without closures whose arguments are
+    tensors or hashable constants are cached: their FX nodes then depend
+    only on the argument types and shapes, the guarded globals and which
+    arguments alias each other.
+    """
+    if not config.cache_inline_calls or config.dynamic_shapes:
+        return None
+    if not config.dynamic_propagation:
+        # lookup() recomputes the example values of replayed nodes
+        return None
+    if type(func) is not UserFunctionVariable or closure_cells:
+        return None
+    if func.fn.__closure__:
+        return None
+
+    key = [func.get_code(), id(func.fn), torch.is_grad_enabled()]
+    arg_nodes = []
+    for name, value in sub_locals.items():
+        if type(value) is TensorVariable:
+            node = value.as_proxy().node
+            alias = arg_nodes.index(node) if node in arg_nodes else None
+            arg_nodes.append(node)
+            fields = tuple(getattr(value, f) for f in TENSOR_KEY_FIELDS)
+            key.append((name, TensorVariable, alias, fields))
+        elif type(value) is ConstantVariable and is_hashable(value.value):
+            key.append((name, type(value.value), value.value))
+        else:
+            return None
+    if not is_hashable(tuple(key)):
+        return None
+    guards = VariableTracker.propagate(list(sub_locals.values())).get(
+        "guards", frozenset()
+    )
+    return InlineCall(tuple(key), arg_nodes, frozenset(guards))
+
+
+def lookup(output, func, call: InlineCall) -> Optional[VariableTracker]:
+    """Replay a recorded inlining of func on new arguments"""
+    record: InlineCallRecord = output.inline_cache.get(call.key)
+    if record is None or record.fn is not func.fn:
+        counters["inline_cache"]["miss"] += 1
+        return None
+    if (
+        record.side_effects is not output.side_effects
+        or record.side_effects_version != output.side_effects.version
+        or any(getattr(n, "_erased", False) for n in record.nodes)
+    ):
+        del output.inline_cache[call.key]
+        counters["inline_cache"]["miss"] += 1
+        return None
+
+    env = dict(zip(record.arg_nodes, call.arg_nodes))
+
+    def lookup_node(node):
+        return env.get(node, node)
+
+    def stored_example_value(value):
+        if isinstance(value, torch.Tensor):
+            return TensorVariable.stored_example_value(value)
+        return value
+
+    for node in record.nodes:
+        new_node = output.create_node(
+            node.op,
+            node.target,
+            torch.fx.node.map_arg(node.args, lookup_node),
+            torch.fx.node.map_arg(node.kwargs, lookup_node),
+        )
+        env[node] = new_node
+        # rerun rather than share the recorded example values, which in-place
+        # ops on either copy would otherwise change for both
+        nnmodule = None
+        if node.op == "call_module":
+            nnmodule = output.get_submodule(node.target)
+        value = TensorVariable.compute_example_value(output, new_node, nnmodule)
+        new_node.meta["example_value"] = torch.fx.node.map_aggregate(
+            value, stored_example_value
+        )
+
+    def replace_proxy(var: VariableTracker):
+        if type(var) is TensorVariable:
+            node = lookup_node(var.as_proxy().node)
+            options = {}
+            value = node.meta.get("example_value")
+            if isinstance(value, torch.Tensor):
+                options = TensorVariable.specialize(value)
+            return var.clone(proxy=torch.fx.Proxy(node, output), **options)
+        return var
+
+    counters["inline_cache"]["hit"] += 1
+    result = VariableTracker.apply(replace_proxy, record.result)
+    return VariableTracker.apply(lambda var: var.add_guards(call.arg_guards), result)
+
+
+def checkpoint(output):
+    """State to pass to record() after inlining"""
+    return (
+        output.graph.checkpoint(),
+        output.side_effects,
+        output.side_effects.version,
+    )
+
+
+def record(output, func, call: InlineCall, state, result: VariableTracker):
+    """Save the FX nodes created since checkpoint() if the call was pure"""
+    graph_checkpoint, side_effects, version = state
+    if (
+        output.side_effects is not side_effects
+        or side_effects.version != version
+        or not is_cacheable_result(result)
+    ):
+        counters["inline_cache"]["uncacheable"] += 1
+        return
+    nodes = [
+        n
+        for n in output.graph.created_nodes[graph_checkpoint:]
+        if not getattr(n, "_erased", False)
+    ]
+    if any(n.op not in RECORDED_OPS or is_data_dependent(n) for n in nodes):
+        counters["inline_cache"]["uncacheable"] += 1
+        return
+    output.inline_cache[call.key] = InlineCallRecord(
+        func.fn, call.arg_nodes, nodes, result, side_effects, version
+    )
@@ -111,3 +111,39 @@ def has_mutation(gm, example_inputs):
         if node.meta["is_mutation"] or node.meta["is_input_mutation"]:
             return True
     return False
+
+
+# nn.Module types seen mutating their state in forward() despite
+# may_mutate_state() returning False
+_mutating_module_types = set()
+
+
+def may_mutate_state(mod: torch.nn.Module):
+    """
+    Conservatively check if calling mod could modify its parameters or
+    buffers.  Standard torch.nn leaf modules only update buffers (e.g.
+    BatchNorm running stats) in training mode.
+    """
+    cls = type(mod)
+    return (
+        cls in _mutating_module_types
+        or not cls.__module__.startswith("torch.nn.")
+        or next(mod.children(), None) is not None
+        or bool(mod._forward_pre_hooks or mod._forward_hooks)
+        or (mod.training and next(mod.buffers(), None) is not None)
+    )
+
+
+def state_versions(mod: torch.nn.Module):
+    return [t._version for t in itertools.chain(mod.parameters(), mod.buffers())]
+
+
+def check_state_versions(mod: torch.nn.Module, versions):
+    """
+    Compare against state_versions() from before calling mod, so a type
+    that mutated its state is always copied by later callers.
+    """
+    if state_versions(mod) != versions:
+        _mutating_module_types.add(type(mod))
+        return False
+    return True
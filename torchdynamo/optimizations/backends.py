@@ -58,6 +58,9 @@ def eager(subgraph):
     return subgraph.model
 
 
+eager.shape_polymorphic = True
+
+
 @create_backend
 def ts(subgraph):
     return subgraph.scripted
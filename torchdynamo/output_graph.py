@@ -15,12 +15,15 @@ from torch import fx
 
 import torchdynamo
 
+from . import async_compile
 from . import config
+from . import persistent_cache
 from . import variables
 from .bytecode_transformation import Instruction
 from .bytecode_transformation import create_instruction
 from .bytecode_transformation import unique_id
 from .codegen import PyCodegen
+from .compile_profiler import profiled
 from .exc import unimplemented
 from .guards import GuardBuilder
 from .mutation_guard import is_dynamic_nn_module
@@ -28,8 +31,11 @@ from .side_effects import SideEffects
 from .source import LocalSource
 from .source import Source
 from .utils import CleanupHook
+from .utils import clone_inputs
 from .utils import count_calls
 from .utils import counters
+from .utils import preserve_rng_state
+from .utils import to_meta
 from .variables.nn_module import NNModuleVariable
 from .variables.tensor import TensorVariable
 
@@ -46,6 +52,85 @@ class FakeRootModule(torch.nn.Module):
         return "FakeRootModule(...)"
 
 
+class CheckpointedGraph(fx.Graph):
+    """fx.Graph that remembers node creation order for restore_graphstate()"""
+
+    def __init__(self, *args, **kwargs):
+        super(CheckpointedGraph, self).__init__(*args, **kwargs)
+        self.created_nodes = []
+
+    def create_node(self, *args, **kwargs):
+        node = super(CheckpointedGraph, self).create_node(*args, **kwargs)
+        self.created_nodes.append(node)
+        return node
+
+    def checkpoint(self):
+        return len(self.created_nodes)
+
+    def restore(self, checkpoint):
+        """Erase nodes created since checkpoint"""
+        assert checkpoint <= len(self.created_nodes), "checkpoint restored twice"
+        for node in reversed(self.created_nodes[checkpoint:]):
+            if not getattr(node, "_erased", False):
+                self.erase_node(node)
+        del self.created_nodes[checkpoint:]
+
+
+class GuardSet(set):
+    """set() of guards that can undo additions made since a checkpoint"""
+
+    def __init__(self):
+        super(GuardSet, self).__init__()
+        self.added = []
+
+    def add(self, guard):
+        if guard not in self:
+            super(GuardSet, self).add(guard)
+            self.added.append(guard)
+
+    def update(self, *others):
+        for other in others:
+            for guard in other:
+                self.add(guard)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def checkpoint(self):
+        return len(self.added)
+
+    def restore(self, checkpoint):
+        assert checkpoint <= len(self.added), "checkpoint restored twice"
+        for guard in self.added[checkpoint:]:
+            self.discard(guard)
+        del self.added[checkpoint:]
+
+
+def call_compiler_fn(compiler_fn, gm, example_inputs, fallback):
+    """Run a backend, reporting errors and returning fallback if it fails"""
+    try:
+        compiled_fn = compiler_fn(gm, example_inputs)
+        assert callable(compiled_fn), "compiler_fn did not return callable"
+    except Exception:
+        sys.stderr.write("-" * 40 + "\n")
+        sys.stderr.write("TORCHDYNAMO: backend compiler failed\n")
+        traceback.print_exc()
+        sys.stderr.write("-" * 40 + "\n")
+        compiled_fn = fallback
+        if config.raise_on_backend_error:
+            raise
+    return compiled_fn
+
+
+def is_shape_polymorphic(compiler_fn):
+    """
+    True if compiler_fn returns graphs that work for any input size, so
+    their guards may use config.ranged_shapes
+    """
+    return getattr(compiler_fn, "shape_polymorphic", False)
+
+
 class OutputGraph(fx.Tracer):
     """
     Wrapper class to hold outputs of InstructionTranslator.  Mainly the
@@ -62,9 +147,9 @@ class OutputGraph(fx.Tracer):
         super(OutputGraph, self).__init__()
 
         # Mutable state checkpointed by copy_graphstate()
-        self.graph = torch.fx.Graph()
+        self.graph = CheckpointedGraph()
         self.graphargs = []
-        self.guards = set()
+        self.guards = GuardSet()
         self.nn_modules = dict()
         self.side_effects = SideEffects()
         self.code_options = dict(code_options)
@@ -76,35 +161,84 @@ class OutputGraph(fx.Tracer):
         self.root_tx = root_tx
         self.cleanups = []
         self.should_exit = False
+        # input name => dims allowed to vary under config.ranged_shapes
+        self.dynamic_dims = dict()
+        self.allow_dynamic_dims = config.ranged_shapes is not None
+        # nn_modules key => source, and compiled fn global => GraphRecord
+        # for persistent_cache
+        self.nn_module_sources = dict()
+        self.graph_records = dict()
+        # code => function of everything inlined, for persistent_cache
+        self.inlined_functions = dict()
+        # nn_modules key => (module, copy on the meta device) for
+        # config.meta_propagation
+        self.meta_nn_modules = dict()
+        # inline_cache.py key => InlineCallRecord
+        self.inline_cache = dict()
 
     @property
     def output(self):
         return self
 
+    def meta_module(self, module_key: str, mod: torch.nn.Module):
+        """
+        A copy of mod whose parameters and buffers are meta tensors, made
+        without copying any tensor data
+        """
+        cached = self.meta_nn_modules.get(module_key)
+        if cached is None or cached[0] is not mod:
+            memo = dict()
+            for tensor in itertools.chain(mod.parameters(), mod.buffers()):
+                memo[id(tensor)] = to_meta(tensor)
+            cached = (mod, copy.deepcopy(mod, memo))
+            self.meta_nn_modules[module_key] = cached
+        return cached[1]
+
+    def record_dynamic_dims(self, name: str, dims):
+        if self.allow_dynamic_dims and dims:
+            self.dynamic_dims[name] = tuple(dims)
+
+    def specialize_shapes(self):
+        """Tracing read a size/stride, so guard on exact shapes"""
+        self.allow_dynamic_dims = False
+        self.dynamic_dims.clear()
+
     def copy_graphstate(self):
-        """Create a checkpoint of the current state by copying everything"""
-        graph_nodes = set(self.graph.nodes)
+        """
+        Create a checkpoint of the current state in O(1).  The graph,
+        graphargs, guards and nn_modules only grow between checkpoints, so
+        we record their sizes and undo later additions in restore_graphstate().
+        SideEffects copies its containers on the next write instead.
+        Checkpoints must be restored newest first.
+        """
         return (
-            graph_nodes,
-            list(self.graphargs),
-            copy.deepcopy(self.guards),
-            dict(self.nn_modules),
-            self.side_effects.clone(),
+            self.graph.checkpoint(),
+            len(self.graphargs),
+            self.guards.checkpoint(),
+            len(self.nn_modules),
+            self.side_effects.checkpoint(),
         )
 
     def restore_graphstate(self, state):
         """Restore a checkpoint created by self.copy_graphstate()"""
         (
-            graph_nodes,
-            self.graphargs,
-            self.guards,
-            self.nn_modules,
+            graph_checkpoint,
+            num_graphargs,
+            guards_checkpoint,
+            num_nn_modules,
             self.side_effects,
         ) = state
         # FX deepcopy doesn't work for a partially created graph, so just remove new nodes
-        for node in reversed(list(self.graph.nodes)):
-            if node not in graph_nodes:
-                self.graph.erase_node(node)
+        self.graph.restore(graph_checkpoint)
+        del self.graphargs[num_graphargs:]
+        self.guards.restore(guards_checkpoint)
+        for name in list(self.nn_modules.keys())[num_nn_modules:]:
+            del self.nn_modules[name]
+        # records may refer to erased nodes
+        self.inline_cache.clear()
+        # fallback values may include the effect of erased in-place ops
+        for node in self.graph.nodes:
+            node.meta.pop("fallback_value", None)
 
     def count_calls(self):
         return count_calls(self.graph)
@@ -192,11 +326,13 @@ class OutputGraph(fx.Tracer):
         for i in itertools.count():
             if name not in self.nn_modules:
                 self.nn_modules[name] = mod
+                self.nn_module_sources[name] = source
                 return wrap_name(name)
             name = f"{base}_{i}"
 
         assert False
 
+    @profiled("compile_subgraph")
     def compile_subgraph(self, tx, partial_convert=False):
         """
         Generate a subgraph to continue execution on user code.
@@ -287,6 +423,9 @@ class OutputGraph(fx.Tracer):
             "output", "output", (self.create_arg(tuple(x.as_proxy() for x in rv)),), {}
         )
         self.remove_unused_graphargs()
+        if self.dynamic_dims and not is_shape_polymorphic(self.compiler_fn):
+            # the compiled graph may be specialized to the example inputs
+            self.specialize_shapes()
         ncalls = count_calls(self.graph)
         counters["stats"]["calls_captured"] += ncalls
         counters["stats"]["fusions_possible"] += ncalls - 1
@@ -294,16 +433,28 @@ class OutputGraph(fx.Tracer):
         if config.dynamic_propagation:
             # free a bit of memory
             for node in self.graph.nodes:
-                if "example_value" in node.meta:
-                    del node.meta["example_value"]
+                node.meta.pop("example_value", None)
+                node.meta.pop("real_value", None)
+                node.meta.pop("fallback_value", None)
+            self.meta_nn_modules.clear()
 
         gm = fx.GraphModule(root, self.graph)
         gm.recompile()
         name = unique_id("__compiled_fn")
-        compiled_fn = self.call_user_compiler(gm)
-        compiled_fn = torchdynamo.disable(compiled_fn)
+        if persistent_cache.enabled():
+            self.graph_records[name] = persistent_cache.GraphRecord.create(
+                gm, self.graphargs, self.nn_module_sources
+            )
+        if config.async_compile:
+            self.install_global_async(name, gm)
+        else:
+            compiled_fn = self.call_user_compiler(gm)
+            record = self.graph_records.get(name)
+            if record is not None:
+                record.save_artifact(compiled_fn, self.compiler_fn)
+            compiled_fn = torchdynamo.disable(compiled_fn)
+            self.install_global(name, compiled_fn)
         counters["stats"]["unique_graphs"] += 1
-        self.install_global(name, compiled_fn)
         if config.debug:
             print(f"\n{name} {gm.forward.__code__.co_filename}")
             self.graph.print_tabular()
@@ -312,19 +463,39 @@ class OutputGraph(fx.Tracer):
         cg.make_call_generated_code(name)
         return cg.get_instructions()
 
+    @profiled("backend_compile")
     def call_user_compiler(self, gm):
-        try:
-            compiled_fn = self.compiler_fn(gm, self.example_inputs())
-            assert callable(compiled_fn), "compiler_fn did not return callable"
-        except Exception:
-            sys.stderr.write("-" * 40 + "\n")
-            sys.stderr.write("TORCHDYNAMO: backend compiler failed\n")
-            traceback.print_exc()
-            sys.stderr.write("-" * 40 + "\n")
-            compiled_fn = gm.forward
-            if config.raise_on_backend_error:
-                raise
-        return compiled_fn
+        # backends may run the graph
+        with preserve_rng_state():
+            return call_compiler_fn(
+                self.compiler_fn, gm, self.example_inputs(), gm.forward
+            )
+
+    def install_global_async(self, name, gm):
+        """
+        Install gm.forward as `name` right away and replace it with the
+        result of self.compiler_fn once that finishes in the background.
+        """
+        from .convert_frame import wrap_convert_context
+
+        # the backend may mutate the graph and submodules it is given
+        # (fusion, dtype conversion, weight folding) while this runs
+        eager_fn = torchdynamo.disable(copy.deepcopy(gm).forward)
+        self.install_global(name, eager_fn)
+        scope = self.root_globals
+        compiler_fn = self.compiler_fn
+        example_inputs = clone_inputs(self.example_inputs())
+        grad_enabled = torch.is_grad_enabled()
+
+        def compile_and_swap():
+            torch._C._set_grad_enabled(grad_enabled)
+            compiled_fn = call_compiler_fn(compiler_fn, gm, example_inputs, eager_fn)
+            # the global is gone if the cache entry was evicted meanwhile
+            if compiled_fn is not eager_fn and scope.get(name) is eager_fn:
+                scope[name] = torchdynamo.disable(compiled_fn)
+
+        # the RNG is shared with the user program, see config.async_compile
+        async_compile.submit(wrap_convert_context(compile_and_swap, preserve_rng=False))
 
     def example_inputs(self):
         result = []
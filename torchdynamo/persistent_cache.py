@@ -0,0 +1,822 @@
+"""
+On-disk cache of converted frames, enabled by config.persistent_cache_dir
+(or TORCHDYNAMO_CACHE_DIR=...).
+
+Each original code object, keyed on (co_filename, co_firstlineno, hash of
+its bytecode/names/consts), backend, python/torch versions, a hash of
+torchdynamo's sources and the config options that change tracing, gets one
+file holding a list of entries.  An entry stores:
+
+    - the rewritten bytecode (marshal)
+    - its guards, together with a process independent fingerprint of the
+      value each guard was created from (type names instead of ids, etc)
+    - the names and code hashes of the functions it inlined
+    - the FX graphs it calls, as a list of nodes plus the sources of their
+      inputs and nn.Modules
+    - resume functions and module/function aliases it loads from globals
+
+On a cache miss in a new process, convert_frame_assert() looks for an
+entry whose fingerprints match the current frame, installs its globals,
+recompiles its graphs with the backend (or loads a saved TorchScript
+artifact, see config.persistent_cache_artifacts) and builds the guards
+from scratch, skipping InstructionTranslator and transform_code_object.
+
+Frames with guards on objects that have no stable name across processes
+(ID_MATCH of a local object, etc) are not saved.
+"""
+import collections
+import dataclasses
+import functools
+import hashlib
+import importlib
+import itertools
+import logging
+import marshal
+import os
+import pickle
+import re
+import sys
+import tempfile
+import types
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import torch
+from torch import fx
+
+import torchdynamo
+
+from . import config
+from .allowed_functions import _allowed_function_ids
+from .allowed_functions import _builtin_function_ids
+from .allowed_functions import _numpy_function_ids
+from .bytecode_transformation import unique_id
+from .guards import CLOSURE_VARS
+from .guards import Guard
+from .guards import GuardBuilder
+from .guards import GuardSource
+from .utils import CleanupHook
+from .utils import counters
+from .utils import istype
+from .utils import preserve_rng_state
+from .utils import rename_implicit
+from .utils import tuple_iterator_len
+
+log = logging.getLogger(__name__)
+
+# bump when the file format changes
+VERSION = 2
+
+
+class Unpersistable(Exception):
+    """Raised for frames that can't be written to the persistent cache"""
+
+    pass
+
+
+def enabled():
+    # code.replace() is python 3.8+
+    return bool(config.persistent_cache_dir) and sys.version_info >= (3, 8)
+
+
+def resolve_name(name: str):
+    """
+    "torch.nn.functional.relu" => torch.nn.functional.relu
+    """
+    parts = name.split(".")
+    for i in range(len(parts), 0, -1):
+        try:
+            obj = importlib.import_module(".".join(parts[:i]))
+        except ImportError:
+            continue
+        for attr in parts[i:]:
+            obj = getattr(obj, attr)
+        return obj
+    raise ImportError(name)
+
+
+def object_name(obj) -> str:
+    """A name that resolve_name() maps back to obj, in any process"""
+    if isinstance(obj, types.ModuleType):
+        candidates = [obj.__name__]
+    else:
+        candidates = [
+            table[id(obj)]
+            for table in (
+                _allowed_function_ids(),
+                _builtin_function_ids(),
+                _numpy_function_ids(),
+            )
+            if id(obj) in table
+        ]
+        module = getattr(obj, "__module__", None)
+        qualname = getattr(obj, "__qualname__", None)
+        if module and qualname and "<locals>" not in qualname:
+            candidates.append(f"{module}.{qualname}")
+    for name in candidates:
+        try:
+            if resolve_name(name) is obj:
+                return name
+        except (ImportError, AttributeError):
+            pass
+    raise Unpersistable(f"no stable name for {type(obj).__name__}")
+
+
+def type_name(cls: type) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def code_hash(code: types.CodeType) -> str:
+    """Hash everything about code that affects its execution"""
+    h = hashlib.sha256()
+    for attr in (
+        "co_argcount",
+        "co_kwonlyargcount",
+        "co_flags",
+        "co_code",
+        "co_names",
+        "co_varnames",
+        "co_freevars",
+        "co_cellvars",
+    ):
+        h.update(repr(getattr(code, attr)).encode("utf-8"))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            h.update(code_hash(const).encode("utf-8"))
+        else:
+            h.update(f"{type(const).__name__}:{const!r}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def backend_name(compiler_fn) -> str:
+    if not hasattr(compiler_fn, "__qualname__"):
+        compiler_fn = type(compiler_fn)
+    return f"{compiler_fn.__module__}.{compiler_fn.__qualname__}"
+
+
+@functools.lru_cache(None)
+def source_hash() -> str:
+    """Hash of torchdynamo's own sources, setup.py's version is rarely bumped"""
+    h = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith((".py", ".c", ".cpp", ".so", ".pyd")):
+                path = os.path.join(dirpath, name)
+                h.update(os.path.relpath(path, root).encode("utf-8"))
+                with open(path, "rb") as fd:
+                    h.update(fd.read())
+    return h.hexdigest()
+
+
+def frame_key(code: types.CodeType, compiler_fn) -> str:
+    h = hashlib.sha256()
+    for part in (
+        VERSION,
+        sys.version,
+        torch.__version__,
+        source_hash(),
+        backend_name(compiler_fn),
+        code.co_filename,
+        code.co_firstlineno,
+        code_hash(code),
+        # options that change what gets traced
+        config.dynamic_shapes,
+        config.ranged_shapes,
+        tuple(config.ranged_shapes_dims),
+        config.guard_nn_modules,
+        config.dead_code_elimination,
+        config.minimum_call_count,
+        config.normalize_ir,
+        config.dynamic_propagation,
+        config.meta_propagation,
+        config.cache_inline_calls,
+        tuple(
+            sorted(
+                (backend_name(fn), repr(value))
+                for fn, value in config.constant_functions.items()
+            )
+        ),
+        tuple(sorted(map(type_name, config.traceable_tensor_subclasses))),
+    ):
+        h.update(repr(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+def frame_path(code: types.CodeType, compiler_fn) -> str:
+    return os.path.join(
+        config.persistent_cache_dir, "frames", f"{frame_key(code, compiler_fn)}.pkl"
+    )
+
+
+def guard_scope(source: GuardSource, f_locals, f_globals):
+    """The scope GuardBuilder evaluates guards from `source` in"""
+    if source.is_local():
+        return {rename_implicit(k): v for k, v in f_locals.items()}
+    return f_globals
+
+
+def eval_source(name: str, source: GuardSource, f_locals, f_globals):
+    return eval(name, guard_scope(source, f_locals, f_globals), CLOSURE_VARS)
+
+
+def constant_fingerprint(value):
+    if istype(value, (set, frozenset)):
+        return (
+            type_name(type(value)),
+            tuple(sorted(map(constant_fingerprint, value), key=repr)),
+        )
+    if istype(value, (tuple, list)):
+        return (type_name(type(value)), tuple(map(constant_fingerprint, value)))
+    if istype(value, (dict, collections.OrderedDict)):
+        return (
+            type_name(type(value)),
+            tuple(
+                (constant_fingerprint(k), constant_fingerprint(v))
+                for k, v in value.items()
+            ),
+        )
+    if istype(
+        value,
+        (
+            int,
+            float,
+            bool,
+            type(None),
+            str,
+            bytes,
+            slice,
+            range,
+            torch.Size,
+            torch.device,
+            torch.dtype,
+            np.int8,
+            np.int16,
+            np.int32,
+            np.int64,
+            np.uint8,
+            np.uint16,
+            np.uint32,
+            np.uint64,
+        ),
+    ):
+        return (type_name(type(value)), repr(value))
+    if isinstance(value, (type, types.ModuleType)) or callable(value):
+        return ("object", object_name(value))
+    raise Unpersistable(f"constant of type {type(value).__name__}")
+
+
+def tensor_fingerprint(value: torch.Tensor, dynamic_dims):
+    dynamic_dims = set(dynamic_dims or ())
+    sizes = tuple(None if i in dynamic_dims else s for i, s in enumerate(value.size()))
+    strides = tuple(
+        None if i in dynamic_dims else s for i, s in enumerate(value.stride())
+    )
+    if dynamic_dims:
+        # ranged guards still require contiguity
+        strides = (strides, value.is_contiguous())
+    return (
+        type_name(type(value)),
+        str(value.dtype),
+        str(value.device),
+        value.requires_grad,
+        sizes,
+        strides,
+    )
+
+
+def module_fingerprint(value: torch.nn.Module):
+    """
+    id() based guards become a check on everything tracing may have read
+    from the module: the type and plain attributes of each submodule, and
+    the metadata of their parameters and buffers
+    """
+    result = []
+    for name, module in value.named_modules():
+        attrs = []
+        for key, attr in sorted(vars(module).items()):
+            if key in ("_parameters", "_buffers", "_modules"):
+                continue
+            if isinstance(attr, torch.Tensor):
+                attrs.append((key, tensor_fingerprint(attr, None)))
+            else:
+                attrs.append((key, constant_fingerprint(attr)))
+        tensors = tuple(
+            (key, None if tensor is None else tensor_fingerprint(tensor, None))
+            for key, tensor in itertools.chain(
+                module._parameters.items(), module._buffers.items()
+            )
+        )
+        result.append((name, type_name(type(module)), tuple(attrs), tensors))
+    return tuple(result)
+
+
+def guard_fingerprint(guard: Guard, f_locals, f_globals, dynamic_dims):
+    """
+    A picklable summary of the value `guard` was created from, equal in
+    two processes iff the guard would accept the same values
+    """
+    kind = guard.create_fn.__name__
+    if getattr(GuardBuilder, kind, None) is not guard.create_fn:
+        raise Unpersistable(f"unknown guard {kind}")
+    if kind == "GRAD_MODE":
+        return torch.is_grad_enabled()
+    if kind == "HASATTR":
+        base, attr = guard.name.rsplit(".", 1)
+        value = eval_source(base, guard.source, f_locals, f_globals)
+        return (type_name(type(value)), hasattr(value, attr))
+
+    value = eval_source(guard.name, guard.source, f_locals, f_globals)
+    if kind == "TENSOR_MATCH":
+        if guard.is_nn_module():
+            raise Unpersistable("id of nn.Module tensor")
+        return tensor_fingerprint(value, dynamic_dims.get(guard.name))
+    if kind in ("TYPE_MATCH", "OBJECT_MUTATION"):
+        if isinstance(value, torch.nn.Module):
+            return module_fingerprint(value)
+        return type_name(type(value))
+    if kind == "NN_MODULE":
+        return module_fingerprint(value)
+    if kind in (
+        "ID_MATCH",
+        "FUNCTION_MATCH",
+        "BUILTIN_MATCH",
+        "PYMODULE_MATCH",
+        "CONSTANT_MATCH",
+        "EQUALS_MATCH",
+    ):
+        return constant_fingerprint(value)
+    if kind == "LIST_LENGTH":
+        return (type_name(type(value)), len(value))
+    if kind == "TUPLE_ITERATOR_LEN":
+        return (type_name(type(value)), tuple_iterator_len(value))
+    if kind in ("DICT_KEYS", "ODICT_KEYS"):
+        return (
+            type_name(type(value)),
+            tuple(map(constant_fingerprint, value.keys())),
+        )
+    if kind == "NN_MODULE_PARAM_NAMES":
+        return (
+            type_name(type(value)),
+            tuple(sorted(k for k, v in value.named_parameters())),
+        )
+    raise Unpersistable(f"guard {kind}")
+
+
+@dataclasses.dataclass
+class NodeRef:
+    name: str
+
+
+@dataclasses.dataclass
+class QualifiedName:
+    name: str
+
+
+def encode_arg(arg):
+    """Replace fx.Nodes in a node's args with NodeRefs"""
+    if isinstance(arg, fx.Node):
+        return NodeRef(arg.name)
+    if istype(arg, torch.Size):
+        return arg
+    if isinstance(arg, tuple) and not hasattr(arg, "_fields"):
+        return tuple(map(encode_arg, arg))
+    if isinstance(arg, list):
+        return list(map(encode_arg, arg))
+    if isinstance(arg, dict):
+        return {k: encode_arg(v) for k, v in arg.items()}
+    if isinstance(arg, slice):
+        return slice(encode_arg(arg.start), encode_arg(arg.stop), encode_arg(arg.step))
+    if callable(arg) and not isinstance(arg, type):
+        return QualifiedName(object_name(arg))
+    return arg
+
+
+def decode_arg(arg, env: Dict[str, fx.Node]):
+    if isinstance(arg, NodeRef):
+        return env[arg.name]
+    if isinstance(arg, QualifiedName):
+        return resolve_name(arg.name)
+    if istype(arg, torch.Size):
+        return arg
+    if isinstance(arg, tuple):
+        return tuple(decode_arg(x, env) for x in arg)
+    if isinstance(arg, list):
+        return [decode_arg(x, env) for x in arg]
+    if isinstance(arg, dict):
+        return {k: decode_arg(v, env) for k, v in arg.items()}
+    if isinstance(arg, slice):
+        return slice(
+            decode_arg(arg.start, env),
+            decode_arg(arg.stop, env),
+            decode_arg(arg.step, env),
+        )
+    return arg
+
+
+@dataclasses.dataclass
+class GraphRecord:
+    """An fx.Graph and where to find its inputs/submodules in a frame"""
+
+    # (op, name, target, args, kwargs)
+    nodes: List[Tuple[str, str, Any, Any, Any]]
+    # root attribute => (source name, GuardSource name)
+    modules: Dict[str, Tuple[str, str]]
+    # (source name, GuardSource name) for each placeholder
+    inputs: List[Tuple[str, str]]
+    # TorchScript file saved from the backend result
+    artifact: Optional[str] = None
+    artifact_key: Optional[str] = None
+
+    @staticmethod
+    def create(gm: fx.GraphModule, graphargs, nn_module_sources):
+        """Returns None for graphs that can't be persisted"""
+        from .variables.builder import GraphArg
+
+        try:
+            nodes = []
+            modules = dict()
+            for node in gm.graph.nodes:
+                target = node.target
+                if node.op == "call_function":
+                    target = QualifiedName(object_name(target))
+                elif node.op in ("call_module", "get_attr"):
+                    root = target.split(".")[0]
+                    source = nn_module_sources[root]
+                    modules[root] = (source.name(), source.guard_source().name)
+                nodes.append(
+                    (
+                        node.op,
+                        node.name,
+                        target,
+                        encode_arg(node.args),
+                        encode_arg(node.kwargs),
+                    )
+                )
+            inputs = []
+            for arg in graphargs:
+                if not istype(arg, GraphArg) or not isinstance(
+                    arg.example, torch.Tensor
+                ):
+                    raise Unpersistable("non-tensor graph input")
+                inputs.append((arg.source.name(), arg.source.guard_source().name))
+            record = GraphRecord(nodes, modules, inputs)
+            if config.persistent_cache_artifacts:
+                record.artifact_key = artifact_key(gm, graphargs)
+            return record
+        except (Unpersistable, KeyError) as e:
+            log.debug(f"persistent_cache: graph not saved: {e}")
+            return None
+
+    def save_artifact(self, compiled_fn, compiler_fn):
+        if self.artifact_key is None or not isinstance(
+            compiled_fn, (torch.jit.ScriptModule, torch.jit.ScriptFunction)
+        ):
+            return
+        backend = hashlib.sha256(backend_name(compiler_fn).encode("utf-8"))
+        name = f"{backend.hexdigest()[:16]}_{self.artifact_key}.pt"
+        path = os.path.join(config.persistent_cache_dir, "graphs", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            torch.jit.save(compiled_fn, path)
+            self.artifact = name
+        except Exception:
+            log.exception("persistent_cache: failed to save backend result")
+
+    def load(self, f_locals, f_globals):
+        """Returns (gm, example_inputs)"""
+        from .output_graph import FakeRootModule
+
+        graph = fx.Graph()
+        env = dict()
+        for op, name, target, args, kwargs in self.nodes:
+            if isinstance(target, QualifiedName):
+                target = resolve_name(target.name)
+            env[name] = graph.create_node(
+                op, target, decode_arg(args, env), decode_arg(kwargs, env), name
+            )
+        root = FakeRootModule(
+            {
+                key: eval_source(name, GuardSource[source], f_locals, f_globals)
+                for key, (name, source) in self.modules.items()
+            }
+        )
+        gm = fx.GraphModule(root, graph)
+        example_inputs = [
+            eval_source(name, GuardSource[source], f_locals, f_globals)
+            for name, source in self.inputs
+        ]
+        return gm, example_inputs
+
+    def compile(self, gm, example_inputs, compiler_fn):
+        from .output_graph import call_compiler_fn
+
+        # like call_user_compiler(), a cache hit mustn't advance the RNG
+        with preserve_rng_state():
+            if self.artifact is not None:
+                path = os.path.join(
+                    config.persistent_cache_dir, "graphs", self.artifact
+                )
+                if os.path.exists(path):
+                    counters["persistent_cache"]["artifacts_loaded"] += 1
+                    return torch.jit.load(path)
+            return call_compiler_fn(compiler_fn, gm, example_inputs, gm.forward)
+
+
+def artifact_key(gm: fx.GraphModule, graphargs):
+    """graph_hash() plus a hash of the weights saved in the artifact"""
+    from .optimizations.inference import graph_hash
+
+    example_inputs = [arg.example for arg in graphargs]
+    h = hashlib.sha256(graph_hash(gm, example_inputs).encode("utf-8"))
+    for name, value in itertools.chain(gm.named_parameters(), gm.named_buffers()):
+        value = value.detach().cpu().contiguous()
+        if value.dtype in (torch.bfloat16, torch.float16):
+            value = value.float()
+        h.update(name.encode("utf-8"))
+        h.update(str(value.dtype).encode("utf-8"))
+        h.update(value.numpy().tobytes())
+    return h.hexdigest()[:40]
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    code: bytes
+    # (name, GuardSource name, GuardBuilder method, fingerprint)
+    guards: List[Tuple[str, str, str, Any]]
+    dynamic_dims: Dict[str, Tuple[int, ...]]
+    # installed global => GraphRecord
+    graphs: Dict[str, GraphRecord]
+    # installed global => marshaled resume function code
+    functions: Dict[str, bytes]
+    # global => qualified name of the module/function it aliases
+    aliases: Dict[str, str]
+    # qualified name => code_hash() of each inlined function
+    inlined: Dict[str, str]
+
+    def create_guards(self):
+        return {
+            Guard(name, GuardSource[source], getattr(GuardBuilder, kind))
+            for name, source, kind, _ in self.guards
+        }
+
+    def matches(self, f_locals, f_globals, aliases):
+        for name, expected in self.inlined.items():
+            try:
+                if code_hash(resolve_name(name).__code__) != expected:
+                    return False
+            except (ImportError, AttributeError):
+                return False
+        scope = None
+        for name, source, kind, expected in self.guards:
+            guard = Guard(name, GuardSource[source], getattr(GuardBuilder, kind))
+            guard_globals = f_globals
+            if not aliases.keys().isdisjoint(re.findall(r"[A-Za-z_]\w*", name)):
+                # guards may read through aliases like __import_foo, eval()
+                # needs a real dict for globals so copy them (once) instead
+                # of using a ChainMap
+                if scope is None:
+                    scope = {**f_globals, **aliases}
+                guard_globals = scope
+            try:
+                actual = guard_fingerprint(
+                    guard, f_locals, guard_globals, self.dynamic_dims
+                )
+            except Exception:
+                return False
+            if actual != expected:
+                return False
+        return True
+
+
+def all_co_names(code: types.CodeType):
+    yield from code.co_names
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from all_co_names(const)
+
+
+def all_nested_codes(code: types.CodeType):
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield const
+            yield from all_nested_codes(const)
+
+
+def inlined_fingerprints(f_code: types.CodeType, inlined_functions):
+    """
+    Name => code_hash() of the functions inlined while tracing f_code.
+    Nested functions are covered by the hash of the code defining them.
+    """
+    result = dict()
+    unnamed = []
+    for code, fn in inlined_functions.items():
+        try:
+            if getattr(fn, "__code__", None) is not code:
+                raise Unpersistable("function without __code__")
+            result[object_name(fn)] = code_hash(code)
+        except Unpersistable:
+            unnamed.append(code)
+    if unnamed:
+        nested = set()
+        for code in itertools.chain(
+            [f_code], (resolve_name(name).__code__ for name in result)
+        ):
+            nested.update(map(id, all_nested_codes(code)))
+        if any(id(code) not in nested for code in unnamed):
+            raise Unpersistable("inlined function without a stable name")
+    return result
+
+
+def rename_globals(code: types.CodeType, renames: Dict[str, str]):
+    return code.replace(
+        co_names=tuple(renames.get(name, name) for name in code.co_names),
+        co_consts=tuple(
+            rename_globals(const, renames)
+            if isinstance(const, types.CodeType)
+            else const
+            for const in code.co_consts
+        ),
+    )
+
+
+def create_entry(frame, code: types.CodeType, output):
+    f_locals, f_globals = frame.f_locals, frame.f_globals
+    guards = []
+    for guard in sorted(output.guards, key=Guard.sort_key):
+        if not config.guard_nn_modules and guard.is_nn_module():
+            continue
+        guards.append(
+            (
+                guard.name,
+                guard.source.name,
+                guard.create_fn.__name__,
+                guard_fingerprint(guard, f_locals, f_globals, output.dynamic_dims),
+            )
+        )
+
+    graphs = dict()
+    functions = dict()
+    for hook in output.cleanups:
+        if not (isinstance(hook, CleanupHook) and hook.scope is f_globals):
+            raise Unpersistable("unknown cleanup")
+        value = f_globals[hook.name]
+        if hook.name in output.graph_records:
+            if output.graph_records[hook.name] is None:
+                raise Unpersistable("graph")
+            graphs[hook.name] = output.graph_records[hook.name]
+        elif (
+            isinstance(value, types.FunctionType)
+            and value.__globals__ is f_globals
+            and not value.__closure__
+            and not value.__defaults__
+        ):
+            functions[hook.name] = marshal.dumps(value.__code__)
+        else:
+            raise Unpersistable(f"installed global {type(value).__name__}")
+
+    # globals created by tracing without a cleanup, e.g. __import_torch
+    aliases = dict()
+    original_names = set(all_co_names(frame.f_code))
+    for name in set(all_co_names(code)) - original_names:
+        if name in graphs or name in functions or name not in f_globals:
+            continue
+        aliases[name] = object_name(f_globals[name])
+
+    try:
+        code_bytes = marshal.dumps(code)
+    except ValueError:
+        raise Unpersistable("unmarshallable constant")
+    return CacheEntry(
+        code_bytes,
+        guards,
+        dict(output.dynamic_dims),
+        graphs,
+        functions,
+        aliases,
+        inlined_fingerprints(frame.f_code, output.inlined_functions),
+    )
+
+
+# path => (stat of the file, entries read from it), so misses of a frame
+# don't unpickle its file again until another process rewrites it
+_read_cache = dict()
+
+
+def read_entries(path: str) -> List[CacheEntry]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return []
+    stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _read_cache.get(path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+    try:
+        with open(path, "rb") as fd:
+            data = pickle.load(fd)
+    except FileNotFoundError:
+        return []
+    except Exception:
+        log.warning(f"persistent_cache: ignoring unreadable {path}")
+        data = []
+    _read_cache[path] = (stat_key, data)
+    return data
+
+
+def write_entries(path: str, entries: List[CacheEntry]):
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    # write + rename so concurrent processes never see partial files
+    fd, tmp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entries, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def save(frame, compiler_fn, code: types.CodeType, output):
+    """Write the result of converting `frame` to the cache"""
+    try:
+        entry = create_entry(frame, code, output)
+        pickle.dumps(entry)
+    except Exception as e:
+        # Unpersistable, or an object pickle/marshal can't handle
+        counters["persistent_cache"]["unsupported"] += 1
+        log.debug(f"persistent_cache: {frame.f_code.co_name} not saved: {e}")
+        return
+    path = frame_path(frame.f_code, compiler_fn)
+    entries = [
+        other for other in read_entries(path) if other.guards != entry.guards
+    ] + [entry]
+    try:
+        write_entries(path, entries[-config.cache_size_limit :])
+    except OSError:
+        log.exception(f"persistent_cache: failed to write {path}")
+        return
+    counters["persistent_cache"]["saves"] += 1
+
+
+def load(frame, compiler_fn):
+    """
+    Install the globals of a matching cache entry.
+    Returns (code, guards, cleanups, dynamic_dims) or None.
+    """
+    f_locals, f_globals = frame.f_locals, frame.f_globals
+    for entry in reversed(read_entries(frame_path(frame.f_code, compiler_fn))):
+        try:
+            aliases = {
+                name: resolve_name(qualname) for name, qualname in entry.aliases.items()
+            }
+        except (ImportError, AttributeError):
+            continue
+        if any(
+            name in f_globals and f_globals[name] is not value
+            for name, value in aliases.items()
+        ):
+            continue
+        if not entry.matches(f_locals, f_globals, aliases):
+            continue
+        f_globals.update(aliases)
+
+        renames = dict()
+        for name in itertools.chain(entry.graphs.keys(), entry.functions.keys()):
+            renames[name] = unique_id(name.rsplit("_", 1)[0])
+        cleanups = []
+        try:
+            for name, code_bytes in entry.functions.items():
+                fn = types.FunctionType(
+                    marshal.loads(code_bytes), f_globals, renames[name]
+                )
+                cleanups.append(CleanupHook.create(f_globals, renames[name], fn))
+            for name, record in entry.graphs.items():
+                gm, example_inputs = record.load(f_locals, f_globals)
+                compiled_fn = record.compile(gm, example_inputs, compiler_fn)
+                compiled_fn = torchdynamo.disable(compiled_fn)
+                cleanups.append(
+                    CleanupHook.create(f_globals, renames[name], compiled_fn)
+                )
+        except Exception:
+            if config.raise_on_backend_error:
+                raise
+            log.exception("persistent_cache: failed to load entry")
+            for hook in cleanups:
+                hook()
+            continue
+        counters["persistent_cache"]["hits"] += 1
+        return (
+            rename_globals(marshal.loads(entry.code), renames),
+            entry.create_guards(),
+            cleanups,
+            dict(entry.dynamic_dims),
+        )
+    counters["persistent_cache"]["misses"] += 1
+    return None
@@ -1,16 +1,19 @@
-import copy
 import dataclasses
 import sys
+import threading
 import types
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Tuple
 
 from .bytecode_transformation import Instruction
+from .bytecode_transformation import cleaned_instructions
 from .bytecode_transformation import create_instruction
 from .bytecode_transformation import transform_code_object
 from .codegen import PyCodegen
 from .utils import ExactWeakKeyDictionary
+from .utils import counters
 
 # taken from code.h in cpython
 CO_OPTIMIZED = 0x0001
@@ -91,21 +94,29 @@ class ReenterWith:
 @dataclasses.dataclass
 class ResumeFunctionMetadata:
     code: types.CodeType
-    instructions: List[Instruction] = None
+    # (opcode, offset) of the instructions of code, which the generated
+    # code ends with
+    template: Tuple[Tuple[int, int], ...] = ()
 
 
 class ContinueExecutionCache:
     cache = ExactWeakKeyDictionary()
     generated_code_metadata = ExactWeakKeyDictionary()
+    # frames are converted on several threads at once
+    lock = threading.RLock()
 
     @classmethod
     def lookup(cls, code, *key):
-        if code not in cls.cache:
-            cls.cache[code] = dict()
-        key = tuple(key)
-        if key not in cls.cache[code]:
-            cls.cache[code][key] = cls.generate(code, *key)
-        return cls.cache[code][key]
+        with cls.lock:
+            if code not in cls.cache:
+                cls.cache[code] = dict()
+            key = tuple(key)
+            if key not in cls.cache[code]:
+                counters["resume_fns"]["generated"] += 1
+                cls.cache[code][key] = cls.generate(code, *key)
+            else:
+                counters["resume_fns"]["reused"] += 1
+            return cls.cache[code][key]
 
     @classmethod
     def generate(
@@ -130,7 +141,7 @@ class ContinueExecutionCache:
         meta = ResumeFunctionMetadata(code)
 
         def update(instructions: List[Instruction], code_options: Dict[str, Any]):
-            meta.instructions = copy.deepcopy(instructions)
+            meta.template = tuple((inst.opcode, inst.offset) for inst in instructions)
 
             args = [f"___stack{i}" for i in range(nstack)]
             args.extend(v for v in argnames if v not in args)
@@ -198,23 +209,15 @@ class ContinueExecutionCache:
         meta: ResumeFunctionMetadata = ContinueExecutionCache.generated_code_metadata[
             code
         ]
-        new_offset = None
-
-        def find_new_offset(
-            instructions: List[Instruction], code_options: Dict[str, Any]
-        ):
-            nonlocal new_offset
-            (target,) = [i for i in instructions if i.offset == offset]
-            # match the functions starting at the last instruction as we have added a prefix
-            (new_target,) = [
-                i2
-                for i1, i2 in zip(reversed(instructions), reversed(meta.instructions))
-                if i1 is target
-            ]
-            assert target.opcode == new_target.opcode
-            new_offset = new_target.offset
-
-        transform_code_object(code, find_new_offset)
+        instructions = cleaned_instructions(code)
+        (target,) = [i for i in instructions if i.offset == offset]
+        # match the functions starting at the last instruction as we have added a prefix
+        ((new_opcode, new_offset),) = [
+            entry
+            for inst, entry in zip(reversed(instructions), reversed(meta.template))
+            if inst is target
+        ]
+        assert target.opcode == new_opcode
         return ContinueExecutionCache.lookup(meta.code, new_offset, *args)
 
 
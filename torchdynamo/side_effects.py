@@ -72,6 +72,33 @@ class SideEffects(object):
         self.id_to_variable = id_to_variable or collections.OrderedDict()
         self.store_attr_mutations = store_attr_mutations or collections.OrderedDict()
         self.keepalive = keepalive or []
+        # containers are also referenced by a checkpoint, see checkpoint()
+        self.shared = False
+        # bumped on every change, see inline_cache.py
+        self.version = 0
+
+    def checkpoint(self):
+        """
+        O(1) snapshot for OutputGraph.copy_graphstate().  The containers
+        are shared until either copy writes to them.
+        """
+        snapshot = self.__class__(
+            id_to_variable=self.id_to_variable,
+            store_attr_mutations=self.store_attr_mutations,
+            keepalive=self.keepalive,
+        )
+        snapshot.shared = self.shared = True
+        return snapshot
+
+    def copy_on_write(self):
+        """Called before every write to the containers"""
+        self.version += 1
+        if self.shared:
+            cloned = self.clone()
+            self.id_to_variable = cloned.id_to_variable
+            self.store_attr_mutations = cloned.store_attr_mutations
+            self.keepalive = cloned.keepalive
+            self.shared = False
 
     def clone(self):
         """Create a shallow copy"""
@@ -85,13 +112,25 @@ class SideEffects(object):
         )
 
     def apply(self, fn):
-        self.id_to_variable = collections.OrderedDict(
+        id_to_variable = collections.OrderedDict(
             (k, VariableTracker.apply(fn, v)) for k, v in self.id_to_variable.items()
         )
-        self.store_attr_mutations = collections.OrderedDict(
+        store_attr_mutations = collections.OrderedDict(
             (k, VariableTracker.apply(fn, v))
             for k, v in self.store_attr_mutations.items()
         )
+        if any(
+            a is not b
+            for a, b in zip(id_to_variable.values(), self.id_to_variable.values())
+        ) or any(
+            a is not b
+            for a, b in zip(
+                store_attr_mutations.values(), self.store_attr_mutations.values()
+            )
+        ):
+            self.version += 1
+        self.id_to_variable = id_to_variable
+        self.store_attr_mutations = store_attr_mutations
 
     def __contains__(self, item):
         return id(item) in self.id_to_variable
@@ -101,6 +140,7 @@ class SideEffects(object):
 
     def store_attr(self, item: VariableTracker, name: str, value: VariableTracker):
         assert self.is_attribute_mutation(item)
+        self.copy_on_write()
         if item.mutable_local not in self.store_attr_mutations:
             self.store_attr_mutations[item.mutable_local] = collections.OrderedDict()
         self.store_attr_mutations[item.mutable_local][name] = value
@@ -144,6 +184,7 @@ class SideEffects(object):
     ):
         """Start tracking a new variable for mutation"""
         variable = variable.clone(mutable_local=mutable_cls(source), source=source)
+        self.copy_on_write()
         self.id_to_variable[id(item)] = variable
         self.keepalive.append(item)
         return variable
@@ -172,6 +213,7 @@ class SideEffects(object):
         variable = variable_cls(
             obj, mutable_local=AttributeMutationNew(None, cls_source), **options
         )
+        self.copy_on_write()
         self.id_to_variable[id(obj)] = variable
         self.keepalive.append(obj)
         return variable
@@ -183,6 +225,7 @@ class SideEffects(object):
         variable = variables.NewCellVariable(
             mutable_local=AttributeMutationNew(None, None),
         )
+        self.copy_on_write()
         self.id_to_variable[id(obj)] = variable
         self.keepalive.append(obj)
         return variable
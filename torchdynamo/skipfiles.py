@@ -80,9 +80,44 @@ SKIP_DIRS = [
     )
 ]
 SKIP_DIRS_RE = None  # set in add() below
-FILENAME_ALLOWLIST = {
-    torch.nn.Sequential.__init__.__code__.co_filename,
-}
+
+
+def _clears_cache(method):
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        result = method(self, *args)
+        clear_cache()
+        return result
+
+    return wrapper
+
+
+class FilenameAllowlist(set):
+    """Files traced even inside SKIP_DIRS, changes drop cached check() results"""
+
+
+for _name in (
+    "__iand__",
+    "__ior__",
+    "__isub__",
+    "__ixor__",
+    "add",
+    "clear",
+    "difference_update",
+    "discard",
+    "intersection_update",
+    "pop",
+    "remove",
+    "symmetric_difference_update",
+    "update",
+):
+    setattr(FilenameAllowlist, _name, _clears_cache(getattr(set, _name)))
+
+FILENAME_ALLOWLIST = FilenameAllowlist(
+    {
+        torch.nn.Sequential.__init__.__code__.co_filename,
+    }
+)
 
 
 def add(module: types.ModuleType):
@@ -93,10 +128,25 @@ def add(module: types.ModuleType):
         return
     SKIP_DIRS.append(_module_dir(module))
     SKIP_DIRS_RE = re.compile(f"^({'|'.join(map(re.escape, SKIP_DIRS))})")
+    clear_cache()
+
+
+def add_allowlist(filename: str):
+    FILENAME_ALLOWLIST.add(filename)
+
+
+def clear_cache():
+    """Forget the results of check() and the files skipped in C"""
+    # the C extension has no python dependencies, unlike eval_frame.py
+    from ._eval_frame import clear_skip_filenames
+
+    check.cache_clear()
+    clear_skip_filenames()
 
 
+@functools.lru_cache(None)
 def check(filename, allow_torch=False):
-    """Should skip this file?"""
+    """Should skip this file?  Cached per filename, see add()"""
     if filename is None:
         return True
     if filename in FILENAME_ALLOWLIST:
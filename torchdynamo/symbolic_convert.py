@@ -25,16 +25,18 @@ from torchdynamo.source import LocalSource
 from torchdynamo.variables.builder import VariableBuilder
 
 from . import config
+from . import inline_cache
 from . import skipfiles
 from .allowed_functions import is_allowed
 from .allowed_functions import is_builtin
-from .bytecode_analysis import livevars_analysis
+from .bytecode_analysis import cached_livevars
 from .bytecode_transformation import Instruction
 from .bytecode_transformation import cleaned_instructions
 from .bytecode_transformation import create_instruction
 from .bytecode_transformation import is_generator
 from .bytecode_transformation import unique_id
 from .codegen import PyCodegen
+from .compile_profiler import profiled
 from .exc import RestartAnalysis
 from .exc import TorchRuntimeError
 from .exc import Unsupported
@@ -160,7 +162,29 @@ def break_graph_if_unsupported(*, push):
     return decorator
 
 
+def missing_opcode(opname: str):
+    def handler(self: "InstructionTranslatorBase", inst: Instruction):
+        unimplemented(f"missing: {opname}")
+
+    return handler
+
+
 class InstructionTranslatorBase(object):
+    # dis.opname index => handler, see create_dispatch_table()
+    dispatch_table: List[typing.Callable] = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch_table = cls.create_dispatch_table()
+
+    @classmethod
+    def create_dispatch_table(cls):
+        """Resolve the handler for every opcode once per class"""
+        return [
+            getattr(cls, opname, None) or missing_opcode(opname)
+            for opname in dis.opname
+        ]
+
     def cell_and_freevars(self):
         if not hasattr(self, "_cell_and_freevars"):
             self._cell_and_freevars = tuple(
@@ -168,8 +192,14 @@ class InstructionTranslatorBase(object):
             ) + tuple(self.code_options["co_freevars"] or [])
         return self._cell_and_freevars
 
+    def livevars(self, inst):
+        """Variables that may be read at or after inst, see cached_livevars()"""
+        if self._livevars is None:
+            self._livevars = cached_livevars(self.f_code, self.instructions)
+        return self._livevars[self.indexof[id(inst)]]
+
     def prune_dead_locals(self):
-        reads = livevars_analysis(self.instructions, self.current_instruction)
+        reads = self.livevars(self.current_instruction)
         # implicit use by super()
         # reads = reads | {"__class__"}
         # output variables?
@@ -251,9 +281,7 @@ class InstructionTranslatorBase(object):
             print("TRACE", inst.opname, inst.argval, self.stack)
 
         try:
-            if not hasattr(self, inst.opname):
-                unimplemented(f"missing: {inst.opname}")
-            getattr(self, inst.opname)(inst)
+            self.dispatch_table[inst.opcode](self, inst)
             return inst.opname != "RETURN_VALUE"
         except Unsupported as exc:
             exc.real_stack.append(self.frame_summary())
@@ -270,6 +298,7 @@ class InstructionTranslatorBase(object):
             + self.instructions
         )
 
+    @profiled("run")
     def run(self):
         try:
             while (
@@ -1013,7 +1042,10 @@ class InstructionTranslatorBase(object):
     INPLACE_OR = stack_op(operator.ior)
 
     def copy_graphstate(self):
-        """Create a checkpoint of the current state by copying everything"""
+        """
+        Create a checkpoint of the current state.  Only the locals/stack of
+        this frame are copied, see OutputGraph.copy_graphstate()
+        """
         return (
             self.output.copy_graphstate(),
             collections.OrderedDict(self.symbolic_locals),
@@ -1076,6 +1108,7 @@ class InstructionTranslatorBase(object):
         self.f_builtins: Dict[str, Any] = f_builtins
         self.code_options: Dict[str, Any] = code_options
         self.f_code: types.CodeType = f_code
+        self._livevars: typing.Optional[List[frozenset]] = None
 
         self.checkpoint = None
 
@@ -1091,6 +1124,11 @@ class InstructionTranslatorBase(object):
                 self.push(BuiltinVariable(None))
 
 
+InstructionTranslatorBase.dispatch_table = (
+    InstructionTranslatorBase.create_dispatch_table()
+)
+
+
 class InstructionTranslator(InstructionTranslatorBase):
     def __init__(
         self,
@@ -1150,11 +1188,14 @@ class InstructionTranslator(InstructionTranslatorBase):
         if inst.opname == "RETURN_VALUE":
             return [create_instruction("RETURN_VALUE")]
 
-        reads = livevars_analysis(self.instructions, inst)
+        reads = self.livevars(inst)
+        # sorted so every path reaching inst shares one resume function
         argnames = tuple(
-            k
-            for k in self.symbolic_locals.keys()
-            if k in reads and k not in self.cell_and_freevars()
+            sorted(
+                k
+                for k in self.symbolic_locals.keys()
+                if k in reads and k not in self.cell_and_freevars()
+            )
         )
         nargs = len(self.stack) + len(argnames)
 
@@ -1204,6 +1245,7 @@ class InliningInstructionTranslator(InstructionTranslatorBase):
             return cls.inline_call_(parent, func, args, kwargs)
 
     @staticmethod
+    @profiled("inline_call")
     def inline_call_(parent, func, args, kwargs):
         assert isinstance(func, (UserFunctionVariable, NestedUserFunctionVariable))
         if func.has_self():
@@ -1228,17 +1270,25 @@ class InliningInstructionTranslator(InstructionTranslatorBase):
         code: types.CodeType = func.get_code()
         if code.co_name in ("__setitem__", "__setattr__"):
             unimplemented(f"inline {code.co_name}")
+        parent.output.inlined_functions.setdefault(code, getattr(func, "fn", None))
 
         if config.trace:
             print("INLINING ", code)
             dis.dis(code)
             print()
 
+        cache_call = None
         if is_generator(code):
             tracer = InliningGeneratorInstructionTranslator(
                 parent, code, sub_locals, closure_cells, func
             )
         else:
+            cache_call = inline_cache.inline_call(func, sub_locals, closure_cells)
+            if cache_call is not None:
+                result = inline_cache.lookup(parent.output, func, cache_call)
+                if result is not None:
+                    return result
+                cache_state = inline_cache.checkpoint(parent.output)
             tracer = InliningInstructionTranslator(
                 parent, code, sub_locals, closure_cells, func
             )
@@ -1246,6 +1296,10 @@ class InliningInstructionTranslator(InstructionTranslatorBase):
         tracer.run()
         assert tracer.symbolic_result is not None
         func.export_freevars(parent, tracer)
+        if cache_call is not None:
+            inline_cache.record(
+                parent.output, func, cache_call, cache_state, tracer.symbolic_result
+            )
 
         if config.trace:
             print("DONE INLINING", code)
@@ -153,6 +153,9 @@ def debug_insert_nops(frame, cache_size):
 
 
 class CompileCounter:
+    # returns gm.forward, see config.ranged_shapes
+    shape_polymorphic = True
+
     def __init__(self):
         self.frame_count = 0
         self.op_count = 0
@@ -224,6 +227,9 @@ def dummy_fx_compile(gm: fx.GraphModule, example_inputs):
     return gm.forward
 
 
+dummy_fx_compile.shape_polymorphic = True
+
+
 def format_speedup(speedup, pvalue, is_correct=True, pvalue_threshold=0.1):
     if not is_correct:
         return "ERROR"
@@ -1,4 +1,5 @@
 import collections
+import contextlib
 import dataclasses
 import functools
 import gc
@@ -7,12 +8,14 @@ import itertools
 import logging
 import operator
 import re
+import threading
 import time
 import types
 import weakref
 from functools import lru_cache
 from typing import Any
 from typing import Dict
+from typing import Optional
 
 import torch
 from torch import fx
@@ -20,7 +23,21 @@ from torch import fx
 from . import config
 
 log = logging.getLogger(__name__)
-counters = collections.defaultdict(collections.Counter)
+
+
+class CounterDict(collections.defaultdict):
+    """defaultdict(Counter) where threads never replace each other's Counter"""
+
+    def __init__(self):
+        super().__init__(collections.Counter)
+
+    def __missing__(self, key):
+        # dict.setdefault() is atomic, unlike defaultdict.__missing__()
+        return self.setdefault(key, collections.Counter())
+
+
+# statistics, increments from threads converting at once may race
+counters = CounterDict()
 
 
 def count_calls(g: fx.Graph):
@@ -123,24 +140,34 @@ class CleanupHook:
     name: str
 
     def __call__(self, *args):
-        CleanupManager.count -= 1
+        with CleanupManager.lock:
+            CleanupManager.count -= 1
         del self.scope[self.name]
 
     @staticmethod
     def create(scope, name, val):
         assert name not in scope
-        CleanupManager.count += 1
+        with CleanupManager.lock:
+            CleanupManager.count += 1
         scope[name] = val
         return CleanupHook(scope, name)
 
 
 class CleanupManager(ExactWeakKeyDictionary):
     count = 0
+    # frames are converted, and their code freed, on several threads
+    lock = threading.RLock()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
 
     def _remove_id(self, idx):
-        for hook in self.values[idx]:
+        with self.lock:
+            hooks = self.values.get(idx, ())
+            super()._remove_id(idx)
+        for hook in hooks:
             hook()
-        super()._remove_id(idx)
 
 
 CleanupManager.instance = CleanupManager()
@@ -154,6 +181,40 @@ def clone_tensor(x):
     return y
 
 
+def is_meta_convertible(x):
+    """Dense tensors of plain types that to_meta() can represent"""
+    return (
+        type(x) in (torch.Tensor, torch.nn.Parameter)
+        and x.layout == torch.strided
+        and not x.is_quantized
+    )
+
+
+def fake_device(x: torch.Tensor):
+    """The device a tensor created by to_meta() stands in for"""
+    return getattr(x, "_torchdynamo_device", x.device)
+
+
+def to_meta(x: torch.Tensor, device=None):
+    """
+    A tensor on the meta device with the size, stride, dtype and
+    requires_grad of x, but no storage.  The original device is kept in
+    fake_device().  Tensors that can't be represented are cloned instead.
+    """
+    if x.device.type == "meta" and device is None:
+        return x
+    if not is_meta_convertible(x):
+        return clone_tensor(x)
+    with torch.no_grad():
+        y = torch.empty_strided(x.size(), x.stride(), dtype=x.dtype, device="meta")
+    if isinstance(x, torch.nn.Parameter):
+        y = torch.nn.Parameter(y, requires_grad=x.requires_grad)
+    else:
+        y.requires_grad_(x.requires_grad)
+    y._torchdynamo_device = fake_device(x) if device is None else device
+    return y
+
+
 def clone_input(x):
     """copy while preserving strides"""
     with torch.no_grad():
@@ -285,6 +346,89 @@ def checkpoint_params(gm):
     return restore
 
 
+class LazyRngState:
+    """
+    Torch CPU/CUDA RNG state that is only cloned on the first save(), so
+    that frame conversions which never run an op don't pay for it.
+
+    The RNG is process-wide, so conversions running on several threads at
+    once share one snapshot: the first save() clones it and the last
+    restore() puts it back, leaving the RNG as it was before any of them.
+    """
+
+    local = threading.local()
+    lock = threading.Lock()
+    # number of saved LazyRngStates and the (cpu, cuda) state they restore
+    users = 0
+    snapshot = None
+
+    def __init__(self):
+        self.saved = False
+
+    @classmethod
+    def current(cls) -> Optional["LazyRngState"]:
+        """The state of the frame conversion in progress on this thread"""
+        return getattr(cls.local, "current", None)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Make this current() and restore the RNG state on exit"""
+        prior = self.current()
+        self.local.current = self
+        try:
+            yield self
+        finally:
+            self.local.current = prior
+            self.restore()
+
+    def save(self):
+        if self.saved:
+            return
+        cls = LazyRngState
+        with cls.lock:
+            if cls.users == 0:
+                cuda_rng_state = None
+                if torch.cuda.is_available():
+                    cuda_rng_state = torch.clone(torch.cuda.get_rng_state())
+                cls.snapshot = (
+                    torch.clone(torch.random.get_rng_state()),
+                    cuda_rng_state,
+                )
+            cls.users += 1
+        self.saved = True
+
+    def restore(self):
+        if not self.saved:
+            return
+        self.saved = False
+        cls = LazyRngState
+        with cls.lock:
+            cls.users -= 1
+            if cls.users == 0:
+                rng_state, cuda_rng_state = cls.snapshot
+                cls.snapshot = None
+                torch.random.set_rng_state(rng_state)
+                if cuda_rng_state is not None:
+                    torch.cuda.set_rng_state(cuda_rng_state)
+
+
+@contextlib.contextmanager
+def preserve_rng_state():
+    """Undo changes to the RNG state made by running ops inside this"""
+    lazy = LazyRngState.current()
+    if lazy is not None:
+        # put back once when the frame conversion finishes
+        lazy.save()
+        yield
+        return
+    lazy = LazyRngState()
+    lazy.save()
+    try:
+        yield
+    finally:
+        lazy.restore()
+
+
 def timed(model, example_inputs, times=1):
     if torch.cuda.is_available():
         synchronize = torch.cuda.synchronize
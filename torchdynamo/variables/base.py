@@ -1,4 +1,5 @@
 import collections
+import operator
 from typing import Any
 from typing import Callable
 from typing import Dict
@@ -11,10 +12,11 @@ from ..exc import unimplemented
 from ..source import AttrSource
 from ..source import Source
 from ..utils import dict_values
-from ..utils import identity
 from ..utils import istype
 from ..utils import odict_values
 
+EMPTY_GUARDS = frozenset()
+
 
 class MutableLocal:
     """
@@ -44,7 +46,8 @@ class VariableTracker:
     @staticmethod
     def propagate(*vars: List[List["VariableTracker"]]):
         """Combine the guards from many VariableTracker into **kwargs for a new instance"""
-        guards = set()
+        # distinct guard sets, usually just one that can be shared as-is
+        guard_sets = []
 
         def visit(var):
             if type(var) in (list, tuple, dict_values, odict_values):
@@ -52,9 +55,14 @@ class VariableTracker:
                     visit(i)
             else:
                 assert isinstance(var, VariableTracker), typestr(var)
-                guards.update(var.guards)
+                if var.guards and not any(var.guards is g for g in guard_sets):
+                    guard_sets.append(var.guards)
 
         visit(vars)
+        if len(guard_sets) <= 1:
+            guards = guard_sets[0] if guard_sets else EMPTY_GUARDS
+        else:
+            guards = EMPTY_GUARDS.union(*guard_sets)
         return {
             "guards": guards,
         }
@@ -65,11 +73,6 @@ class VariableTracker:
         args.update(kwargs)
         return self.__class__(**args)
 
-    @classmethod
-    def copy(cls, value):
-        """Deeper (but not full) copy, leaving FX and user objects alone"""
-        return cls.apply(identity, value)
-
     @classmethod
     def apply(
         cls, fn: Callable[["VariableTracker"], "VariableTracker"], value, cache=None
@@ -77,6 +80,8 @@ class VariableTracker:
         """
         Walk this object and call fn on all the VariableTracker
         instances to produce a new VariableTracker with the results.
+        Parts of `value` that fn leaves unchanged are returned as-is
+        rather than copied.
         """
         if cache is None:
             cache = dict()
@@ -86,21 +91,30 @@ class VariableTracker:
             return cache[idx][0]
 
         if isinstance(value, VariableTracker):
-            updated_dict = dict(value.__dict__)
-            for key in updated_dict.keys():
+            updated_dict = None
+            for key, field in value.__dict__.items():
                 if key not in value._nonvar_fields:
-                    updated_dict[key] = cls.apply(fn, updated_dict[key], cache)
-            result = fn(value.clone(**updated_dict))
-        elif istype(value, list):
-            result = [cls.apply(fn, v, cache) for v in value]
-        elif istype(value, tuple):
-            result = tuple(cls.apply(fn, v, cache) for v in value)
-        elif istype(value, collections.OrderedDict):
-            result = collections.OrderedDict(
-                cls.apply(fn, v, cache) for v in value.items()
-            )
-        elif istype(value, dict):
-            result = {k: cls.apply(fn, v, cache) for k, v in value.items()}
+                    updated = cls.apply(fn, field, cache)
+                    if updated is not field:
+                        if updated_dict is None:
+                            updated_dict = dict(value.__dict__)
+                        updated_dict[key] = updated
+            if updated_dict is not None:
+                result = fn(value.clone(**updated_dict))
+            else:
+                result = fn(value)
+        elif istype(value, (list, tuple)):
+            items = [cls.apply(fn, v, cache) for v in value]
+            if all(map(operator.is_, items, value)):
+                result = value
+            else:
+                result = type(value)(items)
+        elif istype(value, (dict, collections.OrderedDict)):
+            items = [(k, cls.apply(fn, v, cache)) for k, v in value.items()]
+            if all(new is old for (_, new), old in zip(items, value.values())):
+                result = value
+            else:
+                result = type(value)(items)
         else:
             result = value
 
@@ -109,11 +123,15 @@ class VariableTracker:
         return result
 
     def add_guard(self, guard):
-        return self.clone(guards=set.union(self.guards, {guard}))
+        if guard in self.guards:
+            return self
+        return self.clone(guards=self.guards | {guard})
 
     def add_guards(self, guards):
-        assert isinstance(guards, set)
-        return self.clone(guards=set.union(self.guards, guards))
+        assert isinstance(guards, (set, frozenset))
+        if guards <= self.guards:
+            return self
+        return self.clone(guards=self.guards | guards)
 
     def add_options(self, options, *more):
         if more:
@@ -239,7 +257,11 @@ class VariableTracker:
         mutable_local: MutableLocal = None,
     ):
         super(VariableTracker, self).__init__()
-        self.guards = guards or set()
+        # frozen so that trackers can share guard sets by reference
+        if istype(guards, frozenset):
+            self.guards = guards
+        else:
+            self.guards = frozenset(guards or ())
         self.source = source
         self.mutable_local = mutable_local
 
@@ -315,6 +315,9 @@ class VariableBuilder:
                     example_value=value,
                     guards=self.make_guards(GuardBuilder.TENSOR_MATCH),
                 )
+            self.tx.output.record_dynamic_dims(
+                self.name, TensorVariable.dynamic_dims(value)
+            )
             if torch.overrides.has_torch_function_unary(value):
                 subclass_torch_function__func = value.__torch_function__.__func__
                 subclass_type = type(value)
@@ -427,7 +427,7 @@ class BuiltinVariable(VariableTracker):
 
         if default is not None:
             hasattr_var = self.call_hasattr(tx, obj, name_var)
-            guards.update(hasattr_var.guards)
+            guards = options["guards"] = guards | hasattr_var.guards
             assert hasattr_var.as_python_constant() in (True, False)
             if not hasattr_var.as_python_constant():
                 return default.add_guards(guards)
@@ -442,7 +442,11 @@ class BuiltinVariable(VariableTracker):
             return obj.var_getattr(tx, name).add_options(options)
         elif isinstance(obj, variables.TensorVariable) and name == "grad":
             if source:
-                example_value = obj.proxy.node.meta["example_value"].grad
+                node_meta = obj.proxy.node.meta
+                # under config.meta_propagation example_value has no grad
+                example_value = node_meta.get(
+                    "real_value", node_meta["example_value"]
+                ).grad
                 return VariableBuilder(tx, source)(example_value).add_options(options)
             else:
                 unimplemented("tensor grad")
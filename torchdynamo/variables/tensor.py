@@ -1,41 +1,32 @@
 import copy
 import itertools
 import operator
-from contextlib import contextmanager
 from typing import Dict
 from typing import List
 
 import torch.fx
-import torch.random
 from torch.fx.immutable_collections import immutable_list
 
 from .. import config
 from .. import variables
+from ..compile_profiler import profiled
 from ..exc import TorchRuntimeError
 from ..exc import unimplemented
+from ..exc import warning
 from ..utils import clone_tensor
+from ..utils import counters
+from ..utils import fake_device
 from ..utils import istype
+from ..utils import preserve_rng_state
 from ..utils import product
 from ..utils import proxy_args_kwargs
+from ..utils import to_meta
 from .base import MutableLocal
 from .base import VariableTracker
 from .base import typestr
 from .lists import SizeVariable
 
 
-@contextmanager
-def preserve_rng_state():
-    rng = torch.clone(torch.random.get_rng_state())
-    if torch.cuda.is_available():
-        cuda_rng = torch.clone(torch.cuda.get_rng_state())
-    try:
-        yield
-    finally:
-        torch.random.set_rng_state(rng)
-        if torch.cuda.is_available():
-            torch.cuda.set_rng_state(cuda_rng)
-
-
 class TensorVariable(VariableTracker):
     """A torch.Tensor input or an intermediate value in the FX graph"""
 
@@ -59,7 +50,164 @@ class TensorVariable(VariableTracker):
 
         return torch.fx.node.map_arg((node.args, node.kwargs), visit)
 
+    @staticmethod
+    def run_node(node, args, kwargs, nnmodule):
+        op = node.op
+        if op not in ["call_function", "call_method", "call_module"]:
+            assert False, op
+        try:
+            if op == "call_function":
+                return node.target(*args, **kwargs)
+            elif op == "call_method":
+                return getattr(args[0], node.target)(*args[1:], **kwargs)
+            elif op == "call_module":
+                assert nnmodule is not None
+                return nnmodule(*args, **kwargs)
+        except RuntimeError:
+            # Track the assertion when the pytorch execution raises
+            # assertion
+            raise TorchRuntimeError
+
+    @classmethod
+    def run_node_example(cls, node, args, kwargs, nnmodule):
+        """
+        Run node on example values, calling nnmodule directly when it can't
+        mutate its parameters or buffers and on a copy otherwise
+        """
+        from ..optimizations.analysis import check_state_versions
+        from ..optimizations.analysis import may_mutate_state
+        from ..optimizations.analysis import state_versions
+
+        if nnmodule is None:
+            return cls.run_node(node, args, kwargs, nnmodule)
+        if may_mutate_state(nnmodule):
+            counters["stats"]["nn_module_copies"] += 1
+            return cls.run_node(node, args, kwargs, copy.deepcopy(nnmodule))
+        versions = state_versions(nnmodule)
+        result = cls.run_node(node, args, kwargs, nnmodule)
+        if not check_state_versions(nnmodule, versions):
+            warning(f"{type(nnmodule).__name__} mutated its state during tracing")
+        return result
+
+    @staticmethod
+    def meta_args_kwargs(node, args, kwargs):
+        """
+        Redirect device arguments of node to the meta device, returning the
+        device the result is expected to have.
+        """
+        device = None
+        for arg in itertools.chain(args, kwargs.values()):
+            if isinstance(arg, torch.Tensor):
+                device = fake_device(arg)
+                break
+
+        def parse_device(value):
+            if isinstance(value, (str, torch.device)):
+                try:
+                    return torch.device(value)
+                except RuntimeError:
+                    pass
+            return None
+
+        if kwargs.get("device") is not None:
+            device = torch.device(kwargs["device"])
+            kwargs = dict(kwargs, device="meta")
+        if node.op == "call_method" and node.target == "cpu":
+            device = torch.device("cpu")
+        elif node.op == "call_method" and node.target == "cuda":
+            device = torch.device("cuda")
+            if len(args) > 1 and args[1] is not None:
+                device = parse_device(args[1]) or torch.device("cuda", args[1])
+        elif node.op == "call_method" and node.target == "to":
+            args = list(args)
+            for i in range(1, len(args)):
+                if parse_device(args[i]) is not None:
+                    device = parse_device(args[i])
+                    args[i] = "meta"
+                elif isinstance(args[i], torch.Tensor):
+                    device = fake_device(args[i])
+        if device is not None and device.type == "cuda" and device.index is None:
+            device = torch.device("cuda", torch.cuda.current_device())
+        return tuple(args), kwargs, device or torch.device("cpu")
+
+    @classmethod
+    def compute_example_value(cls, tx, node, nnmodule):
+        """Run node on the example values of its inputs"""
+        if config.meta_propagation:
+            return cls.propagate_meta(tx, node, nnmodule)
+        args, kwargs = cls.propagate_args_kwargs(node)
+        with preserve_rng_state():
+            return cls.run_node_example(node, args, kwargs, nnmodule)
+
+    @staticmethod
+    def stored_example_value(value):
+        """What to keep in node.meta["example_value"] for a tensor value"""
+        if config.meta_propagation:
+            return to_meta(value)
+        return clone_tensor(value)
+
     @classmethod
+    def propagate_meta(cls, tx, node, nnmodule):
+        """
+        Compute the example value of node from the meta tensors of its inputs
+        without allocating storage or copying nnmodule.  Ops that have no
+        meta kernel fall back to fallback_value().
+        """
+        args, kwargs = cls.propagate_args_kwargs(node)
+        args, kwargs, device = cls.meta_args_kwargs(node, args, kwargs)
+        try:
+            if node.op == "call_method" and node.target in ("cpu", "cuda"):
+                result = torch.empty_like(args[0])
+                result.requires_grad_(args[0].requires_grad)
+            else:
+                if node.op == "call_module":
+                    nnmodule = tx.output.meta_module(node.target, nnmodule)
+                result = cls.run_node(node, args, kwargs, nnmodule)
+            counters["meta_propagation"]["ok"] += 1
+        except (TorchRuntimeError, NotImplementedError):
+            counters["meta_propagation"]["fallback"] += 1
+            # converted by to_meta() in create()
+            return cls.fallback_value(tx, node)
+        for value in result if isinstance(result, (tuple, list)) else [result]:
+            if isinstance(value, torch.Tensor) and value.device.type == "meta":
+                value._torchdynamo_device = device
+        return result
+
+    @classmethod
+    def fallback_value(cls, tx, node):
+        """
+        Run the graph up to node on copies of the real inputs.  Results of
+        ops without a meta kernel may depend on the data (nonzero(),
+        x[x > 0], ...), so zero filled inputs won't do.  Every earlier node
+        runs, not just the inputs of node, to see the effect of in-place
+        ops.  Values stay in meta["fallback_value"] until the graph is
+        compiled, so each node runs at most once.
+        """
+        for other in tx.output.graph.nodes:
+            if "fallback_value" in other.meta:
+                pass
+            elif other.op in ("placeholder", "get_attr"):
+                value = other.meta.get("real_value", other.meta.get("example_value"))
+                if isinstance(value, torch.Tensor):
+                    value = clone_tensor(value)
+                other.meta["fallback_value"] = value
+            else:
+                args, kwargs = torch.fx.node.map_arg(
+                    (other.args, other.kwargs), lambda n: n.meta["fallback_value"]
+                )
+                nnmodule = None
+                if other.op == "call_module":
+                    nnmodule = tx.output.nn_modules[other.target]
+                with preserve_rng_state():
+                    other.meta["fallback_value"] = cls.run_node_example(
+                        other, args, kwargs, nnmodule
+                    )
+            if other is node:
+                return other.meta["fallback_value"]
+        raise AssertionError(f"{node} is not in the graph")
+
+    @classmethod
+    @profiled("TensorVariable.create")
     def create(cls, tx, proxy, example_value=None, nnmodule=None, **options):
         if "guards" in options:
             tx.output.guards.update(options["guards"])
@@ -69,29 +217,14 @@ class TensorVariable(VariableTracker):
                 options.update(TensorVariable.specialize(example_value))
             return TensorVariable(proxy, **options)
 
-        with preserve_rng_state():
-            if example_value is None:
-                op = proxy.node.op
-                args, kwargs = cls.propagate_args_kwargs(proxy.node)
-                if op not in ["call_function", "call_method", "call_module"]:
-                    assert False, op
-                try:
-                    if op == "call_function":
-                        example_value = proxy.node.target(*args, **kwargs)
-                    elif op == "call_method":
-                        example_value = getattr(args[0], proxy.node.target)(
-                            *args[1:], **kwargs
-                        )
-                    elif op == "call_module":
-                        assert nnmodule is not None
-                        example_value = copy.deepcopy(nnmodule)(*args, **kwargs)
-                except RuntimeError:
-                    # Track the assertion when the pytorch execution raises
-                    # assertion
-                    raise TorchRuntimeError
+        if example_value is None:
+            example_value = cls.compute_example_value(tx, proxy.node, nnmodule)
 
         if isinstance(example_value, torch.Tensor):
-            proxy.node.meta["example_value"] = clone_tensor(example_value)
+            if config.meta_propagation and proxy.node.op in ("placeholder", "get_attr"):
+                # an input, kept for reading attributes like .grad
+                proxy.node.meta["real_value"] = example_value
+            proxy.node.meta["example_value"] = cls.stored_example_value(example_value)
             options.update(TensorVariable.specialize(example_value))
             return TensorVariable(proxy, **options)
         elif (
@@ -199,7 +332,7 @@ class TensorVariable(VariableTracker):
     def specialize(value: torch.Tensor):
         props = {
             "dtype": value.dtype,
-            "device": value.device,
+            "device": fake_device(value),
             "ndim": int(value.ndim),
             "requires_grad": value.requires_grad,
             "is_quantized": value.is_quantized,
@@ -212,6 +345,20 @@ class TensorVariable(VariableTracker):
             props["is_contiguous"] = value.is_contiguous()
         return props
 
+    @staticmethod
+    def dynamic_dims(value: torch.Tensor):
+        """Dims of an input allowed to vary under config.ranged_shapes"""
+        if config.ranged_shapes is None or config.dynamic_shapes:
+            return ()
+        if not value.is_contiguous():
+            return ()
+        dims = set(config.ranged_shapes_dims)
+        dims.update(getattr(value, "_torchdynamo_dynamic_dims", ()))
+        # sizes 0 and 1 change broadcasting behavior so stay specialized
+        return tuple(
+            sorted(d for d in dims if 0 <= d < value.ndim and value.size(d) > 1)
+        )
+
     def var_getattr(self, tx, name):
         from . import ConstantVariable
         from . import TorchVariable
@@ -227,6 +374,7 @@ class TensorVariable(VariableTracker):
         elif name == "is_cuda" and self.device is not None:
             result = ConstantVariable(self.device.type == "cuda", **options)
         elif name == "shape" and self.size is not None:
+            tx.output.specialize_shapes()
             result = ConstantVariable(self.size, **options)
         elif name == "requires_grad" and self.requires_grad is not None:
             result = ConstantVariable(self.requires_grad, **options)
@@ -248,6 +396,7 @@ class TensorVariable(VariableTracker):
     def unpack_var_sequence(self, tx):
         options = VariableTracker.propagate(self)
         if self.size:
+            tx.output.specialize_shapes()
             return [
                 variables.BuiltinVariable(operator.getitem, **options).call_function(
                     tx, [self, variables.ConstantVariable(i)], {}
@@ -289,6 +438,8 @@ class TensorVariable(VariableTracker):
 
         if constant_result:
             assert not kwargs
+            if name in ("stride", "size", "numel"):
+                tx.output.specialize_shapes()
             if len(args) == 1:
                 return constant_result.getitem_const(args[0])
             elif args:
@@ -311,6 +462,7 @@ class TensorVariable(VariableTracker):
         elif name == "__len__":
             if self.size:
                 assert not config.dynamic_shapes
+                tx.output.specialize_shapes()
                 return ConstantVariable(self.size[0], **options)
             else:
                 return TensorVariable.create(
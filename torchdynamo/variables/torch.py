@@ -126,6 +126,7 @@ class TorchVariable(VariableTracker):
             and isinstance(args[0], TensorVariable)
             and args[0].size is not None
         ):
+            tx.output.specialize_shapes()
             return ConstantVariable(product(args[0].size), **options)
         elif self.value in (
             torch.nn.modules.utils._single,
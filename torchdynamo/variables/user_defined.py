@@ -279,9 +279,9 @@ class UserDefinedObjectVariable(UserDefinedVariable):
         if not self.source:
             unimplemented("hasattr no source")
         options = VariableTracker.propagate(self)
-        options["guards"].add(
+        options["guards"] = options["guards"] | {
             AttrSource(self.source, name).make_guard(GuardBuilder.HASATTR)
-        )
+        }
         if self._check_for_getattribute() or self._check_for_getattr():
             unimplemented("hasattr with custom __getattr__")
 